@@ -20,7 +20,7 @@ import Globals
 import Common.util as util
 
 import SenseControl, CommandControl
-import Xplane, SurfaceControl, AttitudeControl, FlightControl, AttitudeControlVTOL, GroundControl
+import Xplane, FlightSim, SurfaceControl, AttitudeControl, FlightControl, AttitudeControlVTOL, GroundControl
 import TakeoffControlVTOL, LandingControlVTOL, AttitudeVTOLEstimation
 import MiddleEngineTiltControl, VTOLYawControl, SolenoidControl, ThrottleControl
 import TakeoffControl, LandingControl
@@ -445,6 +445,12 @@ class Airplane(FileConfig.FileConfig):
         return ret
 
     def Update(self):
+        self._sensors.Poll()
+        ret = self._update()
+        self._servo_controller.Flush()
+        return ret
+
+    def _update(self):
         if self.has_crashed():
             logger.error("Airplane crashed")
             self._throttle_control.Set(0)
@@ -459,7 +465,8 @@ class Airplane(FileConfig.FileConfig):
                 logger.debug("Completed last timed directive")
                 self.GetNextDirective()
         elif self.CurrentFlightMode == Globals.FLIGHT_MODE_GROUND:
-            self._ground_control.Update()
+            if self._ground_control:
+                self._ground_control.Update()
         elif self.CurrentFlightMode == Globals.FLIGHT_MODE_LANDING:
             self._landing_control.Update()
         elif self.CurrentFlightMode == Globals.FLIGHT_MODE_TAKEOFF:
@@ -493,7 +500,8 @@ class Airplane(FileConfig.FileConfig):
         if self.CurrentFlightMode == Globals.FLIGHT_MODE_AIRBORN:
             self._flight_control.Start(last_desired_pitch)
         elif self.CurrentFlightMode == Globals.FLIGHT_MODE_GROUND:
-            self._ground_control.Start()
+            if self._ground_control:
+                self._ground_control.Start()
         elif self.CurrentFlightMode == Globals.FLIGHT_MODE_LANDING:
             self._landing_control.Start(last_desired_pitch)
         elif self.CurrentFlightMode == Globals.FLIGHT_MODE_TAKEOFF:
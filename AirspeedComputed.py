@@ -16,6 +16,7 @@
 import yaml
 
 import Common.util as util
+from Common.Curve import Curve
 
 from MicroServerComs import MicroServerComs
 
@@ -27,7 +28,7 @@ class AirspeedComputed(MicroServerComs):
         self.airspeed_computed = None
         self.ascurve = None
         if isinstance(airspeed_config,dict):
-            self.ascurve = airspeed_config['airspeed_pressure_curve']
+            self.ascurve = Curve.rate(airspeed_config['airspeed_pressure_curve'])
 
     def updated(self, channel):
         if self.ascurve is not None:
@@ -35,7 +36,7 @@ class AirspeedComputed(MicroServerComs):
                 # Only output if we have 2 valid pressures to compare
                 self.timestamp = self.pressuresensors_updated
                 pdiff = self.static_pressure - self.pitot_pressure
-                self.airspeed_computed = util.rate_curve (pdiff, self.ascurve)
+                self.airspeed_computed = self.ascurve (pdiff)
                 self.airspeed_computed = int(round(self.airspeed_computed))
                 self.publish ()
                 print ("AirspeedComputed: %d"%self.airspeed_computed)
@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 import Common.util as util
+from Common.Curve import Curve
 
 from MicroServerComs import MicroServerComs
 
@@ -29,15 +30,17 @@ class AltitudeComputed(MicroServerComs):
         self.sea_level_pressure = None
         self.temperature = None
         self.pressure_calibration = pressure_calibration
+        self._pressure_curve = None
+        if isinstance(pressure_calibration, dict):
+            self._pressure_curve = Curve.rate(pressure_calibration['pressure_calibration'])
         # TODO: publish confidence level based on recency and relevance of inputs
 
     def updated(self, channel):
         if channel == 'pressuresensors':
             self.timestamp = self.pressuresensors_updated
             if self.sea_level_pressure is not None and self.temperature is not None:
-                if isinstance(self.pressure_calibration,dict):
-                    self.static_pressure = util.rate_curve (self.static_pressure,
-                            self.pressure_calibration['pressure_calibration'])
+                if self._pressure_curve is not None:
+                    self.static_pressure = self._pressure_curve (self.static_pressure)
                 self.altitude_computed = ((pow(
                     self.sea_level_pressure / self.static_pressure, 1/PRESSURE_POWER)-1) *
                         (self.temperature + KELVIN_OFFSET)) / PRESSURE_DIVISOR
@@ -108,39 +108,37 @@ class ArduinoCmdMessenger:
     def read_command(self, timeout=1.0):
         starttime = time.time()
         while True:
-            recv = self.device.read()
-            try:
-                recv = recv.decode('utf-8')
-            except:
-                logger.debug ("cannot decode bytes: %s"%recv)
-                recv = None
-            if recv is not None:
+            cmd = self.buffered_command()
+            if cmd is None:
+                # Take everything the port has waiting in one read
+                recv = self.device.read(max(1, self.device.in_waiting))
                 if len(recv) > 0:
-                    self.receive_buffer += recv
-                    eoc = self.command_delim_found (self.receive_buffer)
-                    if eoc >= 0:
-                        cmd,args = self.parse_recv(self.receive_buffer[:eoc])
-                        self.receive_buffer = self.receive_buffer[eoc:]
-                        if cmd is not None:
-                            ts = time.time()
-                            logger.log (3, "%f,receive(%s): %s %s"%(ts, str(self.device.port), cmd, str(args)))
-                            return cmd,args,ts
+                    self.receive_buffer += recv.decode('utf-8', errors='ignore')
+                    cmd = self.buffered_command()
+            if cmd is not None:
+                return cmd
             if time.time() >= starttime + timeout:
                 break
         return None
 
+    def buffered_command(self):
+        eoc = self.command_delim_found (self.receive_buffer)
+        if eoc >= 0:
+            cmd,args = self.parse_recv(self.receive_buffer[:eoc])
+            self.receive_buffer = self.receive_buffer[eoc:]
+            if cmd is not None:
+                ts = time.time()
+                logger.log (3, "%f,receive(%s): %s %s"%(ts, str(self.device.port), cmd, str(args)))
+                return cmd,args,ts
+        return None
+
     def command_delim_found(self, recv):
-        potential_end = 0
-        while (potential_end < len(recv)):
-            if self.command_delim in recv[potential_end:]:
-                potential_end = recv[potential_end:].index(self.command_delim)
-                if potential_end > 0 and (recv[potential_end-1] != self.quote or
-                        (potential_end > 1 and recv[potential_end-2] == self.quote)):
-                    return potential_end + 1
-                else:
-                    potential_end += 1
-            else:
-                return -1
+        potential_end = recv.find(self.command_delim)
+        while potential_end >= 0:
+            if potential_end > 0 and (recv[potential_end-1] != self.quote or
+                    (potential_end > 1 and recv[potential_end-2] == self.quote)):
+                return potential_end + 1
+            potential_end = recv.find(self.command_delim, potential_end + 1)
         return -1
 
 
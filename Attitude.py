@@ -0,0 +1,205 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math
+
+import Globals
+import Common.util as util
+from MicroServerComs import MicroServerComs
+
+# Quaternion attitude filter (Mahony complementary filter), standing in for
+# the separate Pitch, Roll, PitchRate, RollRate, Yaw and TurnRate services.
+#
+# Sensor axes are those of the sense board: x right wing, y nose, z up.
+# The earth frame is x east, y north, z up. The quaternion rotates body
+# vectors into the earth frame.
+# Each gyro sample integrates the quaternion, corrected by the error between
+# the measured and the estimated up (accelerometers) and north (magnetic)
+# directions. The integral of that error tracks the gyro biases.
+class Attitude(MicroServerComs):
+    checkpoint_values = ['q', 'bias']
+    checkpoint_format = '4d3d'
+
+    def __init__(self, kp=0.5, ki=0.02, ground_kp=5.0, accel_factor=1.0, conf_mult=1.0):
+        MicroServerComs.__init__(self, "Attitude")
+        self.flight_mode = Globals.FLIGHT_MODE_GROUND
+        self.a_x = None
+        self.m_x = None
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.bias = [0.0, 0.0, 0.0]       # radians / s
+        self.last_time = None
+        self._up = None                    # Latest measured up direction, body frame
+        self._mag = None                   # Latest measured magnetic field direction, body frame
+        self._up_error = 0.0
+        self._mag_error = 0.0
+        self._warm_start = False
+
+        self.proportional_gain = kp
+        self.integral_gain = ki
+        # Trust the accelerometers much more when sitting still on the ground
+        self.ground_proportional_gain = ground_kp
+        self.accel_factor = accel_factor
+        self.confidence_multiplier = conf_mult
+
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.yaw = 0.0
+        self.pitch_rate = 0.0
+        self.roll_rate = 0.0
+        self.turn_rate = 0.0
+        self.pitch_confidence = 0.0
+        self.roll_confidence = 0.0
+        self.yaw_confidence = 0.0
+        self.pitch_rate_confidence = 0.0
+        self.roll_rate_confidence = 0.0
+        self.turn_rate_confidence = 0.0
+
+    def updated(self, channel):
+        if channel == 'rotationsensors':
+            if self.last_time is not None:
+                timediff = self.rotationsensors_updated - self.last_time
+                if timediff > 0:
+                    self.integrate(timediff)
+                    self.timestamp = self.rotationsensors_updated
+                    self.publish ()
+            self.last_time = self.rotationsensors_updated
+        elif channel == 'accelerometers':
+            self._up = self.normalize(self.a_x, self.a_y, self.a_z)
+            self.yaw = self.a_x * self.accel_factor
+            self.yaw_confidence = 10.0
+            if self._up is not None and self.last_time is None and not self._warm_start:
+                self.level_from_gravity()
+        elif channel == 'magneticsensors':
+            self._mag = self.normalize(self.m_x, self.m_y, self.m_z)
+
+    def checkpoint_restored(self):
+        # Keep the restored attitude rather than re-leveling from gravity
+        self._warm_start = True
+        self.euler()
+
+    def normalize(self, x, y, z):
+        n = math.sqrt(x * x + y * y + z * z)
+        if n == 0.0:
+            return None
+        return (x / n, y / n, z / n)
+
+    def on_ground(self):
+        mode = self.flight_mode
+        if isinstance(mode, bytes):
+            mode = mode.rstrip(b'\0').decode('ascii', errors='ignore')
+        return mode == Globals.FLIGHT_MODE_GROUND
+
+    def level_from_gravity(self):
+        # Start from the accelerometer attitude rather than waiting for the
+        # filter to converge from level
+        ux,uy,uz = self._up
+        pitch = math.atan2(uy, math.sqrt(ux * ux + uz * uz))
+        roll = math.atan2(-ux, uz)
+        cp,sp = math.cos(pitch / 2), math.sin(pitch / 2)
+        cr,sr = math.cos(roll / 2), math.sin(roll / 2)
+        # pitch about x, then roll about y
+        self.q = [cp * cr, sp * cr, cp * sr, sp * sr]
+
+    def integrate(self, dt):
+        w,x,y,z = self.q
+        gx = self.r_x * util.RAD_DEG
+        gy = self.r_y * util.RAD_DEG
+        gz = self.r_z * util.RAD_DEG
+
+        # Rotation matrix rows, body to earth
+        r00 = 1 - 2 * (y * y + z * z)
+        r01 = 2 * (x * y - w * z)
+        r02 = 2 * (x * z + w * y)
+        r10 = 2 * (x * y + w * z)
+        r11 = 1 - 2 * (x * x + z * z)
+        r12 = 2 * (y * z - w * x)
+        r20 = 2 * (x * z - w * y)
+        r21 = 2 * (y * z + w * x)
+        r22 = 1 - 2 * (x * x + y * y)
+
+        ex = ey = ez = 0.0
+        if self._up is not None:
+            # Estimated up in the body frame is the last row
+            ax,ay,az = self._up
+            ex += ay * r22 - az * r21
+            ey += az * r20 - ax * r22
+            ez += ax * r21 - ay * r20
+            self._up_error = math.asin(min(1.0, math.sqrt(ex * ex + ey * ey + ez * ez)))
+        if self._mag is not None:
+            mx,my,mz = self._mag
+            # Measured field in the earth frame, reduced to north and up components
+            hx = r00 * mx + r01 * my + r02 * mz
+            hy = r10 * mx + r11 * my + r12 * mz
+            bz = r20 * mx + r21 * my + r22 * mz
+            by = math.sqrt(hx * hx + hy * hy)
+            # Estimated field direction back in the body frame
+            wx = by * r10 + bz * r20
+            wy = by * r11 + bz * r21
+            wz = by * r12 + bz * r22
+            mex = my * wz - mz * wy
+            mey = mz * wx - mx * wz
+            mez = mx * wy - my * wx
+            self._mag_error = math.asin(min(1.0, math.sqrt(mex * mex + mey * mey + mez * mez)))
+            ex += mex
+            ey += mey
+            ez += mez
+
+        if self.on_ground():
+            kp = self.ground_proportional_gain
+        else:
+            kp = self.proportional_gain
+        self.bias[0] += self.integral_gain * ex * dt
+        self.bias[1] += self.integral_gain * ey * dt
+        self.bias[2] += self.integral_gain * ez * dt
+        gx += self.bias[0]
+        gy += self.bias[1]
+        gz += self.bias[2]
+        # Angular rates from the bias corrected gyros
+        self.pitch_rate = gx * util.DEG_RAD
+        self.roll_rate = gy * util.DEG_RAD
+        # Heading is clockwise about up, so the turn rate is the negative
+        # earth frame z rate
+        self.turn_rate = -(r20 * gx + r21 * gy + r22 * gz) * util.DEG_RAD
+        gx += kp * ex
+        gy += kp * ey
+        gz += kp * ez
+
+        # q += q * (0,g) * dt/2
+        hdt = 0.5 * dt
+        w,x,y,z = (w + (-x * gx - y * gy - z * gz) * hdt,
+                   x + ( w * gx + y * gz - z * gy) * hdt,
+                   y + ( w * gy - x * gz + z * gx) * hdt,
+                   z + ( w * gz + x * gy - y * gx) * hdt)
+        n = math.sqrt(w * w + x * x + y * y + z * z)
+        self.q = [w / n, x / n, y / n, z / n]
+        self.euler()
+
+    def euler(self):
+        w,x,y,z = self.q
+        # The nose is the body y axis
+        nose_z = 2 * (y * z + w * x)
+        self.pitch = math.asin(max(-1.0, min(1.0, nose_z))) * util.DEG_RAD
+        self.roll = math.atan2(-2 * (x * z - w * y), 1 - 2 * (x * x + y * y)) * util.DEG_RAD
+
+        self.pitch_confidence = 10.0 - self._up_error * util.DEG_RAD * self.confidence_multiplier
+        self.roll_confidence = self.pitch_confidence
+        self.pitch_rate_confidence = 10.0 - abs(self.bias[0]) * util.DEG_RAD * self.confidence_multiplier
+        self.roll_rate_confidence = 10.0 - abs(self.bias[1]) * util.DEG_RAD * self.confidence_multiplier
+        self.turn_rate_confidence = 10.0 - self._mag_error * util.DEG_RAD * self.confidence_multiplier
+
+
+if __name__ == "__main__":
+    attitude = Attitude()
+    attitude.listen()
@@ -18,6 +18,7 @@ import logging
 import PID
 
 import Common.util as util
+from Common.Curve import Curve
 import Common.FileConfig as FileConfig
 
 logger=logging.getLogger(__name__)
@@ -103,6 +104,7 @@ class AttitudeControl(FileConfig.FileConfig):
 
     def initialize(self, filelines):
         self.InitializeFromFileLines(filelines)
+        self.RollRateCurve = Curve.rate(self.RollRateCurve)
 
         self._current_airspeed_index = self.get_airspeed_index()
         kp,ki,kd = self.GetTunings (self.PitchPIDTuningParams)
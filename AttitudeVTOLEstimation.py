@@ -18,6 +18,7 @@ import logging, math, copy
 import Common.Spatial as Spatial
 import PID
 import Common.util as util
+from Common.Filters import FIRFilter
 
 logger=logging.getLogger(__name__)
 
@@ -44,8 +45,8 @@ class AttitudeVTOLEstimation:
         self.xpid = None
         self.ypid = None
         self.AccelerationFIR = [0.45, 0.2, 0.1, 0.05, 0.05, .05, .05, .05]
-        self._last_acceleration_x = list()
-        self._last_acceleration_y = list()
+        self._last_acceleration_x = FIRFilter(self.AccelerationFIR)
+        self._last_acceleration_y = FIRFilter(self.AccelerationFIR)
 
         self.JournalFileName = ''
         self._journal_file = None
@@ -138,10 +139,8 @@ class AttitudeVTOLEstimation:
             current_acceleration.sub(self._last_velocity)
             current_acceleration.div(deltat)
         self._last_velocity = current_velocity
-        current_acceleration.x = util.FIRFilter (current_acceleration.x,
-                self._last_acceleration_x, self.AccelerationFIR)
-        current_acceleration.y = util.FIRFilter (current_acceleration.y,
-                self._last_acceleration_y, self.AccelerationFIR)
+        current_acceleration.x = self._last_acceleration_x.filter (current_acceleration.x)
+        current_acceleration.y = self._last_acceleration_y.filter (current_acceleration.y)
 
         desired_accel = Spatial.Vector()
         ms = util.millis(_time)
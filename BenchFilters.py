@@ -0,0 +1,83 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Compares the Common.Filters objects against the list based util.FIRFilter
+
+import random, timeit
+import argparse
+
+import Common.util as util
+from Common.Filters import FIRFilter, BiquadFilter
+
+def old_fir(samples, taps):
+    history = list()
+    for x in samples:
+        util.FIRFilter(x, history, taps)
+
+def new_fir(samples, taps):
+    f = FIRFilter(taps)
+    for x in samples:
+        f.filter(x)
+
+def new_fir_batch(samples, taps):
+    FIRFilter(taps).process(samples)
+
+def biquad(samples, taps):
+    f = BiquadFilter.lowpass(5.0, 100.0)
+    for x in samples:
+        f.filter(x)
+
+def biquad_batch(samples, taps):
+    BiquadFilter.lowpass(5.0, 100.0).process(samples)
+
+if __name__ == "__main__":
+    opt = argparse.ArgumentParser(description='Microbenchmark of the filter primitives')
+    opt.add_argument('-n', '--samples', type=int, default=10000, help='Samples per run')
+    opt.add_argument('-r', '--repeat', type=int, default=5, help='Runs per method (best is reported)')
+    opt.add_argument('-t', '--taps', type=int, default=len(util.LowPassFIR),
+            help='FIR length. The default is util.LowPassFIR')
+    args = opt.parse_args()
+
+    rand = random.Random(1)
+    samples = [rand.gauss(0.0, 1.0) for i in range(args.samples)]
+    if args.taps == len(util.LowPassFIR):
+        taps = util.LowPassFIR
+    else:
+        taps = [1.0 / args.taps] * args.taps
+
+    # The ring buffer must give the same answers as the function it replaces
+    history = list()
+    f = FIRFilter(taps)
+    for x in samples[:100]:
+        if abs(util.FIRFilter(x, history, taps) - f.filter(x)) > 1e-9:
+            raise RuntimeError ("FIRFilter disagrees with util.FIRFilter")
+
+    methods = [('util.FIRFilter', old_fir), ('FIRFilter.filter', new_fir),
+               ('FIRFilter.process', new_fir_batch), ('BiquadFilter.filter', biquad),
+               ('BiquadFilter.process', biquad_batch)]
+    # Runs of the methods are interleaved so that a machine speeding up or
+    # slowing down over the benchmark does not favor any one of them
+    best = dict()
+    for r in range(args.repeat):
+        for name,func in methods:
+            t = timeit.timeit(lambda: func(samples, taps), number=1)
+            best[name] = min(best.get(name, t), t)
+    base = None
+    print ("%-22s %12s %8s"%('method', 'ns/sample', 'speedup'))
+    for name,func in methods:
+        ns = best[name] * 1e9 / len(samples)
+        if base is None:
+            base = ns
+        print ("%-22s %12.1f %7.1fx"%(name, ns, base / ns))
@@ -0,0 +1,140 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Finds the highest sample rate SenseControlRemote can sustain, by driving a
+# SenseControlSlave from a VirtualSensorBoard at increasing rates.
+
+import os, sys, time, select, socket, contextlib
+import multiprocessing
+import argparse, logging
+
+import yaml
+import serial
+
+from ArduinoCmdMessenger import ArduinoCmdMessenger
+from SenseControlRemote import SenseControlSlave, arduino_messages
+from VirtualSensorBoard import VirtualSensorBoard
+
+BENCH_FUNCTIONS = 'armpt'
+RAW_CHANNELS = {
+    'accelerometers': 'RawAccelerometers',
+    'rotationsensors': 'RawRotationSensors',
+    'magneticsensors': 'RawMagneticSensors',
+    'pressuresensors': 'RawPressureSensors',
+    'temperaturesensors': 'RawTemperatureSensors',
+    'gpsfeed': 'GPSFeed',
+}
+
+def sink_pubsub_config(base_config):
+    # Point every raw sensor channel at a local socket nobody reads, so the
+    # benchmark includes packing and sending each reading.
+    sinks = list()
+    config = dict()
+    for chname,function in RAW_CHANNELS.items():
+        sink = socket.socket(type=socket.SOCK_DGRAM)
+        sink.bind(('localhost', 0))
+        sinks.append(sink)
+        chcfg = dict(base_config[chname])
+        chcfg['pubs'] = [{'addr': 'localhost', 'port': sink.getsockname()[1],
+                          'protocol': 'udp', 'function': function}]
+        chcfg['subs'] = [{'addr': 'localhost', 'port': sink.getsockname()[1],
+                          'protocol': 'udp', 'function': 'Sink'}]
+        config[chname] = chcfg
+    return config, sinks
+
+def board_config(period_ms):
+    config = {
+        'accelerometers': ['sensor_i2c', 'a', period_ms, .01, .1, 0.5, 10.0, 30],
+        'gyros':          ['sensor_i2c', 'r', period_ms, .01, .1, 0.5, 45.0, 30],
+        'magnetic':       ['sensor_i2c', 'm', period_ms, .01, .1, 0.8, 10.0, 100],
+        'pressure':       ['sensor_i2c', 'p', period_ms, .01, .1, 15.0, 50.0, 30],
+        'temperature':    ['sensor_i2c', 't', period_ms, .01, .1, 0.2, 1.0, 30],
+        'cal': {
+            'rotation': ['collect', 100, 'respond_heading'],
+            'magnetic': ['rotation', 20, 1., 1.],
+        },
+    }
+    return config
+
+def run_step(rate, duration, warmup, pubsub_config, bit_error_rate):
+    # rate is the aggregate samples per second across all emulated sensors
+    per_function = rate / float(len(BENCH_FUNCTIONS))
+    board = VirtualSensorBoard(dict([(f, per_function) for f in BENCH_FUNCTIONS]),
+            bit_error_rate=bit_error_rate, seed=1)
+    sent = multiprocessing.Value('L', 0)
+    emulator = multiprocessing.Process(target=board.run, args=(warmup + duration + 5.0, sent))
+    emulator.daemon = True
+    emulator.start()
+    port = serial.Serial(board.port, 115200, timeout=0)
+    command_channel = ArduinoCmdMessenger(arduino_messages)
+    command_channel.device = port       # No bootloader reset to wait out on a pty
+    slave = SenseControlSlave(command_channel, board_config(1000.0 / per_function), pubsub_config)
+
+    fd = slave.fileno()
+    measure_start = time.time() + warmup
+    endtime = measure_start + duration
+    measuring = False
+    while True:
+        now = time.time()
+        if not measuring and now >= measure_start:
+            slave.reading_count = 0
+            slave.error_count = 0
+            sent_start = sent.value
+            measuring = True
+        if now >= endtime:
+            break
+        if not slave.pending():
+            select.select ([fd], [], [], 0.01)
+        slave.ReadSensors (100)
+    ingested = slave.reading_count / duration
+    emitted = (sent.value - sent_start) / duration
+    errors = slave.error_count
+    emulator.terminate()
+    emulator.join()
+    port.close()
+    board.close()
+    return ingested, emitted, errors
+
+if __name__ == "__main__":
+    opt = argparse.ArgumentParser(description='Benchmark host side sensor board ingest against a virtual board')
+    opt.add_argument('-r', '--rates', default='100,200,500,1000,2000,5000,10000,20000',
+            help='Comma separated aggregate sample rates (samples/s) to try, in increasing order')
+    opt.add_argument('-d', '--duration', type=float, default=5.0, help='Seconds measured at each rate')
+    opt.add_argument('-w', '--warmup', type=float, default=1.0, help='Seconds ignored at the start of each rate')
+    opt.add_argument('-b', '--bit-error-rate', type=float, default=0.0, help='Probability of flipping each transmitted bit')
+    opt.add_argument('-t', '--threshold', type=float, default=0.98,
+            help='Fraction of the target rate that must be ingested to count as sustained')
+    opt.add_argument('-p', '--pubsub-config', default='sensors_pubsub.yml', help='pubsub config supplying the raw channel formats')
+    args = opt.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    with open (args.pubsub_config, 'r') as yml:
+        base_config = yaml.load(yml)
+        yml.close()
+    pubsub_config, sinks = sink_pubsub_config(base_config)
+
+    best = 0
+    print ("%10s %12s %12s %8s"%('target', 'emitted/s', 'ingested/s', 'errors'))
+    for rate in [float(r) for r in args.rates.split(',')]:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                ingested, emitted, errors = run_step(rate, args.duration, args.warmup,
+                        pubsub_config, args.bit_error_rate)
+        print ("%10d %12.1f %12.1f %8d"%(rate, emitted, ingested, errors))
+        sys.stdout.flush()
+        if ingested < rate * args.threshold:
+            break
+        best = rate
+    print ("Maximum sustained ingest rate: %d samples/s"%best)
@@ -15,16 +15,20 @@
 
 
 import Common.util as util
+from Common.Filters import FIRFilter
 from MicroServerComs import MicroServerComs
 
 class ClimbRate(MicroServerComs):
+    checkpoint_values = ['_raw_alt_rate']
+    checkpoint_format = '%dd'%len(util.LowPassFIR)
+
     def __init__(self, conf_mult=0.01):
         MicroServerComs.__init__(self, "ClimbRate")
         self.last_time = None
         self.last_altitude = None
         self.climb_rate = None
         self.climb_rate_estimate = None
-        self._raw_alt_rate = list()
+        self._raw_alt_rate = FIRFilter(util.LowPassFIR)
         self.climb_rate_confidence = 0.0
         # Default 1 degree per minute
         self.confidence_multiplier = conf_mult
@@ -37,7 +41,7 @@ class ClimbRate(MicroServerComs):
                 timediff /= 60.0        # Convert rate to per minute
                 altdiff = self.altitude_computed - self.last_altitude
                 current_alt_rate = altdiff / timediff
-                self.climb_rate = util.LowPassFilter (current_alt_rate, self._raw_alt_rate)
+                self.climb_rate = self._raw_alt_rate.filter (current_alt_rate)
                 self.climb_rate = int(round(self.climb_rate))
                 if self.climb_rate_estimate is not None:
                     variance = abs(self.climb_rate - self.climb_rate_estimate)
@@ -15,15 +15,19 @@
 
 
 import Common.util as util
+from Common.Filters import FIRFilter
 from MicroServerComs import MicroServerComs
 
 class ClimbRateEstimate(MicroServerComs):
+    checkpoint_values = ['_raw_alt_rate']
+    checkpoint_format = '%dd'%len(util.LowPassFIR)
+
     def __init__(self):
         MicroServerComs.__init__(self, "ClimbRateEstimate")
         self.last_altitude = None
         self.last_time = None
         self.climb_rate_estimate = None
-        self._raw_alt_rate = list()
+        self._raw_alt_rate = FIRFilter(util.LowPassFIR)
 
     def updated(self, channel):
         if self.last_time is not None:
@@ -31,7 +35,7 @@ class ClimbRateEstimate(MicroServerComs):
             timediff /= 60.0        # Convert rate to per minute
             altdiff = self.gps_altitude - self.last_altitude
             current_alt_rate = altdiff / timediff
-            self.climb_rate_estimate = util.LowPassFilter (current_alt_rate, self._raw_alt_rate)
+            self.climb_rate_estimate = self._raw_alt_rate.filter (current_alt_rate)
             self.climb_rate_estimate = int(round(self.climb_rate_estimate))
             self.publish ()
             print ("ClimbRateEstimate: %d/%g => %g"%(altdiff, timediff, self.climb_rate_estimate))
@@ -0,0 +1,128 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os, mmap, struct, time, re, zlib
+import logging
+
+logger=logging.getLogger(__name__)
+
+MAGIC = b'CKPT'
+# magic, layout crc, payload crc, present bits, saved time
+HEADER = struct.Struct('<4sIIQd')
+
+_format_item = re.compile(r'(\d*)([a-zA-Z?])')
+
+class Checkpoint:
+    """ Fixed layout snapshot of some of an object's attributes, kept in a
+    small memory mapped file.
+
+    values and fmt work like a channel's output_values and format: one
+    numeric struct item per name. An item with a count (e.g. '4d') holds a
+    list, or an object with state() and set_state() (the Common.Filters
+    objects).
+    Attributes that are None are skipped, and left alone on restore.
+
+    Saving packs straight into the mapping, so it costs about as much as a
+    publish. The operating system writes the page back; a crash of the
+    process loses nothing that was saved. The payload crc guards against a
+    save torn by the process dying part way through.
+    """
+    def __init__(self, path, values, fmt, period=1.0):
+        self.path = path
+        self.values = list(values)
+        items = _format_item.findall(fmt.replace(' ', ''))
+        if len(items) != len(self.values):
+            raise RuntimeError ("Checkpoint %s: format %s does not match values %s"%(
+                path, fmt, self.values))
+        if len(self.values) > 64:
+            raise RuntimeError ("Checkpoint %s: too many values"%path)
+        self.counts = [int(n) if n else 0 for n,c in items]
+        self.payload = struct.Struct('<' + fmt)
+        self.layout = zlib.crc32((' '.join(self.values) + fmt).encode('ascii'))
+        self.period = period
+        self.next_save = 0.0
+        self.size = HEADER.size + self.payload.size
+
+        if not os.path.exists(path) or os.path.getsize(path) != self.size:
+            with open(path, 'wb') as f:
+                f.write(bytes(self.size))
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def maybe_save(self, obj, now=None):
+        if now is None:
+            now = time.time()
+        if now >= self.next_save:
+            self.save (obj, now)
+            self.next_save = now + self.period
+
+    def save(self, obj, now=None):
+        if now is None:
+            now = time.time()
+        args = list()
+        present = 0
+        for i,(name,count) in enumerate(zip(self.values, self.counts)):
+            val = getattr(obj, name, None)
+            if val is None:
+                if count:
+                    args.extend ([0] * count)
+                else:
+                    args.append (0)
+                continue
+            present |= 1 << i
+            if count:
+                if hasattr(val, 'state'):
+                    val = val.state()
+                args.extend (val)
+            else:
+                args.append (val)
+        self.payload.pack_into (self._map, HEADER.size, *args)
+        crc = zlib.crc32(self._map[HEADER.size:])
+        HEADER.pack_into (self._map, 0, MAGIC, self.layout, crc, present, now)
+
+    def restore(self, obj, max_age, now=None):
+        # Returns True if a fresh checkpoint was applied to obj
+        if now is None:
+            now = time.time()
+        magic,layout,crc,present,saved = HEADER.unpack_from (self._map, 0)
+        if magic != MAGIC or layout != self.layout:
+            return False
+        if crc != zlib.crc32(self._map[HEADER.size:]):
+            logger.warning ("Checkpoint %s is corrupt", self.path)
+            return False
+        age = now - saved
+        if age < 0 or age > max_age:
+            logger.info ("Checkpoint %s is stale (%g seconds)", self.path, age)
+            return False
+        args = self.payload.unpack_from (self._map, HEADER.size)
+        index = 0
+        for i,(name,count) in enumerate(zip(self.values, self.counts)):
+            n = count if count else 1
+            if present & (1 << i):
+                if count:
+                    current = getattr(obj, name, None)
+                    if hasattr(current, 'set_state'):
+                        current.set_state (args[index:index + n])
+                    else:
+                        setattr (obj, name, list(args[index:index + n]))
+                else:
+                    setattr (obj, name, args[index])
+            index += n
+        logger.info ("Restored %s from checkpoint %g seconds old", self.path, age)
+        return True
@@ -0,0 +1,71 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# The time the autopilot and its sensors run on.
+#
+# By default this is the wall clock. A program that runs against a simulator
+# or a replay can use(VirtualClock()) instead, before starting anything that
+# reads the time. Virtual time only moves when something sleeps or waits on
+# it, so a flight runs as fast as the computer can take it, and makes the
+# same decisions as it would in real time.
+
+import time as _time
+import select as _select
+
+class RealClock:
+    def time(self):
+        return _time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds)
+
+    # Waits up to timeout seconds for one of rlist to be readable; returns those that are.
+    def select(self, rlist, timeout):
+        r,w,x = _select.select(rlist, [], [], max(timeout, 0))
+        return r
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    # Never blocks. If nothing is readable, the whole timeout passes.
+    def select(self, rlist, timeout):
+        r,w,x = _select.select(rlist, [], [], 0)
+        if not r:
+            self.sleep(timeout)
+        return r
+
+clock = RealClock()
+
+def use(c):
+    global clock
+    clock = c
+
+def time():
+    return clock.time()
+
+def sleep(seconds):
+    clock.sleep(seconds)
+
+def select(rlist, timeout):
+    return clock.select(rlist, timeout)
@@ -0,0 +1,180 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from bisect import bisect_right
+from numbers import Real
+from array import array
+
+import numpy
+
+class Curve:
+    """ Piece-wise linear curve, compiled once from a list of (x,y) points.
+
+    symmetric: behaves like util.rate_curve. The curve is defined for
+        x >= 0 and mirrored for negative x. Past the last point (and, as in
+        rate_curve, before the first) the result is the last y.
+    otherwise: behaves like SenseControl.look_up. Outside the points the
+        result is the end value, or with continuous, extended along the end slope.
+    reverse swaps x and y (look_up's reverse).
+
+    Points spaced on a uniform grid are indexed directly, otherwise by bisection.
+    lut_size resamples the curve onto a uniform grid of that many points,
+    trading exactness between points for O(1) lookups on long tables.
+
+    Calling a Curve with a number returns a number. Calling it with a
+    sequence or array evaluates every element at once with numpy and
+    returns an ndarray of the same shape.
+    The original points stay available through len(), indexing and iteration.
+    """
+    __slots__ = ('points', 'xs', 'ys', 'slopes', 'symmetric', 'continuous',
+                 '_x0', '_inv_step', '_last')
+
+    def __init__(self, points, symmetric=False, continuous=False, reverse=False, lut_size=None):
+        self.points = list(points)
+        if len(self.points) == 0:
+            raise RuntimeError ("Curve needs at least one point")
+        if reverse:
+            pts = [(float(v), float(k)) for k,v in self.points]
+        else:
+            pts = [(float(k), float(v)) for k,v in self.points]
+        pts.sort(key=lambda p: p[0])
+        self.symmetric = symmetric
+        self.continuous = continuous
+        self.xs = array('d', [p[0] for p in pts])
+        self.ys = array('d', [p[1] for p in pts])
+        self._compile()
+        if lut_size is not None and len(self.xs) > 1 and self._inv_step is None:
+            x0 = self.xs[0]
+            step = (self.xs[-1] - x0) / (lut_size - 1)
+            grid = [x0 + i * step for i in range(lut_size)]
+            grid[-1] = self.xs[-1]
+            ys = array('d', [self._interpolate(x) for x in grid])
+            self.xs = array('d', grid)
+            self.ys = ys
+            self._compile()
+
+    def _compile(self):
+        xs = self.xs
+        ys = self.ys
+        self._last = len(xs) - 1
+        self.slopes = array('d', [0.0] * max(1, self._last))
+        for i in range(self._last):
+            dx = xs[i+1] - xs[i]
+            if dx != 0.0:
+                self.slopes[i] = (ys[i+1] - ys[i]) / dx
+        self._x0 = xs[0]
+        self._inv_step = None
+        if self._last > 1:
+            step = (xs[-1] - xs[0]) / self._last
+            if step > 0.0:
+                tolerance = step * 1e-9
+                for i in range(self._last):
+                    if abs(xs[i+1] - xs[i] - step) > tolerance:
+                        break
+                else:
+                    self._inv_step = 1.0 / step
+
+    def _interpolate(self, x):
+        # x is known to be within [xs[0], xs[-1]]
+        if self._inv_step is not None:
+            i = int((x - self._x0) * self._inv_step)
+        else:
+            i = bisect_right(self.xs, x) - 1
+        if i >= self._last:
+            i = self._last - 1
+        if i < 0:
+            i = 0
+        return self.ys[i] + (x - self.xs[i]) * self.slopes[i]
+
+    def value(self, x):
+        xs = self.xs
+        if self.symmetric:
+            if x < 0:
+                x = -x
+                sign = -1.0
+            else:
+                sign = 1.0
+            if x >= xs[-1] or x < xs[0] or self._last == 0:
+                return sign * self.ys[-1]
+            return sign * self._interpolate(x)
+        if x <= xs[0]:
+            if self.continuous and self._last > 0:
+                return self.ys[0] + (x - xs[0]) * self.slopes[0]
+            return self.ys[0]
+        if x >= xs[-1]:
+            if self.continuous and self._last > 0:
+                return self.ys[-1] + (x - xs[-1]) * self.slopes[-1]
+            return self.ys[-1]
+        return self._interpolate(x)
+
+    def values(self, x):
+        # value() over a whole array
+        x = numpy.asarray(x, dtype=float)
+        xs = numpy.frombuffer(self.xs)
+        ys = numpy.frombuffer(self.ys)
+        if self.symmetric:
+            sign = numpy.where(x < 0, -1.0, 1.0)
+            x = numpy.abs(x)
+            if self._last == 0:
+                return sign * ys[-1]
+            inside = (x >= xs[0]) & (x < xs[-1])
+            return sign * numpy.where(inside, self._interpolate_array(x, xs, ys), ys[-1])
+        if self._last == 0:
+            return numpy.full(x.shape, ys[0])
+        if self.continuous:
+            slopes = numpy.frombuffer(self.slopes)
+            below = ys[0] + (x - xs[0]) * slopes[0]
+            above = ys[-1] + (x - xs[-1]) * slopes[-1]
+        else:
+            below = ys[0]
+            above = ys[-1]
+        return numpy.where(x <= xs[0], below,
+                numpy.where(x >= xs[-1], above, self._interpolate_array(x, xs, ys)))
+
+    def _interpolate_array(self, x, xs, ys):
+        i = numpy.searchsorted(xs, x, side='right') - 1
+        numpy.clip (i, 0, self._last - 1, out=i)
+        return ys[i] + (x - xs[i]) * numpy.frombuffer(self.slopes)[i]
+
+    def __call__(self, x):
+        if isinstance(x, Real):
+            return self.value(x)
+        return self.values(x)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, i):
+        return self.points[i]
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __repr__(self):
+        return "Curve(%s)"%str(self.points)
+
+    @classmethod
+    def rate(cls, points, lut_size=None):
+        # Compile a rate_curve style config value, passing None and Curves through
+        if points is None or isinstance(points, Curve):
+            return points
+        return cls(points, symmetric=True, lut_size=lut_size)
+
+    @classmethod
+    def lookup(cls, points, continuous=False, reverse=False, lut_size=None):
+        # Compile a look_up style table, passing None and Curves through
+        if points is None or isinstance(points, Curve):
+            return points
+        return cls(points, continuous=continuous, reverse=reverse, lut_size=lut_size)
@@ -0,0 +1,316 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Time range queries over recorded events, as columns of numpy arrays.
+#
+# A reader fetches one channel's fields over [start, end) from a store,
+# either every record, or aggregated into equal time buckets. Aggregation is
+# done where the data is: by the database for SQLite and PostgreSQL, and on
+# the memory mapped records for segment files.
+#
+# Results are dicts of arrays. Raw results have 'timestamp' and one array per
+# field. Aggregated results have 'timestamp' (bucket middle), 'count', and
+# <field>_min, <field>_max and <field>_mean per field, for the buckets that
+# hold any records.
+
+import os, mmap, struct, collections
+
+import numpy
+
+from Common.EventStore import format_items
+from Common.SegmentStore import HEADER, MAGIC, SCHEMA_OFFSET, DATA_OFFSET, INDEX_EVERY, TIME
+
+def record_dtype(values, fmt):
+    # A segment record: the time, then the message as struct packs it
+    names = ['_time']
+    formats = ['<f8']
+    offsets = [0]
+    prefix = ''
+    for (count,code),name in zip(format_items(fmt), values):
+        item = count + code
+        offsets.append (TIME.size + struct.calcsize(prefix + item) - struct.calcsize(item))
+        if code in 'sp':
+            formats.append ('S%s'%(count if count else '1'))
+        elif code == 'c':
+            formats.append ('S1')
+        else:
+            formats.append (code)
+        names.append (name)
+        prefix += item
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                        'itemsize': TIME.size + struct.calcsize(fmt)})
+
+def aggregate(times, columns, start, end, buckets):
+    # Aggregates time ordered columns into buckets, with reduceat over each bucket's run
+    width = (end - start) / buckets
+    bins = numpy.floor((times - start) / width).astype(numpy.int64)
+    if len(bins) == 0:
+        firsts = numpy.zeros(0, dtype=numpy.int64)
+    else:
+        firsts = numpy.flatnonzero(numpy.diff(bins, prepend=bins[0] - 1))
+    counts = numpy.diff(numpy.append(firsts, len(times)))
+    ret = {'timestamp': start + (bins[firsts] + 0.5) * width, 'count': counts}
+    for name,col in columns.items():
+        col = col.astype(numpy.float64)
+        if len(firsts):
+            ret[name + '_min'] = numpy.minimum.reduceat(col, firsts)
+            ret[name + '_max'] = numpy.maximum.reduceat(col, firsts)
+            ret[name + '_mean'] = numpy.add.reduceat(col, firsts) / counts
+        else:
+            ret[name + '_min'] = ret[name + '_max'] = ret[name + '_mean'] = col
+    return ret
+
+def lttb(times, values, threshold):
+    """ Largest triangle three buckets: indices of the threshold points of
+    (times, values) that best keep the shape of the line.
+    """
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return numpy.arange(n)
+    selected = numpy.zeros(threshold, dtype=numpy.int64)
+    edges = numpy.floor(numpy.linspace(1, n - 1, threshold - 1)).astype(numpy.int64)
+    a = 0
+    for i in range(threshold - 2):
+        lo,hi = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        nlo = hi
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        if nhi <= nlo:
+            nhi = nlo + 1
+        avg_t = times[nlo:nhi].mean()
+        avg_v = values[nlo:nhi].mean()
+        t = times[lo:hi]
+        v = values[lo:hi]
+        area = numpy.abs((times[a] - avg_t) * (v - values[a]) - (times[a] - t) * (avg_v - values[a]))
+        a = lo + int(numpy.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+class SegmentReader:
+    """ Reads a SegmentStore directory. Segments are memory mapped read only,
+    and the sparse time index narrows each range to a few pages.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = dict()
+
+    def channels(self):
+        return sorted(d for d in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, d)))
+
+    def segments(self, channel):
+        # (path, values, format, count, first time, last time) of each segment, oldest first
+        cdir = os.path.join(self.directory, channel)
+        ret = list()
+        for f in sorted(os.listdir(cdir)):
+            if not f.endswith('.seg'):
+                continue
+            path = os.path.join(cdir, f)
+            with open(path, 'rb') as seg:
+                header = seg.read(DATA_OFFSET)
+            if len(header) < HEADER.size:
+                continue
+            magic,layout,record_size,capacity,first,count,last = HEADER.unpack_from(header)
+            if magic != MAGIC or count == 0:
+                continue
+            fmt,values = header[SCHEMA_OFFSET:].split(b'\n')[:2]
+            ret.append ((path, values.decode('ascii').split(), fmt.decode('ascii'), count, first, last))
+        return ret
+
+    def has_after(self, channel, tm):
+        segments = self.segments(channel)
+        return bool(segments) and segments[-1][5] >= tm
+
+    def records(self, path, values, fmt, count):
+        # A read only mapping can not see past the size the file had when it was
+        # mapped, so a segment still being written is mapped again once it grows
+        cached = self._maps.get(path)
+        if cached is not None and cached[0] >= count:
+            return cached[1][:count], cached[2]
+        dtype = record_dtype(values, fmt)
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count = min(count, (len(m) - DATA_OFFSET) // dtype.itemsize)
+        records = numpy.frombuffer(m, dtype=dtype, count=count, offset=DATA_OFFSET)
+        index_path = path[:-4] + '.idx'
+        index = numpy.fromfile(index_path, dtype='<f8') if os.path.exists(index_path) else None
+        self._maps[path] = (count, records, index)
+        return records, index
+
+    def locate(self, records, index, tm):
+        # First record at or after tm
+        if index is not None:
+            blocks = min(len(index), (len(records) + INDEX_EVERY - 1) // INDEX_EVERY)
+            # The last block starting before tm; the first record at or after tm is in it,
+            # or starts the next block
+            block = max(0, int(numpy.searchsorted(index[:blocks], tm, 'left')) - 1)
+            lo = block * INDEX_EVERY
+            hi = min(len(records), lo + INDEX_EVERY)
+            if hi == len(records) or records['_time'][hi] >= tm:
+                return lo + int(numpy.searchsorted(records['_time'][lo:hi], tm))
+        return int(numpy.searchsorted(records['_time'], tm))
+
+    def raw(self, channel, fields, start, end):
+        parts = list()
+        for path,values,fmt,count,first,last in self.segments(channel):
+            if last < start or first >= end:
+                continue
+            for f in fields:
+                if not f in values:
+                    raise RuntimeError ("Channel %s has no field %s"%(channel, f))
+            records,index = self.records(path, values, fmt, count)
+            parts.append (records[self.locate(records, index, start):self.locate(records, index, end)])
+        ret = {'timestamp': numpy.concatenate([p['_time'] for p in parts]) if parts
+                            else numpy.zeros(0)}
+        for f in fields:
+            ret[f] = numpy.concatenate([p[f] for p in parts]) if parts else numpy.zeros(0)
+        return ret
+
+    def aggregate(self, channel, fields, start, end, buckets):
+        data = self.raw(channel, fields, start, end)
+        times = data.pop('timestamp')
+        return aggregate(times, data, start, end, buckets)
+
+class SQLReader:
+    # Shared by the SQLite and PostgreSQL readers; subclasses give the table name
+    # and how to turn the timestamp column into seconds since the epoch
+    def check_fields(self, fields):
+        # Field names go into the SQL
+        for f in fields:
+            if not f.isidentifier():
+                raise RuntimeError ("Invalid field name %s"%f)
+
+    def fetch(self, query, args):
+        cur = self.dbconn.cursor()
+        cur.execute (query, args)
+        return cur.fetchall()
+
+    def raw(self, channel, fields, start, end):
+        self.check_fields (fields)
+        rows = self.fetch ("SELECT %s, %s FROM %s WHERE %s ORDER BY timestamp"%(
+                    self.epoch, ', '.join(fields), self.table(channel), self.range_condition),
+                    self.range_args(start, end))
+        columns = list(zip(*rows)) if rows else [()] * (len(fields) + 1)
+        ret = {'timestamp': numpy.array(columns[0], dtype=numpy.float64)}
+        for f,col in zip(fields, columns[1:]):
+            ret[f] = numpy.array(col, dtype=numpy.float64)
+        return ret
+
+    def aggregate(self, channel, fields, start, end, buckets):
+        self.check_fields (fields)
+        width = (end - start) / buckets
+        aggregates = ', '.join('min(%s), max(%s), avg(%s)'%(f,f,f) for f in fields)
+        rows = self.fetch ("SELECT %s AS bucket, count(*), %s FROM %s WHERE %s "
+                           "GROUP BY bucket ORDER BY bucket"%(
+                    self.bucket, aggregates, self.table(channel), self.range_condition),
+                    (start, width) + self.range_args(start, end))
+        columns = list(zip(*rows)) if rows else [()] * (2 + 3 * len(fields))
+        ret = {'timestamp': start + (numpy.array(columns[0], dtype=numpy.float64) + 0.5) * width,
+               'count': numpy.array(columns[1], dtype=numpy.int64)}
+        for i,f in enumerate(fields):
+            ret[f + '_min'] = numpy.array(columns[2 + 3 * i], dtype=numpy.float64)
+            ret[f + '_max'] = numpy.array(columns[3 + 3 * i], dtype=numpy.float64)
+            ret[f + '_mean'] = numpy.array(columns[4 + 3 * i], dtype=numpy.float64)
+        return ret
+
+    def has_after(self, channel, tm):
+        rows = self.fetch ("SELECT 1 FROM %s WHERE %s LIMIT 1"%(self.table(channel), self.after_condition),
+                           (tm,))
+        return len(rows) > 0
+
+class SQLiteReader(SQLReader):
+    epoch = 'timestamp'
+    # Every timestamp is at or after the start, so truncating is flooring
+    bucket = 'CAST((timestamp - ?) / ? AS INTEGER)'
+    range_condition = 'timestamp >= ? AND timestamp < ?'
+    after_condition = 'timestamp >= ?'
+
+    def __init__(self, path):
+        import sqlite3
+        self.dbconn = sqlite3.connect ('file:%s?mode=ro'%path, uri=True)
+
+    def table(self, channel):
+        return channel.lower()
+
+    def range_args(self, start, end):
+        return (start, end)
+
+    def channels(self):
+        return [r[0] for r in self.fetch ("SELECT name FROM sqlite_master WHERE type = 'table'", ())]
+
+class PostgresReader(SQLReader):
+    epoch = 'extract(epoch from timestamp)'
+    bucket = 'floor((extract(epoch from timestamp) - %s) / %s)'
+    # Compared as timestamps, so that the BRIN indexes are used
+    range_condition = "timestamp >= to_timestamp(%s) AT TIME ZONE 'UTC' AND " \
+                      "timestamp < to_timestamp(%s) AT TIME ZONE 'UTC'"
+    after_condition = "timestamp >= to_timestamp(%s) AT TIME ZONE 'UTC'"
+
+    def __init__(self, dbname, user, table_prefix):
+        import psycopg2
+        self.dbconn = psycopg2.connect ("dbname=%s user=%s"%(dbname, user))
+        self.dbconn.autocommit = True
+        self.prefix = table_prefix
+
+    def table(self, channel):
+        return ('%s_%s'%(self.prefix, channel)).lower()
+
+    def range_args(self, start, end):
+        return (start, end)
+
+class EventQuery:
+    """ Time range queries over a reader, keeping the cache_size most
+    recently used results.
+
+    With live set, events are still being recorded, and a result is only
+    cached once its channel has a record at or after the end of the range.
+    """
+    def __init__(self, reader, cache_size=64, live=False):
+        self.reader = reader
+        self.cache_size = cache_size
+        self.live = live
+        self._cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def query(self, channel, fields, start, end, buckets=None):
+        """ fields over [start, end), every record, or aggregated into buckets
+        when buckets is given.
+        """
+        key = (channel, tuple(fields), start, end, buckets)
+        ret = self._cache.get(key)
+        if ret is not None:
+            self._cache.move_to_end (key)
+            self.hits += 1
+            return ret
+        self.misses += 1
+        if buckets is None:
+            ret = self.reader.raw (channel, list(fields), start, end)
+        else:
+            ret = self.reader.aggregate (channel, list(fields), start, end, buckets)
+        if not self.live or self.reader.has_after (channel, end):
+            self._cache[key] = ret
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem (last=False)
+        return ret
+
+    def downsample(self, channel, field, start, end, points):
+        """ At most points records of one field, chosen by lttb(). Reads every
+        record of the range, so suits ranges of up to a few million records.
+        """
+        data = self.query (channel, [field], start, end)
+        selected = lttb(data['timestamp'], data[field], points)
+        return {'timestamp': data['timestamp'][selected], field: data[field][selected]}
@@ -0,0 +1,398 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Storage backends for EventDB.
+#
+# A store records raw channel messages. open_channel() describes a channel
+# from its output_values and format, and add() takes a message exactly as it
+# came off the wire; any unpacking is the store's business, off the receive
+# path where it can be.
+
+import time, io, re, struct
+import threading, queue
+from abc import ABC, abstractmethod
+
+# struct format item -> column type
+SQL_TYPES = {
+    'f': 'real',
+    'd': 'double precision',
+    'b': 'smallint',
+    'B': 'smallint',
+    'h': 'smallint',
+    'H': 'integer',
+    'i': 'integer',
+    'I': 'bigint',
+    'l': 'bigint',
+    'L': 'numeric',
+    'q': 'bigint',
+    'Q': 'numeric',
+    '?': 'boolean',
+    'c': 'text',
+    's': 'text',
+}
+
+SQLITE_TYPES = {
+    'real': 'REAL',
+    'double precision': 'REAL',
+    'smallint': 'INTEGER',
+    'integer': 'INTEGER',
+    'bigint': 'INTEGER',
+    'numeric': 'INTEGER',
+    'boolean': 'INTEGER',
+    'text': 'TEXT',
+}
+
+PARTITION_SECONDS = 24 * 3600
+INFINITY = float('inf')
+
+_format_item = re.compile(r'(\d*)([a-zA-Z?])')
+
+def format_items(fmt):
+    # One (count, code) per value: '10s' is one value, '3f' three
+    items = list()
+    for count,c in _format_item.findall(fmt.replace(' ', '')):
+        if c in 'sp':
+            items.append ((count, c))
+        else:
+            items.extend ([('', c)] * (int(count) if count else 1))
+    return items
+
+def format_timestamp(tm):
+    return time.strftime ('%Y-%m-%d %H:%M:%S', time.gmtime(tm)) + '.%06d'%(int((tm - int(tm)) * 1000000))
+
+def copy_escape(text):
+    # COPY text format: backslash, tab and newline are special
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def copy_value(v):
+    if isinstance(v, bool):
+        return 't' if v else 'f'
+    if isinstance(v, bytes):
+        return copy_escape(v.rstrip(b'\0').decode('utf-8', 'replace'))
+    if isinstance(v, float):
+        if v != v:
+            return 'NaN'
+        if v in (INFINITY, -INFINITY):
+            return 'Infinity' if v > 0 else '-Infinity'
+    return str(v)
+
+class EventChannel:
+    """ A channel as recorded: its values, the message layout and where in
+    a message the timestamp is.
+
+    Messages of channels without a timestamp are stamped when received.
+    """
+    def __init__(self, name, values, fmt):
+        self.name = name
+        self.values = list(values)
+        self.format = fmt
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        items = format_items(fmt)
+        if len(items) != len(self.values):
+            raise RuntimeError ("Channel %s: format %s does not match values %s"%(
+                name, fmt, str(self.values)))
+        self.types = list()
+        for count,c in items:
+            if not c in SQL_TYPES and not c == 'p':
+                raise RuntimeError ("Channel %s: format %s is not supported"%(name, c))
+            self.types.append (SQL_TYPES.get(c, 'text'))
+        if 'timestamp' in self.values:
+            self.ts_index = self.values.index('timestamp')
+            # Unpacks up to and including the timestamp; usually just the timestamp
+            self._ts = struct.Struct(''.join(count + c for count,c in items[:self.ts_index + 1]))
+        else:
+            self.ts_index = None
+            self._ts = None
+        self.columns = [(v,t) for v,t in zip(self.values, self.types) if v != 'timestamp']
+        self.value_indices = [i for i,v in enumerate(self.values) if v != 'timestamp']
+
+    def timestamp(self, payload, now):
+        if self._ts is None:
+            return now
+        return self._ts.unpack_from(payload)[self.ts_index]
+
+class EventStore(ABC):
+    def open_channel(self, name, values, fmt):
+        return EventChannel(name, values, fmt)
+
+    def start(self):
+        # Called once all channels are open
+        pass
+
+    @abstractmethod
+    def add(self, channel, payload, now):
+        pass
+
+    def close(self):
+        pass
+
+class BatchWriter(threading.Thread):
+    """ Writes rows to a store from a background thread.
+
+    Rows are queued by add() and passed to the store's write_batch(): once
+    batch_size rows are waiting, or flush_interval seconds after the first
+    row of a batch arrived.
+    When the queue is full (the store has fallen behind by max_queue rows),
+    new rows are dropped and counted.
+    """
+    def __init__(self, store, batch_size=1000, flush_interval=0.25,
+                 max_queue=100000, report_period=10.0):
+        threading.Thread.__init__(self, name="EventWriter", daemon=True)
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.report_period = report_period
+        self.queue = queue.Queue(max_queue)
+
+        self.rows_written = 0
+        self.flush_count = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+        # Counted by add() on the receiving thread, and only read here, so
+        # the report takes the difference from the last one
+        self.dropped = 0
+        self._dropped_reported = 0
+        self.failed = 0
+        self._count_start = time.time()
+
+    def add(self, row):
+        try:
+            self.queue.put_nowait (row)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Writes what is queued, and stops the thread
+        self.queue.put (None)
+        self.join()
+
+    def run(self):
+        rows = list()
+        deadline = None
+        next_report = time.time() + self.report_period if self.report_period else None
+        while True:
+            timeout = deadline
+            if next_report is not None and (timeout is None or next_report < timeout):
+                timeout = next_report
+            if timeout is not None:
+                timeout = max(0.0, timeout - time.time())
+            try:
+                row = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                row = False
+            if row is None:
+                break
+            if row:
+                if not rows:
+                    deadline = time.time() + self.flush_interval
+                rows.append (row)
+                # Take whatever else is waiting without going back to sleep
+                while len(rows) < self.batch_size:
+                    try:
+                        row = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if row is None:
+                        self.flush (rows)
+                        return
+                    rows.append (row)
+            now = time.time()
+            if rows and (len(rows) >= self.batch_size or now >= deadline):
+                self.flush (rows)
+                rows = list()
+                deadline = None
+            if next_report is not None and now >= next_report:
+                self.report()
+                next_report += self.report_period
+        if rows:
+            self.flush (rows)
+
+    def flush(self, rows):
+        start = time.time()
+        try:
+            self.store.write_batch (rows)
+        except Exception as e:
+            self.failed += len(rows)
+            print ("EventDB: could not write %d events: %s"%(len(rows), str(e)))
+            return
+        elapsed = time.time() - start
+        self.rows_written += len(rows)
+        self.flush_count += 1
+        self.flush_time += elapsed
+        if elapsed > self.max_flush_time:
+            self.max_flush_time = elapsed
+
+    def report(self):
+        now = time.time()
+        elapsed = now - self._count_start
+        dropped = self.dropped
+        if elapsed > 0:
+            mean_flush = self.flush_time / self.flush_count if self.flush_count else 0.0
+            print ("EventDB: %g rows/s, flush %.1f ms mean %.1f ms max, queue %d, dropped %d, failed %d"%(
+                self.rows_written / elapsed, mean_flush * 1000.0, self.max_flush_time * 1000.0,
+                self.queue.qsize(), dropped - self._dropped_reported, self.failed))
+        self.rows_written = 0
+        self.flush_count = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+        self._dropped_reported = dropped
+        self.failed = 0
+        self._count_start = now
+
+class BatchedStore(EventStore):
+    # A store written in batches by a BatchWriter. Subclasses provide write_batch(rows),
+    # rows being (channel, time, payload)
+    def __init__(self, batch_size=1000, flush_interval=0.25, max_queue=100000, report_period=10.0):
+        self.writer = BatchWriter(self, batch_size, flush_interval, max_queue, report_period)
+
+    def start(self):
+        self.writer.start()
+
+    def add(self, channel, payload, now):
+        self.writer.add ((channel, channel.timestamp(payload, now), payload))
+
+    def close(self):
+        self.writer.close()
+
+class PostgresTable(EventChannel):
+    """ The PostgreSQL table one channel is recorded in.
+
+    It is partitioned by day on timestamp (UTC). Each partition is created
+    when the first row for its day is written, with a BRIN index on
+    timestamp: rows arrive in time order, so the index stays a few pages
+    per partition.
+    """
+    def __init__(self, prefix, name, values, fmt):
+        EventChannel.__init__(self, name, values, fmt)
+        self.table = ('%s_%s'%(prefix, name)).lower()
+        self.copy_command = "COPY %s (timestamp, %s) FROM STDIN"%(self.table,
+                ', '.join(v for v,t in self.columns))
+        self.partitions = set()
+
+    def create_statement(self):
+        return "CREATE TABLE IF NOT EXISTS %s (timestamp timestamp NOT NULL, %s) PARTITION BY RANGE (timestamp);"%(
+                self.table, ', '.join('%s %s'%(v,t) for v,t in self.columns))
+
+    def partition_statements(self, day):
+        start = day * PARTITION_SECONDS
+        partition = '%s_%s'%(self.table, time.strftime('%Y%m%d', time.gmtime(start)))
+        return ["CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s');"%(
+                    partition, self.table, format_timestamp(start),
+                    format_timestamp(start + PARTITION_SECONDS)),
+                "CREATE INDEX IF NOT EXISTS %s_timestamp ON %s USING brin (timestamp);"%(
+                    partition, partition)]
+
+    def copy_line(self, tm, payload):
+        values = self.struct.unpack(payload)
+        return '%s\t%s\n'%(format_timestamp(tm), '\t'.join(copy_value(values[i])
+                                                        for i in self.value_indices))
+
+class PostgresStore(BatchedStore):
+    """ One typed, day partitioned table per channel, <prefix>_<channel>,
+    written with one COPY per table and one commit per batch.
+    """
+    def __init__(self, dbname, user, table_prefix, **kwargs):
+        BatchedStore.__init__(self, **kwargs)
+        import psycopg2
+        self.Error = psycopg2.Error
+        self.dbconn = psycopg2.connect ("dbname=%s user=%s"%(dbname, user))
+        self.cur = self.dbconn.cursor()
+        self.prefix = table_prefix
+
+    def open_channel(self, name, values, fmt):
+        table = PostgresTable(self.prefix, name, values, fmt)
+        self.cur.execute (table.create_statement())
+        self.dbconn.commit()
+        return table
+
+    def write_batch(self, rows):
+        lines = dict()
+        new_partitions = list()
+        for table,tm,payload in rows:
+            day = int(tm // PARTITION_SECONDS)
+            if not day in table.partitions:
+                table.partitions.add (day)
+                new_partitions.append ((table, day))
+            tlines = lines.get(table)
+            if tlines is None:
+                tlines = list()
+                lines[table] = tlines
+            tlines.append (table.copy_line (tm, payload))
+        try:
+            for table,day in new_partitions:
+                for statement in table.partition_statements (day):
+                    self.cur.execute (statement)
+            for table,tlines in lines.items():
+                self.cur.copy_expert (table.copy_command, io.StringIO(''.join(tlines)))
+            self.dbconn.commit()
+        except self.Error:
+            self.dbconn.rollback()
+            for table,day in new_partitions:
+                table.partitions.discard (day)
+            raise
+
+class SQLiteTable(EventChannel):
+    def __init__(self, name, values, fmt):
+        EventChannel.__init__(self, name, values, fmt)
+        self.table = name.lower()
+        self.insert = "INSERT INTO %s (timestamp, %s) VALUES (?, %s)"%(self.table,
+                ', '.join(v for v,t in self.columns), ', '.join('?' * len(self.columns)))
+
+    def create_statements(self):
+        return ["CREATE TABLE IF NOT EXISTS %s (timestamp REAL NOT NULL, %s)"%(
+                    self.table, ', '.join('%s %s'%(v, SQLITE_TYPES[t]) for v,t in self.columns)),
+                "CREATE INDEX IF NOT EXISTS %s_timestamp ON %s (timestamp)"%(self.table, self.table)]
+
+    def row(self, tm, payload):
+        values = self.struct.unpack(payload)
+        return (tm,) + tuple(values[i] for i in self.value_indices)
+
+class SQLiteStore(BatchedStore):
+    """ One table per channel in a single SQLite file, in WAL mode.
+
+    Timestamps are seconds since the epoch. Each batch is one transaction
+    of executemany() inserts.
+    """
+    def __init__(self, path, **kwargs):
+        BatchedStore.__init__(self, **kwargs)
+        import sqlite3
+        # Tables are created here; after that only the writer thread uses the connection
+        self.dbconn = sqlite3.connect (path, check_same_thread=False)
+        self.dbconn.execute ("PRAGMA journal_mode=WAL")
+        self.dbconn.execute ("PRAGMA synchronous=NORMAL")
+
+    def open_channel(self, name, values, fmt):
+        table = SQLiteTable(name, values, fmt)
+        for statement in table.create_statements():
+            self.dbconn.execute (statement)
+        self.dbconn.commit()
+        return table
+
+    def write_batch(self, rows):
+        tables = dict()
+        for table,tm,payload in rows:
+            trows = tables.get(table)
+            if trows is None:
+                trows = list()
+                tables[table] = trows
+            trows.append (table.row (tm, payload))
+        with self.dbconn:
+            for table,trows in tables.items():
+                self.dbconn.executemany (table.insert, trows)
+
+    def close(self):
+        BatchedStore.close(self)
+        self.dbconn.close()
@@ -0,0 +1,141 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math, operator
+from array import array
+
+class FIRFilter:
+    """ Finite impulse response filter over a preallocated circular buffer.
+
+    taps[0] weights the newest sample. Until len(taps) samples have been
+    seen the missing history counts as zero, the same as util.FIRFilter.
+    """
+    __slots__ = ('taps', '_rotated', '_history', '_index')
+
+    def __init__(self, taps):
+        self.taps = tuple([float(t) for t in taps])
+        n = len(self.taps)
+        # The taps lined up with the ring buffer for each position of the
+        # newest sample, so a sample is one sum over two existing sequences
+        # with nothing allocated.
+        self._rotated = [self.taps[n - i:] + self.taps[:n - i] for i in range(n)]
+        self._history = [0.0] * n
+        self._index = 0
+
+    def reset(self):
+        self._history = [0.0] * len(self._history)
+        self._index = 0
+
+    def filter(self, x):
+        i = self._index - 1
+        if i < 0:
+            i = len(self.taps) - 1
+        self._index = i
+        h = self._history
+        h[i] = x
+        return sum(map(operator.mul, self._rotated[i], h))
+
+    def state(self):
+        # The latest len(taps) samples, newest first
+        i = self._index
+        return self._history[i:] + self._history[:i]
+
+    def set_state(self, samples):
+        self._history = [float(x) for x in samples]
+        self._index = 0
+
+    def process(self, samples):
+        # Filter a whole sequence, continuing from (and updating) the current state
+        out = array('d')
+        append = out.append
+        mul = operator.mul
+        rotated = self._rotated
+        h = self._history
+        i = self._index
+        last = len(h) - 1
+        for x in samples:
+            i = i - 1 if i else last
+            h[i] = x
+            append (sum(map(mul, rotated[i], h)))
+        self._index = i
+        return out
+
+class BiquadFilter:
+    """ Second order IIR section (transposed direct form II).
+
+    Coefficients are normalized so that a0 == 1:
+    y = b0*x + b1*x[-1] + b2*x[-2] - a1*y[-1] - a2*y[-2]
+    """
+    __slots__ = ('b0', 'b1', 'b2', 'a1', 'a2', '_z1', '_z2')
+
+    def __init__(self, b0, b1, b2, a1, a2):
+        self.b0 = b0
+        self.b1 = b1
+        self.b2 = b2
+        self.a1 = a1
+        self.a2 = a2
+        self.reset()
+
+    @classmethod
+    def lowpass(cls, cutoff, sample_rate, q=math.sqrt(0.5)):
+        # Butterworth response with the default q
+        w0 = 2.0 * math.pi * cutoff / sample_rate
+        alpha = math.sin(w0) / (2.0 * q)
+        cosw0 = math.cos(w0)
+        a0 = 1.0 + alpha
+        b1 = (1.0 - cosw0) / a0
+        return cls(b1 / 2.0, b1, b1 / 2.0, -2.0 * cosw0 / a0, (1.0 - alpha) / a0)
+
+    @classmethod
+    def highpass(cls, cutoff, sample_rate, q=math.sqrt(0.5)):
+        w0 = 2.0 * math.pi * cutoff / sample_rate
+        alpha = math.sin(w0) / (2.0 * q)
+        cosw0 = math.cos(w0)
+        a0 = 1.0 + alpha
+        b1 = -(1.0 + cosw0) / a0
+        return cls(-b1 / 2.0, b1, -b1 / 2.0, -2.0 * cosw0 / a0, (1.0 - alpha) / a0)
+
+    def reset(self, value=0.0):
+        # Settle the state as if value had been the input forever
+        # (steady state gain is (b0+b1+b2) / (1+a1+a2))
+        y = value * (self.b0 + self.b1 + self.b2) / (1.0 + self.a1 + self.a2)
+        self._z1 = y - self.b0 * value
+        self._z2 = self.b2 * value - self.a2 * y
+
+    def state(self):
+        return (self._z1, self._z2)
+
+    def set_state(self, z):
+        self._z1, self._z2 = z
+
+    def filter(self, x):
+        y = self.b0 * x + self._z1
+        self._z1 = self.b1 * x - self.a1 * y + self._z2
+        self._z2 = self.b2 * x - self.a2 * y
+        return y
+
+    def process(self, samples):
+        # Same as filter() on each sample, with the state kept in locals
+        b0,b1,b2,a1,a2 = self.b0, self.b1, self.b2, self.a1, self.a2
+        z1,z2 = self._z1, self._z2
+        out = array('d', bytes(8 * len(samples)))
+        for i,x in enumerate(samples):
+            y = b0 * x + z1
+            z1 = b1 * x - a1 * y + z2
+            z2 = b2 * x - a2 * y
+            out[i] = y
+        self._z1 = z1
+        self._z2 = z2
+        return out
@@ -0,0 +1,83 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math
+from array import array
+
+class RunningStats:
+    """ Streaming statistics over a window of samples.
+
+    Mean and variance are kept with Welford's method, the extremes give
+    the maximum absolute deviation from the mean, and two small fixed
+    buffers (the first and the latest trend_length samples) give the
+    start/end trend. Every add() is O(1) and memory is bounded no matter
+    how many samples are collected before reset().
+    """
+    __slots__ = ('trend_length', 'count', 'mean', '_m2', 'minimum', 'maximum',
+                 '_head', '_tail', '_tail_index')
+
+    def __init__(self, trend_length=3):
+        self.trend_length = trend_length
+        self._head = array('d', [0.0] * trend_length)
+        self._tail = array('d', [0.0] * trend_length)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self._tail_index = 0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        if x < self.minimum:
+            self.minimum = x
+        if x > self.maximum:
+            self.maximum = x
+        if self.count <= self.trend_length:
+            self._head[self.count - 1] = x
+        self._tail[self._tail_index] = x
+        self._tail_index += 1
+        if self._tail_index >= self.trend_length:
+            self._tail_index = 0
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    def max_deviation(self):
+        # The sample furthest from the mean is always one of the extremes
+        if self.count == 0:
+            return 0.0
+        return max(self.maximum - self.mean, self.mean - self.minimum)
+
+    def trend(self):
+        # Absolute difference between the mean of the first and the mean of
+        # the last trend_length samples collected
+        n = min(self.count, self.trend_length)
+        if n == 0:
+            return 0.0
+        beg_mean = sum(self._head[:n]) / n
+        if n < self.trend_length:
+            end_mean = beg_mean
+        else:
+            end_mean = sum(self._tail) / n
+        return abs(end_mean - beg_mean)
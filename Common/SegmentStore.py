@@ -0,0 +1,164 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Append-only, per channel binary event segments.
+#
+# Each channel has its own directory of numbered segment files,
+# <directory>/<channel>/<sequence>.seg, each with a sparse time index
+# beside it in <sequence>.idx.
+#
+# A segment is a header, the channel's format and value names, then fixed
+# width records from DATA_OFFSET on. A record is the time (double) followed
+# by the message exactly as received. The segment is preallocated and
+# memory mapped, so appending is two copies into the mapping and an update
+# of the record count; a crash of the process loses nothing appended.
+#
+# The index holds the time of every INDEX_EVERY'th record, for finding a
+# time range without reading the records before it. It assumes the
+# channel's times do not go backwards.
+
+import os, mmap, struct, zlib
+
+from Common.EventStore import EventStore, EventChannel
+
+MAGIC = b'SEG1'
+# magic, layout crc, record size, capacity (records), first time, count, last time
+HEADER = struct.Struct('<4sIIIdId')
+COUNT_OFFSET = 24
+COUNT = struct.Struct('<Id')
+TIME = struct.Struct('<d')
+SCHEMA_OFFSET = HEADER.size
+DATA_OFFSET = 1024
+INDEX_EVERY = 64
+
+def layout_crc(values, fmt):
+    return zlib.crc32((' '.join(values) + fmt).encode('ascii'))
+
+def segment_name(sequence):
+    return '%08d'%sequence
+
+class SegmentChannel(EventChannel):
+    def __init__(self, directory, name, values, fmt, segment_size):
+        EventChannel.__init__(self, name, values, fmt)
+        self.directory = os.path.join(directory, name)
+        self.record_size = TIME.size + self.size
+        self.capacity = (segment_size - DATA_OFFSET) // self.record_size
+        if self.capacity < INDEX_EVERY:
+            raise RuntimeError ("Segment size %d is too small for channel %s"%(segment_size, name))
+        self.layout = layout_crc(self.values, fmt)
+        self.schema = ('%s\n%s\n'%(fmt, ' '.join(self.values))).encode('ascii')
+        if SCHEMA_OFFSET + len(self.schema) > DATA_OFFSET:
+            raise RuntimeError ("Channel %s has too many values for a segment header"%name)
+        self._map = None
+        os.makedirs (self.directory, exist_ok=True)
+
+        sequences = sorted(int(f[:-4]) for f in os.listdir(self.directory)
+                           if f.endswith('.seg') and f[:-4].isdigit())
+        if not (sequences and self.resume(sequences[-1])):
+            self.create (sequences[-1] + 1 if sequences else 0)
+
+    def paths(self, sequence):
+        base = os.path.join(self.directory, segment_name(sequence))
+        return base + '.seg', base + '.idx'
+
+    def map_files(self, sequence):
+        seg_path,idx_path = self.paths(sequence)
+        self._file = open(seg_path, 'r+b')
+        self._file.truncate (DATA_OFFSET + self.capacity * self.record_size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._index_file = open(idx_path, 'r+b')
+        self._index_file.truncate (((self.capacity + INDEX_EVERY - 1) // INDEX_EVERY) * TIME.size)
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        self.sequence = sequence
+
+    def resume(self, sequence):
+        # Carry on appending to the last segment, if it is this layout and has room
+        seg_path,idx_path = self.paths(sequence)
+        with open(seg_path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            return False
+        magic,layout,record_size,capacity,first,count,last = HEADER.unpack(header)
+        if magic != MAGIC or layout != self.layout or capacity != self.capacity or count >= capacity:
+            return False
+        self.map_files (sequence)
+        self.count = count
+        return True
+
+    def create(self, sequence):
+        seg_path,idx_path = self.paths(sequence)
+        with open(seg_path, 'wb') as f:
+            f.write (HEADER.pack(MAGIC, self.layout, self.record_size, self.capacity, 0.0, 0, 0.0))
+            f.write (self.schema)
+        with open(idx_path, 'wb') as f:
+            pass
+        self.map_files (sequence)
+        self.count = 0
+
+    def append(self, tm, payload):
+        n = self.count
+        if n >= self.capacity:
+            self.rotate()
+            n = 0
+        m = self._map
+        offset = DATA_OFFSET + n * self.record_size
+        TIME.pack_into (m, offset, tm)
+        m[offset + TIME.size:offset + self.record_size] = payload
+        if n % INDEX_EVERY == 0:
+            TIME.pack_into (self._index, (n // INDEX_EVERY) * TIME.size, tm)
+            if n == 0:
+                TIME.pack_into (m, COUNT_OFFSET - TIME.size, tm)
+        self.count = n + 1
+        COUNT.pack_into (m, COUNT_OFFSET, n + 1, tm)
+
+    def rotate(self):
+        self.unmap()
+        self.create (self.sequence + 1)
+
+    def unmap(self):
+        # Gives back the unused part of the segment
+        if self._map is None:
+            return
+        self._map.close()
+        self._file.truncate (DATA_OFFSET + self.count * self.record_size)
+        self._file.close()
+        self._index.close()
+        self._index_file.truncate (((self.count + INDEX_EVERY - 1) // INDEX_EVERY) * TIME.size)
+        self._index_file.close()
+        self._map = None
+
+    def close(self):
+        self.unmap()
+
+class SegmentStore(EventStore):
+    """ Records each channel in append-only segment files under directory.
+    Segments hold up to segment_size bytes.
+    """
+    def __init__(self, directory, segment_size=8 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.channels = list()
+
+    def open_channel(self, name, values, fmt):
+        channel = SegmentChannel(self.directory, name, values, fmt, self.segment_size)
+        self.channels.append (channel)
+        return channel
+
+    def add(self, channel, payload, now):
+        channel.append (channel.timestamp(payload, now), payload)
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
@@ -0,0 +1,161 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math, heapq
+
+import Common.util as util
+
+class WindsAloftIndex:
+    """ Winds aloft reports bucketed on a lat/lng/altitude grid.
+
+    Only the latest report for each reported point (position rounded to
+    0.01 degree, altitude) is kept. Reports older than max_age seconds
+    (relative to the newest report seen) are evicted, as are the oldest
+    reports beyond max_reports.
+
+    estimate() blends the k nearest reports. Nearness is the sum of the
+    horizontal distance over distance_scale (nm), the altitude difference
+    over altitude_scale (feet) and the age over age_scale (seconds).
+    Wind vectors are averaged component wise, weighted 1 / (1 + nearness)^2.
+    """
+    def __init__(self, cell_size=1.0, altitude_band=3000, max_age=3 * 3600.0,
+                 max_reports=2000, distance_scale=30.0, altitude_scale=2000.0,
+                 age_scale=3600.0):
+        self.cell_size = cell_size
+        self.altitude_band = altitude_band
+        self.max_age = max_age
+        self.max_reports = max_reports
+        self.distance_scale = distance_scale
+        self.altitude_scale = altitude_scale
+        self.age_scale = age_scale
+
+        self.cells = dict()         # (lat cell, lng cell, altitude band) -> {point: report}
+        self._expiry = list()       # heap of (time, cell, point)
+        self.newest = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def cell(self, lat, lng, altitude):
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lng / self.cell_size)),
+                int(math.floor(altitude / self.altitude_band)))
+
+    def add(self, lat, lng, altitude, tm, heading, speed):
+        # Stored as (time, lat, lng, altitude, north, east) so blending is a plain sum
+        point = (round(lat, 2), round(lng, 2), altitude)
+        key = self.cell(lat, lng, altitude)
+        bucket = self.cells.get(key)
+        if bucket is None:
+            bucket = dict()
+            self.cells[key] = bucket
+        old = bucket.get(point)
+        if old is not None:
+            if old[0] > tm:
+                return
+        else:
+            self.count += 1
+        direction = heading * util.RAD_DEG
+        bucket[point] = (tm, lat, lng, altitude,
+                         speed * math.cos(direction), speed * math.sin(direction))
+        heapq.heappush(self._expiry, (tm, key, point))
+        if self.newest is None or tm > self.newest:
+            self.newest = tm
+        self.evict()
+
+    def evict(self):
+        expiry = self._expiry
+        while expiry:
+            tm,key,point = expiry[0]
+            if tm >= self.newest - self.max_age and self.count <= self.max_reports:
+                break
+            heapq.heappop(expiry)
+            bucket = self.cells.get(key)
+            if bucket is None:
+                continue
+            report = bucket.get(point)
+            # Skip heap entries for reports that have since been replaced
+            if report is None or report[0] != tm:
+                continue
+            del bucket[point]
+            self.count -= 1
+            if not bucket:
+                del self.cells[key]
+        # Replaced reports leave dead heap entries; rebuild before they pile up
+        if len(expiry) > 2 * self.count + 64:
+            self._expiry = [(r[0], key, point) for key,bucket in self.cells.items()
+                            for point,r in bucket.items()]
+            heapq.heapify(self._expiry)
+
+    def nearness(self, report, lat, lng, altitude, tm, rel_lng):
+        dlat = (report[1] - lat) * 60.0
+        dlng = (report[2] - lng) * 60.0 * rel_lng
+        return math.sqrt(dlat * dlat + dlng * dlng) / self.distance_scale + \
+               abs(report[3] - altitude) / self.altitude_scale + \
+               abs(tm - report[0]) / self.age_scale
+
+    def nearest(self, lat, lng, altitude, tm, k=4, max_rings=3):
+        """ Returns up to k (nearness, report) pairs, nearest first.
+
+        Searches rings of grid cells outwards from the given position, and
+        the altitude bands either side, stopping once a further ring cannot
+        hold anything nearer than the k found so far.
+        """
+        rel_lng = math.cos(lat * util.RAD_DEG)
+        clat,clng,calt = self.cell(lat, lng, altitude)
+        found = list()
+        for ring in range(max_rings + 1):
+            if len(found) >= k:
+                # Closest possible point of this ring, in nearness units
+                gap = (ring - 1) * self.cell_size * 60.0 * min(1.0, rel_lng) / self.distance_scale
+                if gap > found[k - 1][0]:
+                    break
+            for ilat in range(clat - ring, clat + ring + 1):
+                for ilng in range(clng - ring, clng + ring + 1):
+                    if max(abs(ilat - clat), abs(ilng - clng)) != ring:
+                        continue
+                    for ialt in (calt - 1, calt, calt + 1):
+                        bucket = self.cells.get((ilat, ilng, ialt))
+                        if bucket is None:
+                            continue
+                        for report in bucket.values():
+                            found.append((self.nearness(report, lat, lng, altitude, tm, rel_lng),
+                                          report))
+            found.sort(key=lambda f: f[0])
+            del found[k:]
+        return found
+
+    def estimate(self, lat, lng, altitude, tm, k=4):
+        """ Returns (heading, speed, weight) of the blended wind, or None.
+
+        weight is the sum of the report weights, 1.0 for a single report
+        from the same place, altitude and time.
+        """
+        found = self.nearest(lat, lng, altitude, tm, k)
+        if not found:
+            return None
+        north = east = total = 0.0
+        for near,report in found:
+            w = 1.0 / ((1.0 + near) * (1.0 + near))
+            north += report[4] * w
+            east += report[5] * w
+            total += w
+        north /= total
+        east /= total
+        heading = math.atan2(east, north) * util.DEG_RAD
+        if heading < 0:
+            heading += 360.0
+        return heading, math.sqrt(north * north + east * east), total
@@ -16,6 +16,7 @@
 import time, math, copy, logging, functools
 
 import Common.Spatial as Spatial
+from Common.Curve import Curve
 
 logger=logging.getLogger(__name__)
 
@@ -175,6 +176,8 @@ def get_rate(current, desired, time_divisor, limits):
     return rate
 
 def rate_curve(x, curve_pieces):
+    if isinstance(curve_pieces, Curve):
+        return curve_pieces(x)
     last_piece = 0
     sign = 1 if x >= 0 else -1
     x = abs(x)
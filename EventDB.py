@@ -14,55 +14,75 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 import time
-import sys
-
-import psycopg2
+import argparse
 
 from MicroServerComs import MicroServerComs
+from PubSub import MAX_DATA_SIZE
+from Common.EventStore import PostgresStore, SQLiteStore
+from Common.SegmentStore import SegmentStore
 
 class EventDB(MicroServerComs):
-    def __init__(self, dbname, user, table):
-        MicroServerComs.__init__(self, "EventDB", input_mode='list')
-        self.dbconn = psycopg2.connect ("dbname=%s user=%s"%(dbname, user))
-        self.cur = self.dbconn.cursor()
-        self.table = table
+    """ Records every channel it subscribes to in an event store.
 
-    def input(self, channel, input_fields, values):
-        data = [str(round(v,3)) if isinstance(v,float) else str(v)
-                    for infield,v in zip(input_fields,values)
-                    if infield != 'timestamp']
-        data_string = ','.join (data)
-        if 'timestamp' in input_fields:
-            #if not self.table_exists():
-            #    self.create_table()
-            tsindex = input_fields.index('timestamp')
-            tm = values[tsindex]
-            timestamp = time.strftime ('%Y-%m-%d %H:%M:%S.', time.gmtime(tm))
-            seconds_fraction = tm - int(tm)
-            timestamp += str(int(round(seconds_fraction * 1000)))   # Add milliseconds
-            query = "INSERT INTO %s (timestamp, subject, verb, data) VALUES ('%s', '%s', '=', '%s');"%(
-                    self.table, timestamp, channel, data_string)
-        else:
-            query = "INSERT INTO %s (timestamp, subject, verb, data) VALUES ('now', '%s', '=', '%s');"%(
-                        self.table, channel, data_string)
-        self.cur.execute (query)
-        self.dbconn.commit()
+    Messages are handed to the store as received, without unpacking them.
+    """
+    def __init__(self, store):
+        MicroServerComs.__init__(self, "EventDB", input_mode='list')
+        self.store = store
+        self.channels = dict()
+        self.error_count = 0
+        opened = dict()
+        for fd,(s,mychname,from_chname,input_values,input_format,cfg_index) in self.subchannels.items():
+            channel = opened.get(from_chname)
+            if channel is None:
+                channel = store.open_channel (from_chname, input_values, input_format)
+                opened[from_chname] = channel
+            self.channels[fd] = channel
+        store.start()
 
-    def table_exists(self):
-        self.cur.execute ("select relname from pg_class where relname like '%s';"%self.table)
-        try:
-            if self.cur.fetchone():
-                return True
-        except:
-            pass
-        return False
+    def data_ready(self, rfd):
+        channel = self.channels.get(rfd)
+        if channel is None:
+            return
+        s = self.subchannels[rfd][0]
+        payload = s.recv(MAX_DATA_SIZE)
+        if len(payload) != channel.size:
+            self.error_count += 1
+            return
+        self.store.add (channel, payload, time.time())
 
-    def create_table(self):
-        with open("create_events_table.sql", "r") as scmd:
-            query = scmd.readlines()
-            scmd.close()
-            self.cur.execute(query)
+    def close(self):
+        self.store.close()
 
 if __name__ == "__main__":
-    eventdb = EventDB(sys.argv[1], sys.argv[2], sys.argv[3])
-    eventdb.listen()
+    opt = argparse.ArgumentParser(description='Records sensor and control channels')
+    opt.add_argument('database', nargs='+', help='postgres: <dbname> <user> <table prefix>. '
+            'sqlite: <database file>. segment: <directory>')
+    opt.add_argument('-B', '--backend', choices=['postgres', 'sqlite', 'segment'], default='postgres',
+            help='Where to record events')
+    opt.add_argument('-b', '--batch-size', type=int, default=1000, help='Rows per database write')
+    opt.add_argument('-f', '--flush-interval', type=float, default=0.25,
+            help='Longest seconds a row waits to be written')
+    opt.add_argument('-q', '--max-queue', type=int, default=100000,
+            help='Rows held for writing before new ones are dropped')
+    opt.add_argument('-r', '--report-period', type=float, default=10.0,
+            help='Seconds between write rate reports (0 for none)')
+    opt.add_argument('-s', '--segment-size', type=int, default=8,
+            help='Segment file size in megabytes (segment backend)')
+    args = opt.parse_args()
+    nargs = 3 if args.backend == 'postgres' else 1
+    if len(args.database) != nargs:
+        opt.error ("The %s backend takes %d database arguments"%(args.backend, nargs))
+    writer_args = dict(batch_size=args.batch_size, flush_interval=args.flush_interval,
+                       max_queue=args.max_queue, report_period=args.report_period)
+    if args.backend == 'postgres':
+        store = PostgresStore(*args.database, **writer_args)
+    elif args.backend == 'sqlite':
+        store = SQLiteStore(args.database[0], **writer_args)
+    else:
+        store = SegmentStore(args.database[0], args.segment_size * 1024 * 1024)
+    eventdb = EventDB(store)
+    try:
+        eventdb.listen()
+    finally:
+        eventdb.close()
@@ -18,6 +18,7 @@ import logging
 import PID
 import Common.FileConfig as FileConfig
 import Common.util as util
+from Common.Curve import Curve
 
 logger=logging.getLogger(__name__)
 
@@ -119,6 +120,10 @@ class FlightControl(FileConfig.FileConfig):
 
     def initialize(self, filelines):
         self.InitializeFromFileLines(filelines)
+        self.RollCurve = Curve.rate(self.RollCurve)
+        self.ClimbRateCurve = Curve.rate(self.ClimbRateCurve)
+        self.ClimbPitchCurve = Curve.rate(self.ClimbPitchCurve)
+        self.DescentCurve = Curve.rate(self.DescentCurve)
         ms = util.millis(self._sensors.Time())
         self._last_update_time = ms
 
@@ -0,0 +1,443 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# A headless flight model standing in for X-Plane.
+#
+# SimControl and SimSensors take the place of Xplane.XplaneControl and
+# Xplane.XplaneSensors in an aircraft config:
+#   ServoControl FlightSim.SimControl("172.sim", (-122.308, 47.4636), 180.0, 408)
+#   Sensors FlightSim.SimSensors()
+#
+# The aircraft is a point mass with lift, drag and thrust, flying over flat
+# ground at the starting elevation. Pitch follows the elevator as a damped
+# short period oscillation, roll rate follows the aileron, and the rudder
+# makes sideslip, which the side force turns the flight path toward. On the
+# ground the rudder steers the nose wheel.
+#
+# The model runs in frames of 1/rate seconds, keeping up with Common.Clock as
+# the sensors are polled. On the virtual clock (Fly.py -V) a flight takes as
+# long as the computer needs to run it and comes out the same every time.
+
+import math, logging
+
+import Common.FileConfig as FileConfig
+import Common.util as util
+import Common.Clock as Clock
+
+logger=logging.getLogger(__name__)
+
+control = None
+
+G = 9.80665
+SEA_LEVEL_DENSITY = 1.225
+EARTH_RADIUS = 6371000.0
+FEET_METER = util.FEET_METER
+KNOTS_MS = 3600.0 * util.NAUT_MILES_PER_METER
+FPM_MS = 60.0 * FEET_METER
+
+# Control channels, as numbered by Xplane.XplaneControl
+ELEVATOR = 0
+AILERON = 1
+RUDDER = 2
+THROTTLE = 3
+GEAR = 4
+FLAPS = 5
+PARKING_BRAKE = 6
+CHANNEL_COUNT = 7
+
+def density_ratio(altitude):
+    # International standard atmosphere, below the tropopause
+    return (1.0 - 2.25577e-5 * altitude) ** 4.25588
+
+def wrap_degrees(a):
+    return a % 360.0
+
+class AircraftModel(FileConfig.FileConfig):
+    def __init__(self):
+        # Mass and propulsion
+        self.Mass = 1000.0              # kg
+        self.WingArea = 16.0            # square meters
+        self.Engines = 1
+        self.StaticThrust = 2500.0      # Newtons per engine at full throttle, standing still
+        self.ThrustLapse = 0.008        # Fraction of thrust lost per m/s of airspeed
+
+        # Aerodynamics
+        self.CL0 = 0.3                  # Lift coefficient at zero angle of attack
+        self.CLAlpha = 5.0              # Lift coefficient per radian angle of attack
+        self.CLMax = 1.5
+        self.CLFlaps = 0.5              # Lift coefficient added by full flaps
+        self.CD0 = 0.03                 # Drag coefficient with no lift
+        self.CDFlaps = 0.04
+        self.CDGear = 0.0
+        self.InducedDrag = 0.05         # CD = CD0 + InducedDrag * CL^2
+
+        # Attitude response. Control authority goes with dynamic pressure
+        # relative to that at ReferenceSpeed.
+        self.ReferenceSpeed = 50.0      # m/s
+        self.MaxRollRate = 60.0         # degrees per second with full aileron
+        self.RollTimeConstant = 0.3     # seconds
+        self.TrimAlpha = 1.0            # Angle of attack (degrees) the neutral elevator holds
+        self.ElevatorAlpha = 12.0       # Angle of attack (degrees) added by full up elevator
+        self.PitchFrequency = 3.0       # Short period natural frequency, radians per second
+        self.PitchDamping = 0.7
+        self.RudderSlip = 10.0          # Side slip (degrees) held by full rudder
+        self.AileronSlip = 2.0          # Adverse side slip (degrees) of full aileron
+        self.SlipTimeConstant = 0.5     # seconds
+        self.SideForce = 0.3            # Flight path turn rate per degree of side slip, degrees per second
+
+        # Ground handling
+        self.RollingFriction = 0.02
+        self.BrakeFriction = 0.4
+        self.SteeringRate = 15.0        # Degrees per second with full rudder, at SteeringSpeed and above
+        self.SteeringSpeed = 10.0       # m/s
+        self.GroundPitch = 0.0          # Pitch sitting on the wheels, degrees
+        self.MaxSinkRate = 5.0          # Touching down any faster (m/s) is a crash
+        self.MaxTouchdownRoll = 30.0    # degrees
+
+        # Systems
+        self.RetractableGear = False
+        self.GearTime = 8.0             # Seconds to raise or lower the gear
+        self.FlapTime = 10.0            # Seconds for full flap travel
+        self.StepSize = 0.01            # Integration step, seconds
+
+        FileConfig.FileConfig.__init__(self)
+
+    def initialize(self, filelines):
+        self.InitializeFromFileLines(filelines)
+        self.controls = [0.0] * CHANNEL_COUNT
+        self.controls[GEAR] = 1.0
+        self.throttles = [0.0] * self.Engines
+        self.stall_alpha = (self.CLMax - self.CL0) / self.CLAlpha
+
+    # Places the aircraft standing on the ground. position is (longitude, latitude),
+    # heading in true degrees and elevation in feet.
+    def start(self, position, heading, elevation):
+        self.time = 0.0
+        self.longitude,self.latitude = position
+        self.elevation = elevation / FEET_METER
+        self.altitude = self.elevation
+        self.airspeed = 0.0                     # True airspeed, m/s
+        self.heading = heading * util.RAD_DEG   # Where the nose points
+        self.track = self.heading               # Where the aircraft goes
+        self.slip = 0.0                         # degrees
+        self.pitch = self.GroundPitch * util.RAD_DEG
+        self.pitch_rate = 0.0
+        self.roll = 0.0
+        self.roll_rate = 0.0
+        self.flight_path = 0.0
+        self.heading_rate = 0.0                 # degrees per second
+        self.gear = 1.0
+        self.flaps = 0.0
+        self.on_ground = True
+        self.crashed = False
+
+    def lift_coefficient(self, alpha):
+        flaps = self.CLFlaps * self.flaps
+        if alpha > self.stall_alpha:
+            return self.CLMax * 0.75 + flaps
+        elif alpha < -self.stall_alpha:
+            return -self.CLMax * 0.75 + flaps
+        return self.CL0 + self.CLAlpha * alpha + flaps
+
+    def run(self, seconds):
+        steps = max(1, int(round(seconds / self.StepSize)))
+        dt = seconds / steps
+        for i in range(steps):
+            self.step(dt)
+
+    def step(self, dt):
+        self.time += dt
+        if self.crashed:
+            return
+        controls = self.controls
+        self.gear = self.move_toward(self.gear, controls[GEAR] if self.RetractableGear else 1.0, dt / self.GearTime)
+        self.flaps = self.move_toward(self.flaps, controls[FLAPS], dt / self.FlapTime)
+
+        V = self.airspeed
+        sigma = density_ratio(self.altitude)
+        qbar = 0.5 * SEA_LEVEL_DENSITY * sigma * V * V
+        authority = min(sigma * (V / self.ReferenceSpeed) ** 2, 2.0)
+
+        alpha = self.pitch - self.flight_path
+        CL = self.lift_coefficient(alpha)
+        lift = qbar * self.WingArea * CL
+        drag = qbar * self.WingArea * (self.CD0 + self.CDFlaps * self.flaps + self.CDGear * self.gear
+                                       + self.InducedDrag * CL * CL)
+        thrust = sum(self.throttles) * self.StaticThrust * max(0.0, 1.0 - self.ThrustLapse * V) * sigma
+        weight = self.Mass * G
+        up_force = lift + thrust * math.sin(alpha)
+
+        # Pitch, as a damped oscillation toward the angle of attack the elevator holds
+        alpha_set = (self.TrimAlpha + self.ElevatorAlpha * controls[ELEVATOR]) * util.RAD_DEG
+        w = self.PitchFrequency
+        self.pitch_rate += (w * w * authority * (alpha_set - alpha)
+                            - 2.0 * self.PitchDamping * w * math.sqrt(authority) * self.pitch_rate) * dt
+        self.pitch += self.pitch_rate * dt
+
+        if self.on_ground:
+            ground_pitch = self.GroundPitch * util.RAD_DEG
+            if self.pitch <= ground_pitch:
+                self.pitch = ground_pitch
+                self.pitch_rate = max(self.pitch_rate, 0.0)
+            normal = max(0.0, weight - up_force)
+            # What of the weight is still on the wheels brings the nose down
+            self.pitch += (ground_pitch - self.pitch) * normal / weight * dt
+            friction = self.BrakeFriction if controls[PARKING_BRAKE] > 0.5 else self.RollingFriction
+            accel = (thrust * math.cos(alpha) - drag - friction * normal) / self.Mass
+            self.airspeed = max(0.0, V + accel * dt)
+            steering = min(V / self.SteeringSpeed, 1.0)
+            self.heading_rate = self.SteeringRate * steering * controls[RUDDER]
+            self.heading += self.heading_rate * util.RAD_DEG * dt
+            self.track = self.heading
+            self.slip = 0.0
+            self.roll = 0.0
+            self.roll_rate = 0.0
+            if up_force > weight:
+                self.on_ground = False
+                logger.debug ("Simulated aircraft lifted off at %g knots", V * KNOTS_MS)
+        else:
+            V = max(V, 1.0)
+            accel = (thrust * math.cos(alpha) - drag) / self.Mass - G * math.sin(self.flight_path)
+            self.airspeed = max(1.0, V + accel * dt)
+            self.flight_path += ((up_force * math.cos(self.roll) - weight * math.cos(self.flight_path))
+                                  / (self.Mass * V)) * dt
+
+            self.roll_rate += ((self.MaxRollRate * min(authority, 1.5) * controls[AILERON]) * util.RAD_DEG
+                               - self.roll_rate) / self.RollTimeConstant * dt
+            self.roll += self.roll_rate * dt
+
+            slip_authority = min(authority, 1.0)
+            slip_set = slip_authority * (self.RudderSlip * controls[RUDDER] - self.AileronSlip * controls[AILERON])
+            self.slip += (slip_set - self.slip) / self.SlipTimeConstant * dt
+            track_rate = (up_force * math.sin(self.roll) / (self.Mass * V * math.cos(self.flight_path))
+                          + self.SideForce * slip_authority * self.slip * util.RAD_DEG)
+            self.track += track_rate * dt
+            heading = self.track + self.slip * util.RAD_DEG
+            self.heading_rate = (heading - self.heading) * util.DEG_RAD / dt
+            self.heading = heading
+
+        climb = self.airspeed * math.sin(self.flight_path)
+        ground_speed = self.airspeed * math.cos(self.flight_path)
+        self.altitude += climb * dt
+        self.latitude += ground_speed * math.cos(self.track) * dt / EARTH_RADIUS * util.DEG_RAD
+        self.longitude += (ground_speed * math.sin(self.track) * dt
+                           / (EARTH_RADIUS * math.cos(self.latitude * util.RAD_DEG)) * util.DEG_RAD)
+
+        if not self.on_ground and climb < 0 and self.altitude <= self.elevation:
+            self.touchdown (-climb)
+
+    def touchdown(self, sink_rate):
+        self.altitude = self.elevation
+        if sink_rate > self.MaxSinkRate or abs(self.roll) * util.DEG_RAD > self.MaxTouchdownRoll \
+                or self.gear < 1.0:
+            self.crashed = True
+            self.airspeed = 0.0
+            logger.error ("Simulated aircraft crashed at %g fpm, %g degrees roll, gear %g",
+                    sink_rate * FPM_MS, self.roll * util.DEG_RAD, self.gear)
+        else:
+            logger.info ("Simulated aircraft touched down at %g fpm, (%.4f,%.4f)",
+                    sink_rate * FPM_MS, self.longitude, self.latitude)
+        self.on_ground = True
+        self.flight_path = 0.0
+        self.roll = 0.0
+        self.roll_rate = 0.0
+        self.heading = self.track
+
+    def move_toward(self, current, target, most):
+        if target > current:
+            return min(target, current + most)
+        return max(target, current - most)
+
+class SimControl:
+    """ Flies the aircraft described by parameter_file, starting on the ground at position
+    (longitude, latitude), pointing heading (true degrees), on ground at elevation feet.
+    """
+    def __init__(self, parameter_file, position, heading, elevation, magnetic_declination=0.0):
+        global control
+        pfile = open(parameter_file, 'r')
+        lines = pfile.readlines()
+        pfile.close()
+        self.model = AircraftModel()
+        self.model.initialize(lines)
+        self.model.start(position, heading, elevation)
+        self.magnetic_declination = magnetic_declination
+        self.ServoRange = (-1.0, 1.0)
+        self._lookup_tables = list()
+        self._throttle_table = None
+        control = self
+
+    def SetThrottleTable(self, table):
+        self._throttle_table = table
+
+    def SetLookupTable(self, channel, table):
+        while len(self._lookup_tables) <= channel:
+            self._lookup_tables.append(None)
+        self._lookup_tables[channel] = table
+
+    def GetLimits(self, channel):
+        if channel < 0 or channel >= len(self._lookup_tables) or self._lookup_tables[channel] == None:
+            raise RuntimeError ("Invalid channel set (%d)"%channel)
+        mn = 9999999
+        mx = -9999999
+        for k,v in self._lookup_tables[channel]:
+            mn = mn if mn < k else k
+            mx = mx if mx > k else k
+        return (mn,mx)
+
+    def SetAnalogChannel(self, channel, val):
+        if channel < 0 or channel >= CHANNEL_COUNT:
+            raise RuntimeError ("Invalid channel set (%d)"%channel)
+        logger.log (3, "Setting channel %d to %g", channel, val)
+        self.model.controls[channel] = val
+        if channel == THROTTLE:
+            self.model.throttles = [val] * self.model.Engines
+
+    def SetDigitalChannel(self, channel, val):
+        self.SetAnalogChannel (channel, val)
+
+    def SetThrottles(self, throttles):
+        logger.log (3, "Setting throttles to %s", str(throttles))
+        self.model.throttles = list(throttles[:self.model.Engines])
+
+    # The model reads the controls when it next runs
+    def Flush(self):
+        pass
+
+    def initialize(self, filelines):
+        return
+
+class SimSensors:
+    """ Reads the simulated aircraft flown by SimControl. Each Poll() runs it up to
+        the last whole frame of 1/rate seconds on the clock.
+    """
+    def __init__(self, rate=20):
+        self.SamplesPerSecond = rate
+        self._frames = 0
+        self._start = 0.0
+
+    def initialize(self, known_altitude=None, given_barometer=None, winds=None):
+        global control
+        self.model = control.model
+        self.magnetic_declination = control.magnetic_declination
+        self._start = Clock.time()
+
+    def WaitSensorsGreen(self):
+        self.Poll()
+
+    def Poll(self):
+        frames = int((Clock.time() - self._start) * self.SamplesPerSecond + 1e-6)
+        while self._frames < frames:
+            self.model.run (1.0 / self.SamplesPerSecond)
+            self._frames += 1
+
+    def WaitFrame(self, timeout):
+        wait = self._start + (self._frames + 1) / self.SamplesPerSecond - Clock.time()
+        if wait > timeout:
+            Clock.sleep(timeout)
+            return False
+        Clock.sleep(wait)
+        return True
+
+    def Altitude(self):
+        return self.model.altitude * FEET_METER
+
+    def Heading(self):
+        return wrap_degrees(self.TrueHeading() + self.magnetic_declination)
+
+    def Roll(self):
+        return self.model.roll * util.DEG_RAD
+
+    def RollRate(self):
+        return self.model.roll_rate * util.DEG_RAD
+
+    def Pitch(self):
+        return self.model.pitch * util.DEG_RAD
+
+    def PitchRate(self):
+        return self.model.pitch_rate * util.DEG_RAD
+
+    def Yaw(self):
+        return self.model.slip
+
+    def AirSpeed(self):
+        m = self.model
+        return m.airspeed * math.sqrt(density_ratio(m.altitude)) * KNOTS_MS
+
+    def GroundSpeed(self):
+        m = self.model
+        return m.airspeed * math.cos(m.flight_path) * KNOTS_MS
+
+    def ClimbRate(self):
+        m = self.model
+        return m.airspeed * math.sin(m.flight_path) * FPM_MS
+
+    def Position(self):
+        return (self.model.longitude, self.model.latitude)
+
+    def HeadingRateChange(self):
+        return self.model.heading_rate
+
+    def TrueHeading(self):
+        return wrap_degrees(self.model.heading * util.DEG_RAD)
+
+    def MagneticDeclination(self):
+        return self.magnetic_declination
+
+    def Time(self):
+        return self.model.time
+
+    # Actual flight path in true coordinates
+    def GroundTrack(self):
+        return wrap_degrees(self.model.track * util.DEG_RAD)
+
+    def WindSpeed(self):
+        return 0.0
+
+    def WindDirection(self):
+        return 0.0
+
+    def AGL(self):
+        m = self.model
+        return (m.altitude - m.elevation) * FEET_METER
+
+    def GearUpLocked(self):
+        return self.model.gear == 0.0 or not self.model.RetractableGear
+
+    def FlapPosition(self):
+        return self.model.flaps
+
+    def OuterEnginePosition(self):
+        return 0
+
+    def Battery(self):
+        return 100
+
+    def EnginesOut(self):
+        return 0
+
+    def Snapshot(self):
+        m = self.model
+        return str({"Time": m.time, "Altitude": self.Altitude(), "AGL": self.AGL(), "AirSpeed": self.AirSpeed(),
+                    "ClimbRate": self.ClimbRate(), "Heading": self.Heading(), "Pitch": self.Pitch(),
+                    "Roll": self.Roll(), "Yaw": self.Yaw(), "Position": self.Position(), "OnGround": m.on_ground})
+
+    def KnownAltitude(self, alt):
+        pass
+
+    def KnownMagneticVariation(self, v):
+        pass
+
+    def FlightMode (self, mode, vertical=True):
+        pass
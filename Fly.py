@@ -16,13 +16,14 @@
 
 
 import os
-import sys,  time
+import sys
 import argparse
 import logging
 
 import Airplane, Globals
 import Common.PIDOptimizer as PIDOptimizer
 import Common.Optimizer as Optimizer
+import Common.Clock as Clock
 import Test.UnitTestFixture as UnitTestFixture
 
 args = None
@@ -45,6 +46,10 @@ if '__main__' == __name__:
     opt.add_argument('-b', '--barometer', default=None, type=float, help='The given barometric pressure in inches of mercury')
     opt.add_argument('-s', '--wind-speed', default=None, type=int, help='The current wind speed in knots')
     opt.add_argument('--wind-heading', default=None, type=int, help='The current wind heading in degrees')
+    opt.add_argument('-e', '--event-driven', action='store_true', help='Run each control cycle as a new attitude frame arrives')
+    opt.add_argument('-d', '--deadline', default=.1, type=float, help='The longest seconds between control cycles')
+    opt.add_argument('-t', '--time-limit', default=None, type=float, help='Stop after this many seconds of sensor time')
+    opt.add_argument('-V', '--virtual-clock', action='store_true', help='Run on a virtual clock, as fast as the simulation allows')
     args = opt.parse_args()
 
     if args.home:
@@ -55,6 +60,8 @@ if '__main__' == __name__:
             sys.exit(1)
     rootlogger = logging.getLogger()
     rootlogger.setLevel(args.log_level)
+    if args.virtual_clock:
+        Clock.use(Clock.VirtualClock())
 
     dist_path = '/usr/local/lib/python2.7/dist-packages'
     if os.path.isdir(dist_path):
@@ -135,8 +142,15 @@ if '__main__' == __name__:
             dispatch_command_number = len(craft.FlightPlan) - 1
     craft._flight_plan_index = dispatch_command_number
     craft.DispatchCommand (craft.FlightPlan[dispatch_command_number])
-    while True:
+    missed_frames = 0
+    stop_time = None if args.time_limit is None else craft._sensors.Time() + args.time_limit
+    while stop_time is None or craft._sensors.Time() < stop_time:
         craft.Update()
         if args.unit_test:
             UnitTestFixture.Update()
-        time.sleep(.1)
+        if args.event_driven:
+            if not craft._sensors.WaitFrame(args.deadline):
+                missed_frames += 1
+                rootlogger.debug("No attitude frame within %g seconds (%d missed)", args.deadline, missed_frames)
+        else:
+            Clock.sleep(args.deadline)
@@ -1,19 +1,24 @@
 import math
 
 from Common.util import DEG_RAD
+from Common.Curve import Curve
 from MicroServerComs import MicroServerComs
 
 class GroundRoll(MicroServerComs):
     def __init__(self, accelerometer_calibration):
         self.accelerometer_calibration = accelerometer_calibration
+        self._accelerometer_curves = None
+        if isinstance(accelerometer_calibration, dict):
+            self._accelerometer_curves = [Curve.rate(accelerometer_calibration[a]) for a in 'xyz']
         MicroServerComs.__init__(self, "GroundRoll")
 
     def updated(self, channel):
         if self.a_z != 0:
-            if isinstance(self.accelerometer_calibration, dict):
-                self.a_x = util.rate_curve (self.a_x, self.accelerometer_calibration['x'])
-                self.a_y = util.rate_curve (self.a_y, self.accelerometer_calibration['y'])
-                self.a_z = util.rate_curve (self.a_z, self.accelerometer_calibration['z'])
+            if self._accelerometer_curves is not None:
+                cx,cy,cz = self._accelerometer_curves
+                self.a_x = cx (self.a_x)
+                self.a_y = cy (self.a_y)
+                self.a_z = cz (self.a_z)
             self.ground_roll = (math.atan2(float(self.a_z), float(self.a_x)) - math.pi / 2) * DEG_RAD
             self.timestamp = self.accelerometers_updated
             self.publish ()
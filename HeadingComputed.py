@@ -13,7 +13,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-from Common.util import DEG_RAD, rate_curve
+from Common.util import DEG_RAD
+from Common.Curve import Curve
 import math
 
 from MicroServerComs import MicroServerComs
@@ -21,6 +22,10 @@ from MicroServerComs import MicroServerComs
 class HeadingComputed(MicroServerComs):
     def __init__(self, heading_calibration):
         self.heading_calibration = heading_calibration
+        self._compass_correction = None
+        if isinstance(heading_calibration, dict):
+            # Compass calibration tables are dense and usually evenly spaced
+            self._compass_correction = Curve.rate(heading_calibration['compass_correction'])
         MicroServerComs.__init__(self, "HeadingComputed")
 
     def updated(self, channel):
@@ -39,8 +44,8 @@ class HeadingComputed(MicroServerComs):
     def _calibrated_heading(self, heading):
         # In each table, estimate the calibrated heading
         # estimate calibrated heading through a piece wise linear function
-        if isinstance(self.heading_calibration, dict):
-            heading = rate_curve (heading, self.heading_calibration['compass_correction'])
+        if self._compass_correction is not None:
+            heading = self._compass_correction (heading)
         return heading
 
 if __name__ == "__main__":
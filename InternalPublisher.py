@@ -13,13 +13,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import select, time
+import select
+
+import Common.Clock as Clock
 
 TheInternalPublisher = None
 
 class InternalPublisher:
-    def __init__(self, config):
+    def __init__(self, config, left_out=()):
         self.channels = dict()
+        # Functions deliberately not run in this configuration (e.g. RunMicroServices --ahrs)
+        self.left_out = set(left_out)
         self.pending_channels = list()
         self.config = config
         self.external_subscriptions = dict()
@@ -40,7 +44,9 @@ class InternalPublisher:
                 continue
             target_name = pipe['function']
             if not target_name in self.channels:
-                raise RuntimeError ("Internal publish: listener not found")
+                if target_name in self.left_out:
+                    continue
+                raise RuntimeError ("Internal publish: listener %s not found"%target_name)
             if not target_name in self.config:
                 raise RuntimeError ("Internal publish: listener config not found")
             target = self.channels[target_name]
@@ -58,7 +64,7 @@ class InternalPublisher:
                     target_property = v
                 setattr (target, target_property, val)
                 if not timestamped:
-                    setattr (target, ts_name, time.time())
+                    setattr (target, ts_name, Clock.time())
             self.pending_channels.append ((target_name,source_name))
         self.propagate()
 
@@ -18,6 +18,8 @@ import logging, math
 import PID
 import Common.FileConfig as FileConfig
 import Common.util as util
+from Common.Curve import Curve
+from Common.Filters import FIRFilter
 
 logger=logging.getLogger(__name__)
 
@@ -72,7 +74,7 @@ class LandingControl(FileConfig.FileConfig):
 
         # Operational properties
         self._SlipPID = None
-        self._slip_history = list()
+        self._slip_history = FIRFilter(util.LowPassFIR)
         self._last_side_error = 0.0
         self._attitude_control = att_cont
         self._flight_control = flight_cont
@@ -89,6 +91,9 @@ class LandingControl(FileConfig.FileConfig):
 
     def initialize(self, filelines):
         self.InitializeFromFileLines(filelines)
+        self.FlareDescentCurve = Curve.rate(self.FlareDescentCurve)
+        self.FlarePowerCurve = Curve.rate(self.FlarePowerCurve)
+        self.SideSlipCurve = Curve.rate(self.SideSlipCurve)
         if self.ApproachAirSpeed == 0:
             self.ApproachAirSpeed = self._callback.StallSpeed * 1.7
         if self.PatternAirSpeed == 0:
@@ -295,7 +300,7 @@ class LandingControl(FileConfig.FileConfig):
 
     def Stop(self):
         self._SlipPID.SetMode (PID.MANUAL, 0,0)
-        self._slip_history = list()
+        self._slip_history.reset()
         self._flight_control.Stop()
         self._flight_control.SetCallback (self._callback)
         if self._journal_file:
@@ -341,7 +346,7 @@ class LandingControl(FileConfig.FileConfig):
                 relative_ground_track += 360
             shift_rate = ground_speed * math.sin(relative_ground_track * util.RAD_DEG)
             shift_rate *= util.FEET_NM / (3600.0) # nm / hour --> feet / s
-            shift_rate = util.LowPassFilter (shift_rate, self._slip_history)
+            shift_rate = self._slip_history.filter (shift_rate)
             self._last_side_error = side
             desired_shift_rate = util.rate_curve (side, self.SideSlipCurve)
             self._SlipPID.SetSetPoint (desired_shift_rate, 2.0)
@@ -368,7 +373,7 @@ class LandingControl(FileConfig.FileConfig):
         # TODO: Make go-around decision
         logger.info ("Beginning touchdown flare")
         self._flarePitchPID.SetMode (PID.AUTOMATIC,
-                                    self._sensors.ClimbRate(), self._last_desired_pitch)
+                                    self._sensors.ClimbRate(), self._sensors.Pitch())
         self._flight_control.SetCallback (self._callback)
         self._flight_control.Stop()
         self._flight_mode = SUBMODE_FLARE
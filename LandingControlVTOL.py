@@ -18,6 +18,7 @@ import logging
 import Common.FileConfig as FileConfig
 import Globals
 import Common.util as util
+from Common.Curve import Curve
 
 logger=logging.getLogger(__name__)
 
@@ -87,6 +88,7 @@ class LandingControlVTOL(FileConfig.FileConfig):
 
     def initialize(self, filelines):
         self.InitializeFromFileLines(filelines)
+        self.CorrectionCurve = Curve.rate(self.CorrectionCurve)
 
     # Notifies that the take off roll has accompished enough speed that flight controls
     # have responsibility and authority. Activates PIDs.
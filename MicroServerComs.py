@@ -13,14 +13,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import socket, select, struct, time
+import socket, select, struct, os
 import yaml
 
 from PubSub import MAX_DATA_SIZE, CONFIG_FILE
 import InternalPublisher
+from Common.Checkpoint import Checkpoint
+import Common.Clock as Clock
 _pubsub_config = None
 
 class MicroServerComs:
+    # State worth keeping across a restart, described like output_values and
+    # format. Subclasses that have some set these. See enable_checkpoint.
+    checkpoint_values = None
+    checkpoint_format = None
+    _checkpoint = None
+
     def __init__(self, function, input_mode='injection', channel=None, timeout=None, config=None):
         global _pubsub_config
         self.pubchannel = None
@@ -108,6 +116,29 @@ class MicroServerComs:
     def __str__(self):
         return "%s: pub=%s, subs=%s"%(self.function, str(self.pubchannel), str(self.subchannels))
 
+    def enable_checkpoint(self, directory, max_age, period=1.0, name=None):
+        # Restores the checkpoint_values from directory if saved within the last
+        # max_age seconds, then saves them at most every period seconds as the
+        # service publishes. Returns True if the state was restored.
+        if self.checkpoint_values is None:
+            return False
+        if name is None:
+            name = self.function
+        self._checkpoint = Checkpoint (os.path.join(directory, name + '.ckpt'),
+                self.checkpoint_values, self.checkpoint_format, period)
+        if self._checkpoint.restore (self, max_age):
+            self.checkpoint_restored()
+            return True
+        return False
+
+    def checkpoint_restored(self):
+        pass
+
+    # Called on each publish. A service that publishes through helpers calls it itself.
+    def save_checkpoint(self):
+        if self._checkpoint is not None:
+            self._checkpoint.maybe_save (self)
+
     def listen(self, timeout=None, loop=True):
         rsocks = list(self.subchannels.keys())
         if self.pubchannel is not None:
@@ -161,7 +192,7 @@ class MicroServerComs:
                     else:
                         self.inject (vname, value, cfg_index)
                 if not timestamped:
-                    self.inject (ts_name, time.time(), cfg_index)
+                    self.inject (ts_name, Clock.time(), cfg_index)
                 if self.multi_receiver:
                     self.updated (from_chname, cfg_index)
                 else:
@@ -170,6 +201,7 @@ class MicroServerComs:
                 self.input (from_chname, input_values, values_list)
 
     def publish(self,debug=False):
+        self.save_checkpoint ()
         if self.has_external_listeners:
             if self.pubchannel is None:
                 raise RuntimeError ("Function %s has no pub channel"%self.function)
@@ -14,39 +14,136 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 
-import time, sys
-import threading
+import sys, math, random, csv, heapq
+import argparse
 
 import yaml
 
 from MicroServerComs import MicroServerComs
+import Common.Clock as Clock
+
+# Sequence types, selected with the 'type' key of a sequence (default step):
+#   step:  {value: [...], duration: n}
+#   ramp:  {type: ramp, value: [...], to: [...], duration: n}
+#          Linear from value to 'to'. Without 'to', ramps to the start of the next sequence.
+#   sine:  {type: sine, value: [...], amplitude: [...], wave_period: s, phase: deg, duration: n}
+#          value is the center line. wave_period is in seconds of simulated time.
+#   csv:   {type: csv, file: name.csv, duration: n}
+#          One row per sample, one column per value. duration defaults to the number of rows.
+# Any sequence may also carry 'noise: sigma' (scalar or one per value) to add gaussian noise.
+# duration is always in mock periods. The literal 'time' in a value list is replaced
+# by the publish time.
+
+def _per_value(x, n):
+    if isinstance(x, (list, tuple)):
+        if len(x) != n:
+            raise RuntimeError ("Sequence parameter %s does not match %d values"%(str(x), n))
+        return list(x)
+    return [x] * n
+
+def _csv_field(f):
+    f = f.strip()
+    if f == 'time':
+        return f
+    return float(f)
+
+class MockSequence:
+    def __init__(self, seq, period, rand):
+        self.period = period
+        self.rand = rand
+        self.start = seq.get('value')
+        self.duration = seq.get('duration', 1)
+        noise = seq.get('noise')
+        self.noise = None if noise is None else _per_value(noise, len(self.start))
+
+    def link(self, next_seq):
+        pass
+
+    def waveform(self, i):
+        return self.start
+
+    def value(self, i):
+        ret = self.waveform(i)
+        if self.noise is not None:
+            ret = [v if v == 'time' or sigma == 0 else v + self.rand.gauss(0.0, sigma)
+                    for v,sigma in zip(ret, self.noise)]
+        return ret
 
-class MockDataSet:
-    def __init__(self, cfg):
-        self.sequences = cfg
-
+class RampSequence(MockSequence):
+    def __init__(self, seq, period, rand):
+        MockSequence.__init__(self, seq, period, rand)
+        self.end = seq.get('to')
+
+    def link(self, next_seq):
+        if self.end is None:
+            self.end = next_seq.start
+
+    def waveform(self, i):
+        frac = float(i) / self.duration
+        return [a if a == 'time' else a + (b - a) * frac for a,b in zip(self.start, self.end)]
+
+class SineSequence(MockSequence):
+    def __init__(self, seq, period, rand):
+        MockSequence.__init__(self, seq, period, rand)
+        self.amplitude = _per_value(seq['amplitude'], len(self.start))
+        self.omega = 2.0 * math.pi / seq['wave_period']
+        self.phase = seq.get('phase', 0.0) * math.pi / 180.0
+
+    def waveform(self, i):
+        s = math.sin(self.omega * i * self.period + self.phase)
+        return [c if c == 'time' else c + a * s for c,a in zip(self.start, self.amplitude)]
+
+class CSVSequence(MockSequence):
+    def __init__(self, seq, period, rand):
+        with open(seq['file'], 'r') as f:
+            self.rows = [[_csv_field(v) for v in row] for row in csv.reader(f)
+                            if len(row) > 0 and not row[0].startswith('#')]
+        if len(self.rows) == 0:
+            raise RuntimeError ("No samples in mock data file %s"%seq['file'])
+        seq = dict(seq)
+        seq['value'] = self.rows[0]
+        seq.setdefault('duration', len(self.rows))
+        MockSequence.__init__(self, seq, period, rand)
+
+    def waveform(self, i):
+        return self.rows[i % len(self.rows)]
+
+sequence_types = {'step': MockSequence, 'ramp': RampSequence, 'sine': SineSequence, 'csv': CSVSequence}
+
+def make_sequence(seq, period, rand):
+    seq_type = seq.get('type', 'step')
+    if not seq_type in sequence_types:
+        raise RuntimeError ("Unknown mock sequence type %s"%seq_type)
+    return sequence_types[seq_type](seq, period, rand)
 
 class MockRawData(MicroServerComs):
-    def __init__(self, data_name, dcfg, tm = time.time()):
+    def __init__(self, data_name, dcfg, tm=None, speedup=1.0, config=None, seed=None):
         self.mock_period = 0
         self.cur_seq = 0
         self.cur_period = 0
+        self.sent_count = 0
+        self.missed_count = 0
 
+        if tm is None:
+            tm = Clock.time()
         self.channel = data_name
-        self.mock_period = dcfg['period']
+        self.mock_period = dcfg['period'] / speedup
         self.next_time = tm + self.mock_period
         self.function = dcfg['function']
-        self.sequences = dcfg['sequences']
+        # Each channel's noise comes from its own generator, derived from the seed and its name
+        rand = random.Random(None if seed is None else "%d %s"%(seed, data_name))
+        self.sequences = [make_sequence(seq, dcfg['period'], rand) for seq in dcfg['sequences']]
+        for i,seq in enumerate(self.sequences):
+            seq.link(self.sequences[(i + 1) % len(self.sequences)])
 
-        MicroServerComs.__init__(self, self.function, channel=self.channel)
+        MicroServerComs.__init__(self, self.function, channel=self.channel, config=config)
         print ("MockRawData init complete. pub = %s, output values = %s"%(self.pubchannel, self.output_values))
 
     def get_next(self):
         seq = self.sequences [self.cur_seq]
-        ret = seq['value']
-        # Future: add the ability to plot functions and smooth transitions between sequences
+        ret = seq.value(self.cur_period)
         self.cur_period += 1
-        if self.cur_period >= seq['duration']:
+        if self.cur_period >= seq.duration:
             self.cur_period = 0
             self.cur_seq += 1
             if self.cur_seq >= len(self.sequences):
@@ -64,8 +161,8 @@ class MockRawData(MicroServerComs):
                     setattr (self, attrname, self.next_time)
                 else:
                     setattr (self, attrname, val)
-            print ("mock %s sending data"%self.function)
             self.publish ()
+            self.sent_count += 1
             self.increment_time(tm)
 
     def increment_time(self, tm):
@@ -74,26 +171,67 @@ class MockRawData(MicroServerComs):
         while nxt < tm:
             nxt += self.mock_period
             self.get_next()
+            self.missed_count += 1
         self.next_time = nxt
 
-def run_mock_data(mock):
+def run_mock_data(mocks, duration=None, report_period=None):
+    # All mocks run from one thread, in order of their next publish time.
+    # The index breaks ties so mocks themselves are never compared.
+    heap = [(m.peek_next_time(), i, m) for i,m in enumerate(mocks)]
+    heapq.heapify(heap)
+    start = Clock.time()
+    endtime = None if duration is None else start + duration
+    next_report = None if report_period is None else start + report_period
     while True:
-        next_time = mock.peek_next_time()
-        sleep_time = (next_time - time.time())
+        next_time,i,mock = heap[0]
+        now = Clock.time()
+        if endtime is not None and now >= endtime:
+            break
+        if next_report is not None and now >= next_report:
+            report_counts(mocks, now - next_report + report_period)
+            next_report = now + report_period
+        sleep_time = next_time - now
         if sleep_time > 0:
-            time.sleep(sleep_time)
-        mock.send_data(time.time())
+            Clock.sleep(sleep_time)
+            now = Clock.time()
+        mock.send_data(now)
+        heapq.heapreplace(heap, (mock.peek_next_time(), i, mock))
+
+def report_counts(mocks, elapsed):
+    sent = sum([m.sent_count for m in mocks])
+    missed = sum([m.missed_count for m in mocks])
+    print ("mock data: %g messages/s, %d periods missed"%(sent / elapsed, missed))
+    sys.stdout.flush()
+    for m in mocks:
+        m.sent_count = 0
+        m.missed_count = 0
 
 
 if __name__ == "__main__":
-    with open(sys.argv[1], "r") as yml:
+    opt = argparse.ArgumentParser(description='Publish mock raw sensor data')
+    opt.add_argument('mock_config', help='Mock data sequences (e.g. raw_sensors_mock.yml)')
+    opt.add_argument('-s', '--speedup', type=float, default=1.0,
+            help='Divide every mock period by this factor, for load testing')
+    opt.add_argument('-d', '--duration', type=float, default=None, help='Seconds to run (default forever)')
+    opt.add_argument('-r', '--report-period', type=float, default=None,
+            help='Print the aggregate publish rate every so many seconds')
+    opt.add_argument('-p', '--pubsub-config', default=None, help='pubsub config to use instead of the default')
+    opt.add_argument('--seed', type=int, default=None, help='Random seed for sequence noise')
+    opt.add_argument('-V', '--virtual-clock', action='store_true',
+            help='Publish on a virtual clock, as fast as possible, with time starting at 0')
+    args = opt.parse_args()
+
+    pubsub_config = None
+    if args.pubsub_config is not None:
+        with open(args.pubsub_config, "r") as yml:
+            pubsub_config = yaml.load(yml)
+            yml.close()
+    with open(args.mock_config, "r") as yml:
         cfg = yaml.load(yml)
         yml.close()
-        print ("cfg=" + str(cfg))
-        mocks = list()
-        for dn,dcfg in cfg.items():
-            mock = threading.Thread (target=run_mock_data, args=(MockRawData(dn, dcfg),))
-            mock.start()
-            mocks.append(mock)
-        for m in mocks:
-            m.join()
+    print ("cfg=" + str(cfg))
+    if args.virtual_clock:
+        Clock.use(Clock.VirtualClock())
+    tm = Clock.time()
+    mocks = [MockRawData(dn, dcfg, tm, args.speedup, pubsub_config, args.seed) for dn,dcfg in cfg.items()]
+    run_mock_data(mocks, args.duration, args.report_period)
@@ -18,6 +18,9 @@ import Globals
 from MicroServerComs import MicroServerComs
 
 class Pitch(MicroServerComs):
+    checkpoint_values = ['pitch', 'pitch_confidence']
+    checkpoint_format = 'dd'
+
     def __init__(self, cor_rate=1.0, conf_mult=1.0):
         MicroServerComs.__init__(self, "Pitch")
         self.last_time = None
@@ -0,0 +1,121 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math
+
+import Common.util as util
+from MicroServerComs import MicroServerComs
+
+# Dead reckons position between GPS fixes (about 1 Hz), so consumers get a
+# fresh position at the heading (control loop) rate.
+# Between fixes the ground vector is the air vector (true heading, true airspeed)
+# plus the current wind estimate. Without fresh air data it falls back to the
+# last GPS ground vector. Each fix resets the position to the fix, projected
+# forward by the fix's age.
+class Position(MicroServerComs):
+    def __init__(self, conf_mult=1.0, half_life=5.0, rate=20.0, stale_time=2.0):
+        MicroServerComs.__init__(self, "Position")
+        self.gps_utc = None
+        self.gps_lat = None
+        self.gps_lng = None
+        self.gps_ground_speed = None
+        self.gps_ground_track = None
+        self.gps_signal_quality = None
+        self.heading = None
+        self.gps_magnetic_variation = 0.0
+        self.airspeed = None
+        self.cas2tas = None
+        self.wind_heading = 0
+        self.wind_speed = 0
+        self.Heading_updated = None
+        self.Airspeed_updated = None
+
+        self.timestamp = None
+        self.position_lat = None
+        self.position_lng = None
+        self.position_ground_speed = None
+        self.position_ground_track = None
+        self.position_confidence = 0.0
+        self._fix_confidence = 0.0
+
+        self.confidence_multiplier = conf_mult
+        # Seconds without a fix for the confidence to drop by half
+        self.confidence_half_life = half_life
+        self.publish_period = 1.0 / rate
+        # Air data older than this (seconds) is not used for dead reckoning
+        self.stale_time = stale_time
+        self._last_publish = None
+
+    def updated(self, channel):
+        if channel == 'gpsfeed':
+            if self.gps_signal_quality > 0:
+                self.take_fix()
+        elif channel == 'Heading':
+            if self.timestamp is not None and self.Heading_updated > self.timestamp:
+                self.dead_reckon(self.Heading_updated)
+                if self._last_publish is None or \
+                        self.timestamp - self._last_publish >= self.publish_period:
+                    self.publish_position()
+
+    def ground_vector(self, tm):
+        # Returns (speed knots, true track degrees)
+        if self.heading is not None and self.airspeed is not None and \
+                self.cas2tas is not None and \
+                tm - self.Heading_updated < self.stale_time and \
+                tm - self.Airspeed_updated < self.stale_time:
+            tas = self.airspeed * self.cas2tas
+            true_heading = (self.heading - self.gps_magnetic_variation) * util.RAD_DEG
+            wind_heading = self.wind_heading * util.RAD_DEG
+            north = tas * math.cos(true_heading) + self.wind_speed * math.cos(wind_heading)
+            east = tas * math.sin(true_heading) + self.wind_speed * math.sin(wind_heading)
+            track = math.atan2(east, north) * util.DEG_RAD
+            if track < 0:
+                track += 360.0
+            return math.sqrt(north * north + east * east), track
+        return float(self.gps_ground_speed), float(self.gps_ground_track)
+
+    def take_fix(self):
+        self.position_lat = self.gps_lat
+        self.position_lng = self.gps_lng
+        self.timestamp = self.gps_utc
+        self._fix_confidence = self.gps_signal_quality * self.confidence_multiplier
+        # Catch up to the latest air data, so the fix's latency is not lost
+        if self.Heading_updated is not None and self.Heading_updated > self.gps_utc:
+            self.dead_reckon(self.Heading_updated)
+        else:
+            self.position_ground_speed, self.position_ground_track = self.ground_vector(self.gps_utc)
+            self.position_confidence = self._fix_confidence
+        self.publish_position()
+
+    def dead_reckon(self, tm):
+        self.position_ground_speed, self.position_ground_track = self.ground_vector(tm)
+        dt = tm - self.timestamp
+        if dt > 0:
+            distance = self.position_ground_speed * dt / 3600.0
+            self.position_lng, self.position_lat = util.AddPosition(
+                    (self.position_lng, self.position_lat), distance, self.position_ground_track)
+        self.timestamp = tm
+        age = max(0.0, tm - self.gps_utc)
+        self.position_confidence = self._fix_confidence * \
+                0.5 ** (age / self.confidence_half_life)
+
+    def publish_position(self):
+        self._last_publish = self.timestamp
+        self.publish ()
+
+
+if __name__ == "__main__":
+    pos = Position()
+    pos.listen()
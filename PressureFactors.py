@@ -16,6 +16,7 @@
 import math
 
 import Common.util as util
+from Common.Curve import Curve
 
 from MicroServerComs import MicroServerComs
 
@@ -25,6 +26,9 @@ PRESSURE_DIVISOR=.0065
 PRESSURE_POWER=5.25588
 
 class PressureFactors(MicroServerComs):
+    checkpoint_values = ['sea_level_pressure', 'standard_sea_level_temp', 'cas2tas']
+    checkpoint_format = 'ddd'
+
     def __init__(self, pressure_calibration):
         MicroServerComs.__init__(self, "PressureFactors")
         self.known_altitude = None
@@ -35,6 +39,9 @@ class PressureFactors(MicroServerComs):
         self.static_pressure = None
         self.standard_sea_level_temp = None
         self.pressure_calibration = pressure_calibration
+        self._pressure_curve = None
+        if isinstance(pressure_calibration, dict):
+            self._pressure_curve = Curve.rate(pressure_calibration['pressure_calibration'])
         # TODO: publish confidence level based on recency and relevance of inputs
 
     def updated(self, channel):
@@ -45,9 +52,8 @@ class PressureFactors(MicroServerComs):
             self.sea_level_pressure = (self.given_barometer * KPA_INHG)
 
         if self.static_pressure is not None:
-            if isinstance(self.pressure_calibration,dict):
-                self.static_pressure = util.rate_curve (self.static_pressure,
-                        self.pressure_calibration['pressure_calibration'])
+            if self._pressure_curve is not None:
+                self.static_pressure = self._pressure_curve (self.static_pressure)
 
         if self.known_altitude is not None and self.static_pressure is not None and \
                 self.temperature is not None:
@@ -32,11 +32,16 @@ def run_channel (*args, **kwargs):
     select_list = list()
     exception_list = list()
     subs = dict()
+    pub_ports = set()
     if pubs_cfg is not None:
         for pipe in pubs_cfg:
             protocol = pipe['protocol']
             if protocol == 'udp':
                 port = pipe['port']
+                # Alternative publishers of a channel may share its port
+                if port in pub_ports:
+                    continue
+                pub_ports.add (port)
                 usock = socket.socket (type=socket.SOCK_DGRAM)
                 try:
                     usock.bind(('',port))
@@ -54,6 +54,11 @@ class RAIS(MicroServerComs):
         self.gps_ground_track = None
         self.gps_signal_quality = None
         self.gps_magnetic_variation = None
+        self.position_lat = None
+        self.position_lng = None
+        self.position_ground_speed = None
+        self.position_ground_track = None
+        self.position_confidence = None
         self.update_period = 1.0/30.0
         self.callback = None
 
@@ -72,6 +77,15 @@ class RAIS(MicroServerComs):
                 self.callback ("LONG", self.gps_lng)
                 self.callback ("TIMEZ", time.asctime(time.gmtime(self.gps_utc)))
                 self.callback ("TRACKM", self.gps_ground_track + self.gps_magnetic_variation)
+            elif channel == "Attitude":         # Combined quaternion AHRS output
+                self.callback ("PITCH", self.pitch)
+                self.callback ("ROLL", self.roll)
+                self.callback ("YAW", self.yaw)
+            elif channel == "Position":         # Dead reckoned between GPS fixes
+                self.callback ("GS", self.position_ground_speed)
+                self.callback ("TRACK", self.position_ground_track)
+                self.callback ("LAT", self.position_lat)
+                self.callback ("LONG", self.position_lng)
 
     def AreSensorsGreen(self):
         ret = not (self.altitude is None or 
@@ -12,236 +12,266 @@
 # GNU General Public License for more details.
 # 
 # You should have received a copy of the GNU General Public License
-# along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import sys, time
+import sys, time, math, struct, re, operator
 
+import numpy
 import yaml
 
 from MicroServerComs import MicroServerComs
+from PubSub import MAX_DATA_SIZE
+
+_format_item = re.compile(r'(\d*)([a-zA-Z?])')
+
+def reading_dtype(names, fmt):
+    """ A numpy structured dtype laid out byte for byte as struct packs fmt,
+    so a received message can be copied straight into an array row.
+    """
+    offsets = list()
+    formats = list()
+    prefix = ''
+    for count,code in _format_item.findall(fmt):
+        if code == 'x':
+            prefix += count + code
+            continue
+        item = count + code
+        offsets.append (struct.calcsize(prefix + item) - struct.calcsize(item))
+        if code == 's':
+            formats.append ('S%s'%(count if count else '1'))
+        elif count:
+            raise RuntimeError ("Repeat count in channel format %s not supported"%fmt)
+        else:
+            formats.append (code)
+        prefix += item
+    if len(formats) != len(names):
+        raise RuntimeError ("Channel format %s does not match values %s"%(fmt, names))
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                        'itemsize': struct.calcsize(fmt)})
+
+class ChannelVotes:
+    """ The latest reading and the voting state of every input pipeline for
+    one channel. Readings are rows of a structured array with the channel's
+    own layout. History is a fixed size ring of events per pipeline, with an
+    exponentially decayed running sum of their penalties.
+    """
+    def __init__(self, name, values, fmt, pipelines, interval):
+        self.name = name
+        self.values = list(values)
+        self.format = fmt
+        self.dtype = reading_dtype(self.values, fmt)
+        self.readings = numpy.zeros(pipelines, self.dtype)
+        size = self.dtype.itemsize
+        raw = memoryview(self.readings.view(numpy.uint8))
+        self.rows = [raw[i * size:(i + 1) * size] for i in range(pipelines)]
+
+        self.confidence_values = [v for v in self.values if 'confidence' in v]
+        for vname in self.values:
+            if not ('confidence' in vname or 'timestamp' in vname):
+                # The prime output value, that redundant pipelines are compared by
+                self.data_value = vname
+                break
+        else:
+            raise RuntimeError ("No data output found in channel %s"%name)
+
+        self.lost_after = interval * RAISDiscriminator.LOST_SIGNAL_INTERVALS
+        self.received = numpy.zeros(pipelines, bool)
+        self.local_time = numpy.zeros(pipelines)
+        self.lost = numpy.zeros(pipelines, bool)
+        self.failing = numpy.zeros(pipelines, bool)
+        self.fail_confidence = numpy.zeros(pipelines)
+        self.penalty = numpy.zeros(pipelines)
+        self.penalty_time = numpy.zeros(pipelines)
+        self.history = numpy.zeros((pipelines, RAISDiscriminator.HISTORY_SIZE),
+                                   RAISDiscriminator.HISTORY_DTYPE)
+        self.history_next = [0] * pipelines
+        self.favored = None
+
+    def record(self, idx, event, confidence, tm, penalty):
+        self.penalty[idx] = self.penalty[idx] * \
+                math.exp((self.penalty_time[idx] - tm) * RAISDiscriminator.DECAY_RATE) + penalty
+        self.penalty_time[idx] = tm
+        i = self.history_next[idx]
+        self.history[idx, i] = (event, confidence, tm)
+        self.history_next[idx] = (i + 1) % RAISDiscriminator.HISTORY_SIZE
+
+    def latest_event(self, idx):
+        # (event, confidence, time) of the latest history entry
+        return self.history[idx, self.history_next[idx] - 1].item()
+
+    def scores(self, now):
+        # Score of every pipeline, higher is better. -inf for those never heard.
+        score = -self.penalty * numpy.exp((self.penalty_time - now) * RAISDiscriminator.DECAY_RATE)
+        score -= numpy.where(self.failing, (10.0 - self.fail_confidence) *
+                RAISDiscriminator.CONFIDENCE_SCORE_FINAL_WEIGHT, 0.0)
+        score -= numpy.where(self.lost, RAISDiscriminator.LOST_SIGNAL_SCORE_FINAL_WEIGHT, 0.0)
+        data = self.readings[self.data_value].astype(float)
+        heard = data[self.received]
+        n = len(heard)
+        if n >= 3:
+            # Upper median, found by selection rather than a sort
+            median = numpy.partition(heard, n // 2)[n // 2]
+            variance = numpy.abs(data - median)
+            if median != 0:
+                variance /= abs(median)
+            # Readings away from the median count against a pipeline
+            score -= variance * RAISDiscriminator.VARIANCE_SCORE_WEIGHT
+        score[~self.received] = -numpy.inf
+        return score
 
 class RAISDiscriminator(MicroServerComs):
     LOST_SIGNAL_INTERVALS=10
-    HIST_LOST_SIGNAL='LOST'
-    HIST_ACQUIRED_SIGNAL='ACQ'
-    HIST_CONFIDENCE_FAIL='FAIL'
-    HIST_CONFIDENCE_GOOD='GOOD'
+    HIST_NONE = 0
+    HIST_LOST_SIGNAL = 1
+    HIST_ACQUIRED_SIGNAL = 2
+    HIST_CONFIDENCE_FAIL = 3
+    HIST_CONFIDENCE_GOOD = 4
+    HIST_NAMES = ('', 'LOST', 'ACQ', 'FAIL', 'GOOD')
+    HISTORY_DTYPE = numpy.dtype([('event', 'u1'), ('confidence', 'f4'), ('time', 'f8')])
     LOW_CONFIDENCE_THRESHOLD = 4.0
     LOST_SIGNAL_SCORE_WEIGHT = 10.0
     CONFIDENCE_SCORE_WEIGHT = 1.0
     LOST_SIGNAL_SCORE_FINAL_WEIGHT = 100.0
     CONFIDENCE_SCORE_FINAL_WEIGHT = 10.0
     VARIANCE_SCORE_WEIGHT=1.0
+    HISTORY_SIZE = 32           # Entries kept per input pipeline and channel
+    SCORE_HALF_LIFE = 300.0     # Seconds for a past failure to count half as much
+    DECAY_RATE = math.log(2.0) / SCORE_HALF_LIFE
 
     def __init__(self, inputs_config, outputs_config):
         MicroServerComs.__init__(self, "RAISDiscriminator", config=inputs_config)
-        self.gps_magnetic_variation = dict()
-        self.altitude = dict()
-        self.altitude_confidence = dict()
-        self.Altitude_updated = dict()
-        self.Altitude_updated_local_time = dict()
-        self.airspeed = dict()
-        self.airspeed_confidence = dict()
-        self.airspeed_is_estimated = dict()
-        self.Airspeed_updated = dict()
-        self.Airspeed_updated_local_time = dict()
-        self.heading = dict()
-        self.heading_confidence = dict()
-        self.Heading_updated = dict()
-        self.Heading_updated_local_time = dict()
-        self.roll_rate = dict()
-        self.roll_rate_confidence = dict()
-        self.RollRate_updated = dict()
-        self.RollRate_updated_local_time = dict()
-        self.roll = dict()
-        self.roll_confidence = dict()
-        self.Roll_updated = dict()
-        self.Roll_updated_local_time = dict()
-        self.pitch = dict()
-        self.pitch_confidence = dict()
-        self.Pitch_updated = dict()
-        self.Pitch_updated_local_time = dict()
-        self.pitch_rate = dict()
-        self.pitch_rate_confidence = dict()
-        self.PitchRate_updated = dict()
-        self.PitchRate_updated_local_time = dict()
-        self.yaw = dict()
-        self.yaw_confidence = dict()
-        self.Yaw_updated = dict()
-        self.Yaw_updated_local_time = dict()
-        self.climb_rate = dict()
-        self.climb_rate_confidence = dict()
-        self.ClimbRate_updated = dict()
-        self.ClimbRate_updated_local_time = dict()
-        self.turn_rate = dict()
-        self.turn_rate_confidence = dict()
-        self.TurnRate_updated = dict()
-        self.TurnRate_updated_local_time = dict()
-        self.gps_utc = dict()
-        self.gps_lat = dict()
-        self.gps_lng = dict()
-        self.gps_ground_speed = dict()
-        self.gps_ground_track = dict()
-        self.ground_vector_confidence = dict()
-        self.GroundVector_updated = dict()
-        self.GroundVector_updated_local_time = dict()
-
-        self.history = dict()
-        self.input_map = dict()
-        self.favored_channel = dict()
+        if isinstance(inputs_config, list):
+            pipelines = len(inputs_config)
+        else:
+            pipelines = 1
+        self.channels = dict()
         for sock,mychan,fromchan,output_values,fmt,idx in self.subchannels.values():
-            self.input_map[fromchan] = output_values
-            self.favored_channel[fromchan] = None
+            if not fromchan in self.channels:
+                interval = 0.1
+                if 'gps' in output_values[0]:
+                    interval = 1.0
+                self.channels[fromchan] = ChannelVotes(fromchan, output_values, fmt,
+                                                       pipelines, interval)
+        self._scratch = bytearray(MAX_DATA_SIZE)
+        self._scratch_view = memoryview(self._scratch)
+        self.error_count = 0
 
-        self._publisher = RAISPublisher(outputs_config)
+        self._publisher = RAISPublisher(outputs_config, self.channels)
 
-    def updated(self, channel, idx):
-        self.update_history (channel, idx)
-        self.update_discriminator (channel, idx)
-        self.output (channel)
+    def data_ready(self, rfd):
+        # Messages are copied straight into the channel's array, no injection
+        s,mychname,channel,input_values,input_format,idx = self.subchannels[rfd]
+        votes = self.channels[channel]
+        n = s.recv_into (self._scratch)
+        row = votes.rows[idx]
+        if n != len(row):
+            self.error_count += 1
+            print ("RAISDiscriminator: %d byte message on %s, expected %d"%(n, channel, len(row)))
+            return
+        row[:] = self._scratch_view[:n]
+        self.updated (votes, idx)
 
-    def update_history(self, channel, idx):
+    def updated(self, votes, idx):
+        now = time.time()
+        self.update_history (votes, idx, now)
+        self.update_discriminator (votes, idx, now)
+        self.output (votes)
+
+    def update_history(self, votes, idx, now):
         # Check for lost feeds
-        ts_name = channel + '_updated_local_time'
-        d = getattr(self, ts_name)
-        latest = time.time()
-        d[idx] = latest
-        interval = 0.1
-        if 'gps' in self.input_map[channel][0]:
-            interval = 1.0
-        for a,tm in d.items():
-            if a == idx:
-                continue
-            tdiff = latest - tm
-            if tdiff > interval * RAISDiscriminator.LOST_SIGNAL_INTERVALS:
-                self.append_history(idx, channel,
-                        (RAISDiscriminator.HIST_LOST_SIGNAL, latest))
-            elif self.get_latest_history(idx, channel)[0] == \
-                    RAISDiscriminator.HIST_LOST_SIGNAL:
-                self.append_history(idx, channel,
-                        (RAISDiscriminator.HIST_ACQUIRED_SIGNAL, latest))
+        votes.received[idx] = True
+        votes.local_time[idx] = now
+        if votes.lost[idx]:
+            votes.lost[idx] = False
+            votes.record (idx, RAISDiscriminator.HIST_ACQUIRED_SIGNAL, 0.0, now, 0.0)
+        newly_lost = numpy.flatnonzero(votes.received & ~votes.lost &
+                                       (now - votes.local_time > votes.lost_after))
+        for a in newly_lost:
+            votes.lost[a] = True
+            votes.record (a, RAISDiscriminator.HIST_LOST_SIGNAL, 0.0, now,
+                          RAISDiscriminator.LOST_SIGNAL_SCORE_WEIGHT)
 
         # Check confidence from latest update
-        for vname in self.input_map[channel]:
-            if 'confidence' in vname:
-                confidence = getattr(self,vname)[idx]
-                if confidence < RAISDiscriminator.LOW_CONFIDENCE_THRESHOLD:
-                    if self.get_latest_history(idx, channel)[0] == \
-                            RAISDiscriminator.HIST_CONFIDENCE_FAIL:
-                        if confidence < self.history[channel][idx][-1][1]:
-                            self.history[channel][idx][-1] = \
-                                    (RAISDiscriminator.HIST_CONFIDENCE_FAIL, confidence, latest)
-                    else:
-                        self.append_history(idx, channel,
-                                (RAISDiscriminator.HIST_CONFIDENCE_FAIL,
-                                    confidence, latest))
-                elif self.get_latest_history(idx, channel)[0] == \
-                        RAISDiscriminator.HIST_CONFIDENCE_FAIL:
-                    self.append_history(idx, channel,
-                            (RAISDiscriminator.HIST_CONFIDENCE_GOOD,
-                                confidence, latest))
-
-    def append_history(self, idx, channel, entry):
-        if not channel in self.history:
-            self.history[channel] = dict()
-        if not idx in self.history[channel]:
-            self.history[channel][idx] = list()
-        self.history[channel][idx].append (entry)
-
-    def get_latest_history(self, idx, channel):
-        if not channel in self.history:
-            return ('',0)
-        if not idx in self.history[channel]:
-            return ('',0)
-        if len(self.history[channel][idx]) == 0:
-            return ('',0)
-        return self.history[channel][idx][-1]
-
-    def update_discriminator(self, channel, idx):
-        if self.favored_channel[channel] == None:
-            self.favored_channel[channel] = idx    # Anything is better than nothing
-        else:
-            h = self.get_latest_history (idx, channel)
-
-            # Find the prime output value dictionary
-            for vname in self.input_map[channel]:
-                if not ('confidence' in vname or 'timestamp' in vname):
-                    data_vname = vname
-                    break
-            else:
-                raise RuntimeError ("No data output found in channel %s"%channel)
-            d = getattr(self, data_vname)
-            # Find the median reading
-            if len(d) > 2:
-                # We've got 3 or more redundant sensor arrays
-                readings = [r for r in d.values()]
-                readings.sort()
-                median = readings[len(d) / 2]
-            else:
-                median = None
-            if h[0] == RAISDiscriminator.HIST_CONFIDENCE_FAIL or \
-                    h[0] == RAISDiscriminator.HIST_LOST_SIGNAL:
-                # Currently favored channel is suspect. See if there's another better
-                options = [(self.score_history(ad, channel) +
-                            self.score_variance (d, ad, median), ad)
-                                    for ad in self.history[channel].keys()]
-                options.sort(reverse=True)  # Descending scores, first is best
-                if self.favored_channel[channel] != options[0][1]:
-                    print ("RAISDiscriminator: favoring input pipeline %s for %s"%(
-                                self.favored_channel[channel], channel))
-                    self.favored_channel[channel] = options[0][1]
+        if votes.confidence_values:
+            row = votes.readings[idx]
+            confidence = min([row[vname] for vname in votes.confidence_values])
+            if confidence < RAISDiscriminator.LOW_CONFIDENCE_THRESHOLD:
+                if votes.failing[idx]:
+                    worse = votes.fail_confidence[idx] - confidence
+                    if worse > 0:
+                        # Still failing, but worse. Charge the difference.
+                        votes.fail_confidence[idx] = confidence
+                        votes.record (idx, RAISDiscriminator.HIST_CONFIDENCE_FAIL, confidence, now,
+                                      worse * RAISDiscriminator.CONFIDENCE_SCORE_WEIGHT)
+                else:
+                    votes.failing[idx] = True
+                    votes.fail_confidence[idx] = confidence
+                    votes.record (idx, RAISDiscriminator.HIST_CONFIDENCE_FAIL, confidence, now,
+                            (10.0 - confidence) * RAISDiscriminator.CONFIDENCE_SCORE_WEIGHT)
+            elif votes.failing[idx]:
+                votes.failing[idx] = False
+                votes.record (idx, RAISDiscriminator.HIST_CONFIDENCE_GOOD, confidence, now, 0.0)
 
-    def score_history (self, idx, channel):
-        ret = 0.0
-        last_entry = None
-        if idx in self.history[channel]:
-            for entry in self.history[channel][idx]:
-                if entry[0] == RAISDiscriminator.HIST_CONFIDENCE_FAIL:
-                    ret -= (10.0 - entry[1]) * RAISDiscriminator.CONFIDENCE_SCORE_WEIGHT
-                if entry[0] == RAISDiscriminator.HIST_LOST_SIGNAL:
-                    ret -= RAISDiscriminator.LOST_SIGNAL_SCORE_WEIGHT
-                last_entry = entry
-        if last_entry is not None:
-            if last_entry[0] == RAISDiscriminator.HIST_CONFIDENCE_FAIL:
-                ret -= (10.0 - last_entry[1]) * RAISDiscriminator.CONFIDENCE_SCORE_FINAL_WEIGHT
-            if last_entry[0] == RAISDiscriminator.HIST_LOST_SIGNAL:
-                ret -= RAISDiscriminator.LOST_SIGNAL_FINAL_SCORE_WEIGHT
-        return ret
+    def update_discriminator(self, votes, idx, now):
+        if votes.favored is None:
+            votes.favored = idx    # Anything is better than nothing
+        elif votes.failing[votes.favored] or votes.lost[votes.favored]:
+            # Currently favored channel is suspect. See if there's another better
+            best = int(numpy.argmax(votes.scores(now)))
+            if votes.favored != best:
+                votes.favored = best
+                print ("RAISDiscriminator: favoring input pipeline %s for %s"%(best, votes.name))
 
-    def score_variance (self, d, idx, median):
-        if (median is not None) and idx in d:
-            variance = abs(d[idx] - median) / median
-            return variance * RAISDiscriminator.VARIANCE_SCORE_WEIGHT
-        else:
-            return 0.0
-
-    def output(self, channel):
-        ts_name = channel + '_updated'
-        #print ("channel %s updating"%channel)
-        for vname in self.input_map[channel]:
-            attrname = vname
-            if 'timestamp' in vname:
-                attrname = ts_name
-            setattr (self._publisher, attrname,
-                    getattr(self, attrname)[self.favored_channel[channel]])
-        self._publisher.pub_channel (channel)
+    def output(self, votes):
+        self._publisher.pub_row (votes, votes.favored)
 
 class RAISPublisher:
-    def __init__(self, config):
+    """ Sends the favored pipeline's reading of each channel on to the
+    output config's channel of the same name.
+
+    Output channels are resolved once, at startup. When the output layout is
+    the input layout (the usual case) the stored row is sent as it is.
+    Otherwise the values are picked out by position and packed with a
+    precompiled struct.
+    """
+    def __init__(self, config, channels):
         self.config = config
         self.outputs = dict()
+        for name,votes in channels.items():
+            self.outputs[name] = self.compile_channel (votes)
 
-    def pub_channel (self, channel):
-        if not channel in self.outputs:
-            self.outputs[channel] = MicroServerComs(channel, config=self.config)
-        o = self.outputs[channel]
-        ts_name = channel + '_updated'
+    def compile_channel(self, votes):
+        # Returns (send, pack, pick), with pack None to send the raw row,
+        # or None when nothing listens to this channel
+        if self.config is None or not votes.name in self.config:
+            return None
+        o = MicroServerComs(votes.name, config=self.config)
+        if not o.has_external_listeners:
+            return None
+        if o.pubchannel is None:
+            raise RuntimeError ("Function %s has no pub channel"%votes.name)
+        send = o.pubchannel.send
+        if list(o.output_values) == votes.values and o.output_format == votes.format:
+            return (send, None, None)
         for vname in o.output_values:
-            invname = vname
-            if 'timestamp' == vname:
-                invname = ts_name
-            setattr (o, vname, getattr(self, invname))
-        o.publish()
+            if not vname in votes.values:
+                raise RuntimeError ("RAIS output %s value %s is not an input"%(votes.name, vname))
+        positions = [votes.values.index(vname) for vname in o.output_values]
+        if len(positions) == 1:
+            index = positions[0]
+            pick = lambda row: (row[index],)
+        else:
+            pick = operator.itemgetter(*positions)
+        return (send, struct.Struct(o.output_format).pack, pick)
+
+    def pub_row(self, votes, idx):
+        out = self.outputs.get(votes.name)
+        if out is None:
+            return
+        send,pack,pick = out
+        if pack is None:
+            send (votes.rows[idx])
+        else:
+            send (pack(*pick(votes.readings[idx].item())))
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -17,6 +17,9 @@ import Globals
 from MicroServerComs import MicroServerComs
 
 class Roll(MicroServerComs):
+    checkpoint_values = ['roll', 'roll_confidence']
+    checkpoint_format = 'dd'
+
     def __init__(self, cor_rate=1.0, conf_mult=1.0):
         MicroServerComs.__init__(self, "Roll")
         self.last_time = None
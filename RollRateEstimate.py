@@ -15,12 +15,16 @@
 
 
 import Common.util as util
+from Common.Filters import FIRFilter
 from MicroServerComs import MicroServerComs
 
 class RollRateEstimate(MicroServerComs):
+    checkpoint_values = ['_roll']
+    checkpoint_format = '%dd'%len(util.LowPassFIR)
+
     def __init__(self):
         MicroServerComs.__init__(self, "RollRateEstimate")
-        self._roll = list()
+        self._roll = FIRFilter(util.LowPassFIR)
         self.last_roll = None
         self.last_time = None
 
@@ -29,7 +33,7 @@ class RollRateEstimate(MicroServerComs):
         if self.last_roll is not None:
             timediff = self.timestamp - self.last_time
             current_roll_rate = (self.roll_estimate - self.last_roll) / timediff
-            self.roll_rate_estimate = util.LowPassFilter (current_roll_rate, self._roll)
+            self.roll_rate_estimate = self._roll.filter (current_roll_rate)
             self.publish ()
             print ("RollRateEstimate: %g => %g"%(self.roll_estimate, self.roll_rate_estimate))
         self.last_time = self.timestamp
@@ -43,14 +43,35 @@ from ClimbRate import ClimbRate
 from GroundVector import GroundVector
 from ClimbRateEstimate import ClimbRateEstimate
 from PitchRate import PitchRate
+from Position import Position
+from Attitude import Attitude
+from VerticalKalman import VerticalKalman
 import InternalPublisher
 import MicroServerComs
 from PubSub import CONFIG_FILE
 
-def run_service(so):
-    so.listen()
+# The functions of each --ahrs and --vertical alternative, so that the
+# internal publisher knows which listeners are left out on purpose
+ATTITUDE_FUNCTIONS = {
+    'quaternion': ['Attitude'],
+    'euler': ['PitchEstimate', 'GroundRoll', 'RollEstimate', 'RollRateEstimate', 'TurnRateComputed',
+              'Pitch', 'Roll', 'Yaw', 'RollRate', 'TurnRate', 'PitchRate', 'TrackRate'],
+}
+VERTICAL_FUNCTIONS = {
+    'kalman': ['VerticalKalman', 'KalmanAltitude', 'KalmanClimbRate'],
+    'fir': ['Altitude', 'ClimbRate'],
+}
 
-if __name__ == "__main__":
+def left_out_functions(ahrs, vertical):
+    ret = list()
+    for choice,alternatives in ((ahrs, ATTITUDE_FUNCTIONS), (vertical, VERTICAL_FUNCTIONS)):
+        for name,functions in alternatives.items():
+            if name != choice:
+                ret += functions
+    return ret
+
+def arg_parser():
+    # Also used by RunRAIS.py to see which services its pipelines run
     opt = argparse.ArgumentParser(description=
             'Run the microservices necessary for a complete, self checking AHRS computation pipeline')
     opt.add_argument('-p', '--pubsub-config', default=CONFIG_FILE,
@@ -63,13 +84,29 @@ if __name__ == "__main__":
             help='YAML config file altitude calibration curve')
     opt.add_argument('-c', '--accelerometer-calibration', default='accelerometer_calibration.yml',
             help='YAML config file accelerometer calibration curve')
+    opt.add_argument('--ahrs', choices=['euler', 'quaternion'], default='euler',
+            help='Attitude from the separate per axis services, or the combined quaternion filter')
+    opt.add_argument('--vertical', choices=['fir', 'kalman'], default='fir',
+            help='Altitude and climb rate from the filtered baro difference, or the baro/accelerometer/GPS Kalman filter')
+    opt.add_argument('--checkpoint-dir', default=None,
+            help='Directory to keep service state in, for a warm start after a restart')
+    opt.add_argument('--checkpoint-max-age', type=float, default=60.0,
+            help='Seconds old a checkpoint can be and still be restored')
+    opt.add_argument('--checkpoint-period', type=float, default=1.0, help='Seconds between checkpoint saves')
+    return opt
+
+def run_service(so):
+    so.listen()
+
+if __name__ == "__main__":
+    opt = arg_parser()
     args = opt.parse_args()
 
     with open (args.pubsub_config, 'r') as yml:
         MicroServerComs._pubsub_config = yaml.load(yml)
         yml.close()
     InternalPublisher.TheInternalPublisher = InternalPublisher.InternalPublisher(
-            MicroServerComs._pubsub_config)
+            MicroServerComs._pubsub_config, left_out_functions(args.ahrs, args.vertical))
     airspeed_config = None
     if os.path.exists(args.airspeed_config):
         with open (args.airspeed_config, 'r') as yml:
@@ -91,31 +128,44 @@ if __name__ == "__main__":
             accelerometer_calibration = yaml.load(yml)
             yml.close()
 
-    service_objects = [
+    if args.ahrs == 'quaternion':
+        attitude_services = [Attitude()]
+    else:
+        attitude_services = [
                  PitchEstimate(accelerometer_calibration)
                 ,GroundRoll(accelerometer_calibration)
                 ,RollEstimate()
                 ,RollRateEstimate()
                 ,TurnRateComputed()
-                ,HeadingComputed(heading_calibration)
                 ,Pitch()
                 ,Roll()
                 ,Yaw()
-                ,Heading()
                 ,RollRate()
+                ,TurnRate()
+                ,PitchRate()
+                ,TrackRate()
+                ]
+    if args.vertical == 'kalman':
+        vertical_services = [VerticalKalman()]
+    else:
+        vertical_services = [Altitude(), ClimbRate()]
+    service_objects = attitude_services + vertical_services + [
+                 HeadingComputed(heading_calibration)
+                ,Heading()
                 ,HeadingTasEstimate()
                 ,WindEstimate()
                 ,PressureFactors(pressure_calibration)
                 ,AirspeedComputed(airspeed_config)
                 ,AirspeedEstimate()
                 ,AltitudeComputed(pressure_calibration)
-                ,TrackRate()
-                ,TurnRate()
                 ,Airspeed()
-                ,Altitude()
-                ,ClimbRate()
                 ,GroundVector()
                 ,ClimbRateEstimate()
-                ,PitchRate()
+                ,Position()
                 ]
+    if args.checkpoint_dir is not None:
+        os.makedirs (args.checkpoint_dir, exist_ok=True)
+        for so in service_objects:
+            if so.enable_checkpoint (args.checkpoint_dir, args.checkpoint_max_age, args.checkpoint_period):
+                print ("%s: warm start"%so.function)
     InternalPublisher.TheInternalPublisher.listen()
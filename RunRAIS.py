@@ -0,0 +1,418 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Runs N redundant sensor processing pipelines and the RAISDiscriminator
+# voting between them.
+#
+# Each pipeline gets a copy of the template pubsub config with every UDP port
+# moved to its own range, its own PubSub.py hub, its own RunMicroServices.py
+# and, optionally, its own sensor source. The processes of a pipeline are
+# pinned to one core.
+# The pipeline port ranges, and one more for the RAIS output channels, are
+# kept out of the local (ephemeral) port range, where the connected UDP
+# sockets of the other processes get their ports.
+# For mock sources every address is rewritten to localhost, since the whole
+# pipeline then runs on this host.
+# The launcher also subscribes to one output channel of every pipeline (by
+# default the attitude channel of the --ahrs the pipelines run) and reports
+# each pipeline's CPU use and its latency from sensor timestamp to that output.
+# The RAIS output config is rewritten so that its subscribers inside the
+# pipelines (PressureFactors for the given barometer) exist once per pipeline,
+# and gets its own PubSub.py hub. Its consumers (Display, autopilot, EventDB)
+# take their ports from the rewritten copy in --config-dir.
+
+import sys, os, time, copy, shlex, socket, struct, select, subprocess
+import argparse
+
+import yaml
+
+from PubSub import CONFIG_FILE, MAX_DATA_SIZE
+import RunMicroServices
+
+MONITOR_FUNCTION = 'RAISMonitor'
+LOCAL_PORT_RANGE_FILE = '/proc/sys/net/ipv4/ip_local_port_range'
+
+def udp_ports(config):
+    ports = set()
+    for chcfg in config.values():
+        for pipes in (chcfg['pubs'], chcfg['subs']):
+            for pipe in (pipes or []):
+                if pipe['protocol'] == 'udp':
+                    ports.add (pipe['port'])
+    return ports
+
+def port_stride(ports):
+    # Smallest round offset that keeps the port ranges apart
+    span = max(ports) - min(ports) + 1
+    return ((span + 999) // 1000) * 1000
+
+def local_port_range():
+    # Where the kernel picks ports for unbound sockets; the IANA range where it does not say
+    try:
+        with open(LOCAL_PORT_RANGE_FILE, 'r') as f:
+            low,high = f.read().split()
+        return int(low), int(high)
+    except (OSError, ValueError):
+        return 49152, 65535
+
+def port_offsets(ports, count, stride, base, reserved):
+    # Offsets for count copies of ports: the lowest port at base, base + stride, ...
+    # skipping any range that overlaps reserved
+    low,high = min(ports), max(ports)
+    offsets = list()
+    first = base
+    while len(offsets) < count:
+        last = first + high - low
+        if last > 65535:
+            raise RuntimeError ("%d port ranges %d apart do not fit in the port space outside %d-%d"%(
+                count, stride, reserved[0], reserved[1]))
+        if last < reserved[0] or first > reserved[1]:
+            offsets.append (first - low)
+        first += stride
+    return offsets
+
+def add_monitor(config, channel, left_out=()):
+    # Subscribe the launcher to one output channel, on a port the template does not use
+    chcfg = config.get(channel)
+    if chcfg is None or not chcfg['pubs']:
+        raise RuntimeError ("Monitor channel %s is not published"%channel)
+    if all([pipe['function'] in left_out for pipe in chcfg['pubs']]):
+        raise RuntimeError ("Monitor channel %s is not published by the services the pipelines run"%channel)
+    used = udp_ports(config)
+    port = chcfg['pubs'][0]['port'] + 9
+    while port in used:
+        port += 1
+    if chcfg['subs'] is None:
+        chcfg['subs'] = list()
+    chcfg['subs'].append ({'addr': 'localhost', 'port': port, 'protocol': 'udp',
+                           'function': MONITOR_FUNCTION})
+    return port
+
+def pipeline_config(template, offset, local=False):
+    # local puts every end on this host, for sources that run here
+    config = copy.deepcopy(template)
+    for chcfg in config.values():
+        for pipes in (chcfg['pubs'], chcfg['subs']):
+            for pipe in (pipes or []):
+                if pipe['protocol'] == 'udp':
+                    pipe['port'] += offset
+                    if local:
+                        pipe['addr'] = 'localhost'
+    return config
+
+def port_map(config):
+    # channel -> {function: port}, for the record
+    ret = dict()
+    for chname,chcfg in config.items():
+        ports = dict()
+        for pipes in (chcfg['pubs'], chcfg['subs']):
+            for pipe in (pipes or []):
+                if pipe['protocol'] == 'udp':
+                    ports[pipe['function']] = pipe['port']
+        if ports:
+            ret[chname] = ports
+    return ret
+
+def pipeline_subs(config, template):
+    # The subscribers of the RAIS output config that live in the pipelines
+    ret = set()
+    for chname,chcfg in config.items():
+        if chname in template:
+            for pipe in (template[chname]['subs'] or []):
+                if pipe['protocol'] == 'udp':
+                    ret.add ((pipe['function'], pipe['port']))
+    return ret
+
+def output_ports(config, template):
+    # The RAIS output config's own ports
+    subs = pipeline_subs(config, template)
+    ports = set()
+    for chcfg in config.values():
+        for pipes in (chcfg['pubs'], chcfg['subs']):
+            for pipe in (pipes or []):
+                if pipe['protocol'] == 'udp' and not (pipe['function'], pipe['port']) in subs:
+                    ports.add (pipe['port'])
+    return ports
+
+def output_config(config, template, offsets, output_offset):
+    # The RAIS output config lists the pipelines' own subscribers (e.g.
+    # PressureFactors for givenbarometer) once; repeat them for every pipeline.
+    # Its own ports move by output_offset.
+    in_pipelines = pipeline_subs(config, template)
+    config = copy.deepcopy(config)
+    for chname,chcfg in config.items():
+        for pipe in (chcfg['pubs'] or []):
+            if pipe['protocol'] == 'udp':
+                pipe['port'] += output_offset
+        subs = list()
+        for pipe in (chcfg['subs'] or []):
+            if pipe['protocol'] != 'udp':
+                subs.append (pipe)
+            elif (pipe['function'], pipe['port']) in in_pipelines:
+                for offset in offsets:
+                    shifted = dict(pipe)
+                    shifted['port'] += offset
+                    subs.append (shifted)
+            else:
+                shifted = dict(pipe)
+                shifted['port'] += output_offset
+                subs.append (shifted)
+        if subs:
+            chcfg['subs'] = subs
+    return config
+
+def is_mock(source):
+    return source == 'mock' or source.startswith('mock:')
+
+def source_command(source, pubsub_file):
+    # mock[:mock_config] runs MockRawData.py, anything else is a serial port for
+    # SenseControlRemote.py. 'none' leaves the sensor feed to be started elsewhere.
+    if source == 'none':
+        return None
+    if is_mock(source):
+        mock_config = source[5:] if source.startswith('mock:') else 'raw_sensors_mock.yml'
+        return [sys.executable, 'MockRawData.py', mock_config, '-p', pubsub_file]
+    return [sys.executable, 'SenseControlRemote.py', source, '-p', pubsub_file]
+
+def process_cpu_seconds(pid):
+    # user + system time of a process from /proc; None where that is unavailable
+    try:
+        with open('/proc/%d/stat'%pid, 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+class Pipeline:
+    def __init__(self, index, pubsub_file, monitor_port, core):
+        self.index = index
+        self.pubsub_file = pubsub_file
+        self.monitor_port = monitor_port
+        self.core = core
+        self.processes = list()
+        self.last_cpu = 0.0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def start(self, command):
+        p = subprocess.Popen(command)
+        if self.core is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity (p.pid, {self.core})
+        self.processes.append (p)
+        return p
+
+    def cpu_seconds(self):
+        total = 0.0
+        for p in self.processes:
+            cpu = process_cpu_seconds(p.pid)
+            if cpu is not None:
+                total += cpu
+        return total
+
+    def add_latency(self, latency):
+        self.latency_count += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def report(self, period):
+        cpu = self.cpu_seconds()
+        used = cpu - self.last_cpu
+        self.last_cpu = cpu
+        if self.latency_count:
+            latency = "%7.1f ms mean %7.1f ms max"%(self.latency_sum / self.latency_count * 1000.0,
+                    self.latency_max * 1000.0)
+        else:
+            latency = "no output"
+        print ("pipeline %d (core %s): %5.1f%% cpu, %6d outputs, %s"%(self.index, self.core,
+                used / period * 100.0, self.latency_count, latency))
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def exited(self):
+        # The first process found to have exited, or None
+        for p in self.processes:
+            if p.poll() is not None:
+                return p
+        return None
+
+    def stop(self):
+        for p in self.processes:
+            if p.poll() is None:
+                p.terminate()
+        for p in self.processes:
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+if __name__ == "__main__":
+    opt = argparse.ArgumentParser(description=
+            'Run N redundant sensor processing pipelines voted on by RAISDiscriminator')
+    opt.add_argument('-t', '--template', default=CONFIG_FILE, help='Pipeline pubsub config template')
+    opt.add_argument('-n', '--pipelines', type=int, default=None,
+            help='Number of pipelines (default one per --source)')
+    opt.add_argument('-s', '--source', action='append', default=None,
+            help='Sensor source per pipeline: a serial port, mock[:mock_config] or none. Give once for all, or once per pipeline')
+    opt.add_argument('-o', '--output-config', default='rais_output.yml', help='RAISDiscriminator output config')
+    opt.add_argument('-d', '--config-dir', default='rais_pipelines',
+            help='Directory for the generated pipeline configs and port map')
+    opt.add_argument('--stride', type=int, default=None,
+            help='Port offset between pipelines (default the span of the template ports, rounded up)')
+    opt.add_argument('--base-port', type=int, default=10000,
+            help='Lowest port of the first pipeline. Pipelines and the RAIS output skip the local port range')
+    opt.add_argument('--cores', default=None,
+            help='Comma separated cores to pin pipelines to, in turn (default all available but the first)')
+    opt.add_argument('--services-args', default='',
+            help='Extra arguments for each RunMicroServices.py, e.g. "--ahrs quaternion"')
+    opt.add_argument('-m', '--monitor-channel', default=None,
+            help='Output channel the latency is measured on (default Attitude or Pitch, as --ahrs)')
+    opt.add_argument('-r', '--report-period', type=float, default=5.0, help='Seconds between reports')
+    opt.add_argument('--no-discriminator', action='store_true',
+            help='Only run the pipelines (RAISDiscriminator runs elsewhere)')
+    args = opt.parse_args()
+
+    sources = args.source if args.source else ['none']
+    npipelines = args.pipelines if args.pipelines is not None else len(sources)
+    if len(sources) == 1:
+        sources = sources * npipelines
+    if len(sources) != npipelines:
+        raise RuntimeError ("Need one source or one per pipeline (%d given for %d pipelines)"%(
+            len(sources), npipelines))
+
+    services = RunMicroServices.arg_parser().parse_args(shlex.split(args.services_args))
+    monitor_channel = args.monitor_channel
+    if monitor_channel is None:
+        monitor_channel = 'Attitude' if services.ahrs == 'quaternion' else 'Pitch'
+
+    with open (args.template, 'r') as yml:
+        template = yaml.load(yml)
+        yml.close()
+    monitor_port = add_monitor(template, monitor_channel,
+            RunMicroServices.left_out_functions(services.ahrs, services.vertical))
+    monitor_values = template[monitor_channel]['output_values']
+    if not 'timestamp' in monitor_values:
+        raise RuntimeError ("Monitor channel %s has no timestamp"%monitor_channel)
+    monitor_format = struct.Struct(template[monitor_channel]['format'])
+    monitor_ts = monitor_values.index('timestamp')
+    with open (args.output_config, 'r') as yml:
+        output_template = yaml.load(yml)
+        yml.close()
+
+    # One port range per pipeline, then one for the RAIS output
+    all_ports = udp_ports(template) | output_ports(output_template, template)
+    stride = args.stride if args.stride is not None else port_stride(all_ports)
+    reserved = local_port_range()
+    offsets = port_offsets(all_ports, npipelines + 1, stride, args.base_port, reserved)
+    output_offset = offsets.pop()
+
+    if args.cores is not None:
+        cores = [int(c) for c in args.cores.split(',')]
+    elif hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) > 1:
+            cores = cores[1:]       # Leave the first for the discriminator and this launcher
+    else:
+        cores = [None]
+
+    os.makedirs (args.config_dir, exist_ok=True)
+    pipelines = list()
+    ports = dict()
+    for i,(offset,source) in enumerate(zip(offsets, sources)):
+        config = pipeline_config(template, offset, is_mock(source))
+        pubsub_file = os.path.join(args.config_dir, 'pipeline%d_pubsub.yml'%i)
+        with open (pubsub_file, 'w') as yml:
+            yaml.dump (config, yml, default_flow_style=None)
+        ports['pipeline%d'%i] = port_map(config)
+        pipelines.append (Pipeline(i, pubsub_file, monitor_port + offset, cores[i % len(cores)]))
+    output = output_config(output_template, template, offsets, output_offset)
+    output_file = os.path.join(args.config_dir, 'rais_output.yml')
+    with open (output_file, 'w') as yml:
+        yaml.dump (output, yml, default_flow_style=None)
+    ports['rais_output'] = port_map(output)
+    used = set()
+    for offset in offsets:
+        used |= set(p + offset for p in udp_ports(template))
+    for chcfg in output.values():
+        for pipe in (chcfg['pubs'] or []):
+            if pipe['protocol'] == 'udp' and pipe['port'] in used:
+                raise RuntimeError ("RAIS output port %d is used by a pipeline"%pipe['port'])
+    for port in used | udp_ports(output):
+        if reserved[0] <= port <= reserved[1]:
+            raise RuntimeError ("Port %d is in the local port range %d-%d"%(port, reserved[0], reserved[1]))
+    with open (os.path.join(args.config_dir, 'port_map.yml'), 'w') as yml:
+        yaml.dump (ports, yml, default_flow_style=False)
+
+    monitors = dict()
+    for p in pipelines:
+        s = socket.socket(type=socket.SOCK_DGRAM)
+        s.bind (('localhost', p.monitor_port))
+        monitors[s.fileno()] = (s, p)
+
+    output_hub = None
+    discriminator = None
+    try:
+        # Everything that binds ports first, so no source publishes into the void
+        if not args.no_discriminator:
+            output_hub = subprocess.Popen([sys.executable, 'PubSub.py', output_file])
+        for p in pipelines:
+            p.start ([sys.executable, 'PubSub.py', p.pubsub_file])
+            p.start ([sys.executable, 'RunMicroServices.py', '-p', p.pubsub_file] +
+                     shlex.split(args.services_args))
+        if not args.no_discriminator:
+            discriminator = subprocess.Popen([sys.executable, 'RAISDiscriminator.py'] +
+                    [p.pubsub_file for p in pipelines] + [output_file])
+        for p,source in zip(pipelines, sources):
+            command = source_command(source, p.pubsub_file)
+            if command is not None:
+                p.start (command)
+        print ("Started %d pipelines, %d ports apart from port %d, monitoring %s. Configs in %s"%(
+            npipelines, stride, args.base_port, monitor_channel, args.config_dir))
+
+        next_report = time.time() + args.report_period
+        for p in pipelines:
+            p.last_cpu = p.cpu_seconds()
+        while True:
+            timeout = max(0.0, next_report - time.time())
+            r,w,x = select.select (list(monitors.keys()), [], [], timeout)
+            now = time.time()
+            for fd in r:
+                s,p = monitors[fd]
+                data = s.recv(MAX_DATA_SIZE)
+                if len(data) == monitor_format.size:
+                    p.add_latency (now - monitor_format.unpack(data)[monitor_ts])
+            for p in pipelines:
+                dead = p.exited()
+                if dead is not None:
+                    raise RuntimeError ("pipeline %d: %s exited with %d"%(p.index,
+                        ' '.join(dead.args[1:]), dead.returncode))
+            if discriminator is not None and discriminator.poll() is not None:
+                raise RuntimeError ("RAISDiscriminator exited")
+            if output_hub is not None and output_hub.poll() is not None:
+                raise RuntimeError ("RAIS output PubSub.py exited")
+            if now >= next_report:
+                for p in pipelines:
+                    p.report (args.report_period)
+                next_report += args.report_period
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in (discriminator, output_hub):
+            if p is not None and p.poll() is None:
+                p.terminate()
+        for p in pipelines:
+            p.stop()
@@ -13,12 +13,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import time, math, logging
+import math, logging
 
 from MicroServerComs import MicroServerComs
+from Common.Curve import Curve
+import Common.Clock as Clock
 
 logger=logging.getLogger(__name__)
 
+# A message on one of these channels is a new attitude frame
+FRAME_CHANNELS = ('Attitude', 'Roll')
+
 class Control(MicroServerComs):
     def __init__(self):
         MicroServerComs.__init__(self, "Control")
@@ -54,14 +59,18 @@ class Control(MicroServerComs):
             self.publish()
         logger.log (3, "Setting throttles to %s", str(throttles))
 
+    def Flush(self):
+        # Every setting is published as it is made
+        pass
+
     def SetThrottleTable(self, table):
-        self._throttle_table = table
+        self._throttle_table = Curve.lookup(table)
 
     def SetThrottleChannels(self, chs):
         self._throttle_channels = chs
 
     def SetLookupTable(self, channel, table):
-        self._lookup_tables[channel] = table
+        self._lookup_tables[channel] = Curve.lookup(table)
 
     def initialize(self, filelines):
         return
@@ -101,6 +110,7 @@ class Sensors(MicroServerComs):
         self.gps_ground_track = None
         self.gps_signal_quality = None
         self.gps_magnetic_variation = None
+        self._fresh = False
 
     def initialize(self, alt, wind):
         if alt is not None:
@@ -119,52 +129,59 @@ class Sensors(MicroServerComs):
     def WindsAloftReport(self, lat, lng, altitude, timestamp, direction, speed):
         self._wind_report.send (lat, lng, altitude, timestamp, direction, speed)
 
-    def Altitude(self):
+    # Poll() once per control cycle takes in what the sensor pipeline has published;
+    # the accessors return the latest values it left.
+    def Poll(self):
         self.listen (timeout=0, loop=False)
+        self._fresh = False
+
+    # Waits until an attitude frame arrives that the last Poll() did not take in,
+    # or timeout seconds pass. Returns whether one arrived.
+    def WaitFrame(self, timeout):
+        end = Clock.time() + timeout
+        rsocks = list(self.subchannels.keys())
+        while not self._fresh:
+            remaining = end - Clock.time()
+            if remaining <= 0:
+                return False
+            if Clock.select(rsocks, remaining):
+                self.listen (timeout=0, loop=False)
+        return True
+
+    def Altitude(self):
         return self.altitude
 
     def Heading(self):
-        self.listen (timeout=0, loop=False)
         return self.heading
 
     def Roll(self):
-        self.listen (timeout=0, loop=False)
         return self.roll
 
     def RollRate(self):
-        self.listen (timeout=0, loop=False)
         return self.roll_rate
 
     def Pitch(self):
-        self.listen (timeout=0, loop=False)
         return self.pitch
 
     def PitchRate(self):
-        self.listen (timeout=0, loop=False)
         return self.pitch_rate
 
     def Yaw(self):
-        self.listen (timeout=0, loop=False)
         return self.yaw
 
     def AirSpeed(self):
-        self.listen (timeout=0, loop=False)
         return self.airspeed
 
     def ClimbRate(self):
-        self.listen (timeout=0, loop=False)
         return self.climb_rate
 
     def Position(self):
-        self.listen (timeout=0, loop=False)
         return (self.gps_lat, self.gps_lng)
 
     def HeadingRateChange(self):
-        self.listen (timeout=0, loop=False)
         return self.turn_rate
 
     def TrueHeading(self):
-        self.listen (timeout=0, loop=False)
         if self.gps_magnetic_variation is not None:
             return self.heading - self.gps_magnetic_variation
         else:
@@ -185,11 +202,9 @@ class Sensors(MicroServerComs):
 
     # Actual flight path in true coordinates
     def GroundTrack(self):
-        self.listen (timeout=0, loop=False)
         return self.gps_ground_track
 
     def GroundSpeed(self):
-        self.listen (timeout=0, loop=False)
         if self.gps_ground_speed is not None and \
                 self.altitude is not None and \
                 self.wind_report is not None and \
@@ -204,7 +219,6 @@ class Sensors(MicroServerComs):
         return self.gps_ground_speed
 
     def AGL(self):
-        self.listen (timeout=0, loop=False)
         raise RuntimeError("AGL sensor Not implemented")
 
     def Battery(self):
@@ -217,7 +231,8 @@ class Sensors(MicroServerComs):
         return str(dir(self))
     
     def updated(self, channel):
-        return
+        if channel in FRAME_CHANNELS:
+            self._fresh = True
 
     def WaitSensorsGreen(self):
         while self.gps_ground_speed is None or \
@@ -231,8 +246,8 @@ class Sensors(MicroServerComs):
                 self.pitch_rate is None or \
                 self.roll_rate is None or \
                 self.climb_rate is None:
-            self.listen (timeout=0, loop=False)
-            time.sleep (.1)
+            self.Poll()
+            Clock.sleep (.1)
 
 class KnownAltitude(MicroServerComs):
     def __init__(self):
@@ -268,6 +283,9 @@ class WindsAloftReport(MicroServerComs):
         self.publish()
 
 def look_up(keyin, lookup_table, continuous=False, reverse=False):
+    if isinstance(lookup_table, Curve):
+        # A compiled table carries its own continuous/reverse modes
+        return lookup_table(keyin)
     last_keypoint = None
     last_val = None
 
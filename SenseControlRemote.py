@@ -14,7 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 import os
-import sys,  math, time
+import sys,  math, time, select, struct, re
 
 import logging
 import argparse
@@ -28,6 +28,7 @@ from ArduinoCmdMessenger import ArduinoCmdMessenger
 import Globals
 import Common.Spatial as Spatial
 import Common.util as util
+from Common.RunningStats import RunningStats
 
 from NMEAParser import ParseNMEAStrings
 
@@ -55,17 +56,24 @@ arduino_messages = [
 ]
 
 class SenseControlSlave(MicroServerComs):
-    def __init__(self, command_channel, config, pubsub_cfg):
+    def __init__(self, command_channel, config, pubsub_cfg, name=None):
         self._mainCmd = command_channel
         self._config = config
         self._sensors = dict()
+        if name is None:
+            name = str(command_channel.device.port)
+        self.name = name
+        self.clock = BoardClock()
+        self.reading_count = 0
+        self.error_count = 0
+        self._count_start = time.time()
         sensor_chnum = 0
-        self._accelerometers = Accelerometers(pubsub_cfg)
-        self._rotation = Rotation(pubsub_cfg)
-        self._magnetic = Magnetic(pubsub_cfg)
-        self._pressure = Pressure(pubsub_cfg)
-        self._temperature = Temperature(pubsub_cfg)
-        self._gps = GPS(pubsub_cfg)
+        self._accelerometers = Accelerometers(pubsub_cfg, self.clock)
+        self._rotation = Rotation(pubsub_cfg, self.clock)
+        self._magnetic = Magnetic(pubsub_cfg, self.clock)
+        self._pressure = Pressure(pubsub_cfg, self.clock)
+        self._temperature = Temperature(pubsub_cfg, self.clock)
+        self._gps = GPS(pubsub_cfg, self.clock)
         self._calibrations = dict()
         for config_term,cfg in self._config.items():
             if config_term.startswith ('cal'):
@@ -91,26 +99,43 @@ class SenseControlSlave(MicroServerComs):
                         self.ProcessResponse(r)
                 self._sensors[sensor_chnum] = function
                 sensor_chnum += 1
+        # Magnetic stillness detection resets the gyro bias through the rotation object
+        cal = self._calibrations.get('magnetic')
+        if cal is not None:
+            cal.append(self._rotation)
         MicroServerComs.__init__(self, "ControlSlave", config=pubsub_cfg)
 
-    def update(self, channel):
+    def updated(self, channel):
         if channel == "Control":
             if not self.channel in self._config:
                 raise RuntimeError ("Invalid channel name received: %s"%self.channel)
             chtype,pin = self._config[self.channel]
             if chtype == 'analog_output':
-                self._mainCmd.sendCmd ("set_analog_output", pin, self.value)
+                self._mainCmd.sendCmd ("set_analog_output", [pin, self.value])
             elif chtype == 'digital_output':
-                self._mainCmd.sendCmd ("set_digital_output", pin, self.value)
+                self._mainCmd.sendCmd ("set_digital_output", [pin, self.value])
             else:
                 raise RuntimeError ("Trying to set invalid channel (%s) type %s"%(self.channel, chtype))
 
-    def ReadSensors(self):
-        global rootlogger
-        while True:
+    def enable_checkpoints(self, directory, max_age, period):
+        name = "%s-%s"%(self._rotation.function, re.sub(r'\W', '_', self.name))
+        if self._rotation.enable_checkpoint (directory, max_age, period, name):
+            logger.info ("%s: gyro bias restored %s", self.name, str(self._rotation.current_bias))
+
+    def fileno(self):
+        return self._mainCmd.device.fileno()
+
+    def pending(self):
+        # True if complete commands are already sitting in the receive buffer
+        return self._mainCmd.command_delim_found (self._mainCmd.receive_buffer) >= 0
+
+    def ReadSensors(self, max_commands=None):
+        count = 0
+        while max_commands is None or count < max_commands:
             cmd = self._mainCmd.read_command (0)
             if not self.ProcessResponse (cmd):
                 break
+            count += 1
 
     def ProcessResponse(self, cmd):
         if cmd is not None:
@@ -118,17 +143,41 @@ class SenseControlSlave(MicroServerComs):
             if name == 'sensor_reading':
                 ch = args[0]
                 if not ch in self._sensors:
-                    rootlogger.error ("Invalid sensor channel received from board: %d"%ch)
+                    self.error_count += 1
+                    logger.error ("%s: Invalid sensor channel received from board: %s"%(self.name, str(ch)))
                 else:
                     function = self._sensors[ch]
-                    self.sensor_updated (function, args[1:])
-            if name == 'log':
-                loglevel,log_string = args
-                rootlogger.log (loglevel, "scboard: " + log_string)
+                    try:
+                        self.sensor_updated (function, args[1:])
+                        self.reading_count += 1
+                    except (ValueError, TypeError, struct.error) as e:
+                        # A garbled reading from one board must not stop the others
+                        self.error_count += 1
+                        logger.error ("%s: Bad sensor reading %s (%s)"%(self.name, str(args), str(e)))
+            elif name == 'log':
+                if len(args) != 2 or not isinstance(args[0], int):
+                    self.error_count += 1
+                    logger.error ("%s: Bad log message %s"%(self.name, str(args)))
+                else:
+                    loglevel,log_string = args
+                    logger.log (loglevel, "scboard(%s): %s"%(self.name, log_string))
+            elif name == 'nack' or name == 'Unknown' or name == 'Invalid':
+                self.error_count += 1
+                logger.error ("%s: %s %s"%(self.name, name, str(args)))
             return True
         else:
             return False
 
+    def report_counts(self):
+        now = time.time()
+        elapsed = now - self._count_start
+        if elapsed > 0:
+            logger.info ("board %s: %g readings/s, %d errors"%(self.name,
+                self.reading_count / elapsed, self.error_count))
+        self.reading_count = 0
+        self.error_count = 0
+        self._count_start = now
+
     def sensor_updated(self, function, args):
         """ function labels used by sensor board:
         ts = timestamp. unsigned 4 byte integer in milliseconds since boot
@@ -144,10 +193,7 @@ class SenseControlSlave(MicroServerComs):
         elif function == 'r':
             self._rotation.send (args,self._calibrations.get('rotation'))
         elif function == 'm':
-            cal = self._calibrations.get('magnetic')
-            if cal is not None:
-                cal.append(self._rotation)
-            self._magnetic.send (args, cal)
+            self._magnetic.send (args, self._calibrations.get('magnetic'))
         elif function == 'p':
             self._pressure.send (args, self._calibrations.get('pressure'))
         elif function == 't':
@@ -195,7 +241,8 @@ class SampleCounter():
             self.reject_count = 0
 
 class Accelerometers(MicroServerComs,SampleCounter):
-    def __init__(self, pubsub_cfg):
+    def __init__(self, pubsub_cfg, clock):
+        self.clock = clock
         self.a_x = None
         self.a_y = None
         self.a_z = None
@@ -206,18 +253,23 @@ class Accelerometers(MicroServerComs,SampleCounter):
     def send(self, args, calibration):
         self.a_x, self.a_y, self.a_z, ts, self.sample_count, secondary, rj = args
         self.update_counts(secondary, rj)
-        self.timestamp = make_timestamp (ts)
+        self.timestamp = self.clock.make_timestamp (ts)
         #print ("accel %g,%g,%g"%(self.a_x, self.a_y, self.a_z))
         self.publish()
 
 class Rotation(MicroServerComs,SampleCounter):
-    def __init__(self, pubsub_cfg):
+    # The collected gyro bias survives a restart
+    checkpoint_values = ['current_bias', 'cal_collection_count']
+    checkpoint_format = '3di'
+
+    def __init__(self, pubsub_cfg, clock):
+        self.clock = clock
         self.r_x = None
         self.r_y = None
         self.r_z = None
         self.cal_collection_count = 0
         self.current_bias = [0.0, 0.0, 0.0]
-        self.samples = [list(), list(), list()]
+        self.samples = [RunningStats(), RunningStats(), RunningStats()]
         self.timestamp = None
         self.print_count = 0
         MicroServerComs.__init__(self, "RawRotationSensors", channel='rotationsensors', config=pubsub_cfg)
@@ -245,33 +297,36 @@ class Rotation(MicroServerComs,SampleCounter):
             else:
                 c_x, c_y, c_z = calibration
             if len(calibration) >= 3 and calibration[2] == 'respond_heading':
-                self.samples[0].append (self.r_x)
-                self.samples[1].append (self.r_y)
-                self.samples[2].append (self.r_z)
+                self.samples[0].add (self.r_x)
+                self.samples[1].add (self.r_y)
+                self.samples[2].add (self.r_z)
             self.r_x -= c_x
             self.r_y -= c_y
             self.r_z -= c_z
 
-        self.timestamp = make_timestamp (ts)
+        self.timestamp = self.clock.make_timestamp (ts)
         self.print_count += 1
         if self.print_count % 10 == 0:
             print ("rotation %g,%g,%g"%(self.r_x, self.r_y, self.r_z))
         self.publish()
 
     def reset_bias(self):
-        mean = [sum(x) for x in self.samples]
-        self.current_bias = [x/len(self.samples[0]) for x in mean]
+        if self.samples[0].count == 0:
+            return
+        self.current_bias = [x.mean for x in self.samples]
         print ("New rotation bias %s"%(str(self.current_bias)))
 
     def reset_samples(self):
-        self.samples = [list(), list(), list()]
+        for x in self.samples:
+            x.reset()
 
 class Magnetic(MicroServerComs,SampleCounter):
-    def __init__(self, pubsub_cfg):
+    def __init__(self, pubsub_cfg, clock):
+        self.clock = clock
         self.m_x = None
         self.m_y = None
         self.m_z = None
-        self.samples = [list(), list(), list()]
+        self.samples = [RunningStats(), RunningStats(), RunningStats()]
         self.timestamp = None
         MicroServerComs.__init__(self, "RawMagneticSensors", channel='magneticsensors', config=pubsub_cfg)
         SampleCounter.__init__(self)
@@ -282,18 +337,12 @@ class Magnetic(MicroServerComs,SampleCounter):
         if calibration is not None and isinstance (calibration[0],str) and calibration[0] == 'rotation':
             if len(calibration) >= 5:
                 sample_count,max_sample_dev,max_trend_dev,rot_object = calibration[1:5]
-                self.samples[0].append (self.m_x)
-                self.samples[1].append (self.m_y)
-                self.samples[2].append (self.m_z)
-                if len(self.samples[0]) >= sample_count:
-                    mean = [sum(x)/len(self.samples[0]) for x in self.samples]
-                    deviation = [[abs(x-m) for x in samp] for samp,m in zip(self.samples,mean)]
-                    deviation = [max(x) for x in deviation]
-                    deviation = max(deviation)
-                    end_mean = [sum(x[-3:])/3 for x in self.samples]
-                    beg_mean = [sum(x[:3])/3 for x in self.samples]
-                    trend = [abs(e-b) for e,b in zip(end_mean,beg_mean)]
-                    max_trend = max(trend)
+                self.samples[0].add (self.m_x)
+                self.samples[1].add (self.m_y)
+                self.samples[2].add (self.m_z)
+                if self.samples[0].count >= sample_count:
+                    deviation = max([x.max_deviation() for x in self.samples])
+                    max_trend = max([x.trend() for x in self.samples])
                     if deviation < max_sample_dev and max_trend < max_trend_dev:
                         rot_object.reset_bias()
                         print ("reset rotation bias because %.4g<%.4g and %.4g<%.4g"%(
@@ -303,14 +352,16 @@ class Magnetic(MicroServerComs,SampleCounter):
                         print ("DO NOT reset rotation bias because %.4g>=%.4g or %.4g>=%.4g"%(
                                     deviation, max_sample_dev,
                                     max_trend, max_trend_dev))
-                    self.samples = [list(), list(), list()]
+                    for x in self.samples:
+                        x.reset()
                     rot_object.reset_samples()
-        self.timestamp = make_timestamp (ts)
+        self.timestamp = self.clock.make_timestamp (ts)
         #print ("magnetic %g,%g,%g"%(self.m_x, self.m_y, self.m_z))
         self.publish()
 
 class Pressure(MicroServerComs,SampleCounter):
-    def __init__(self, pubsub_cfg):
+    def __init__(self, pubsub_cfg, clock):
+        self.clock = clock
         self.static_pressure = None
         self.pitot_pressure = None
         self.timestamp = None
@@ -324,12 +375,13 @@ class Pressure(MicroServerComs,SampleCounter):
         self.update_counts(secondary, rj)
         self.static_pressure /= 1000.0
         self.pitot_pressure /= 1000.0
-        self.timestamp = make_timestamp (ts)
+        self.timestamp = self.clock.make_timestamp (ts)
         #print ("pressure %g,%g"%(self.static_pressure, self.pitot_pressure))
         self.publish()
 
 class Temperature(MicroServerComs,SampleCounter):
-    def __init__(self, pubsub_cfg):
+    def __init__(self, pubsub_cfg, clock):
+        self.clock = clock
         self.temperature = None
         MicroServerComs.__init__(self, "RawTemperatureSensors", channel='temperaturesensors', config=pubsub_cfg)
         SampleCounter.__init__(self, 10)
@@ -341,7 +393,8 @@ class Temperature(MicroServerComs,SampleCounter):
         self.publish()
 
 class GPS(MicroServerComs):
-    def __init__(self, pubsub_cfg):
+    def __init__(self, pubsub_cfg, clock):
+        self.clock = clock
         self.gps_utc = None
         self.gps_lat = None
         self.gps_lng = None
@@ -358,7 +411,7 @@ class GPS(MicroServerComs):
         ParseNMEAStrings (nmea_string, self)
         if self.HaveNewPosition and self.gps_ground_speed is not None and \
                 self.gps_lat is not None:
-            update_time_offset (self.gps_utc, ts)
+            self.clock.update_time_offset (self.gps_utc, ts)
             self.HaveNewPosition = False
             print ("gps: %g,%g,%g,%d,%d,%d,%d,%g"%(
         self.gps_utc,
@@ -371,29 +424,89 @@ class GPS(MicroServerComs):
         self.gps_magnetic_variation))
             self.publish()
 
-time_offset = 0
+class BoardClock:
+    # Each board counts milliseconds from its own boot, so every board
+    # keeps its own offset to UTC, taken from its first GPS fix.
+    def __init__(self):
+        self.time_offset = 0
 
-def update_time_offset(curtime, board_ts):
-    global time_offset
-    if time_offset == 0:
-        time_offset = curtime - float(board_ts) / 1000.0
+    def update_time_offset(self, curtime, board_ts):
+        if self.time_offset == 0:
+            self.time_offset = curtime - float(board_ts) / 1000.0
 
-def make_timestamp (board_ts):
-    if time_offset == 0:
-        return time.time()
-    else:
-        return float(board_ts)/1000.0 + time_offset
+    def make_timestamp (self, board_ts):
+        if self.time_offset == 0:
+            return time.time()
+        else:
+            return float(board_ts)/1000.0 + self.time_offset
+
+def run_boards(slaves, report_period=10.0, max_commands=100):
+    # One select loop over every board's serial port and control subscriptions
+    readers = dict()
+    for slave in slaves:
+        readers[slave.fileno()] = (slave, None)
+        for fd in slave.subchannels.keys():
+            readers[fd] = (slave, fd)
+    rsocks = list(readers.keys())
+    next_report = time.time() + report_period
+    while True:
+        timeout = report_period if report_period else None
+        for slave in slaves:
+            if slave.pending():
+                timeout = 0
+                break
+        r,w,x = select.select (rsocks, [], [], timeout)
+        if timeout == 0:
+            for slave in slaves:
+                if slave.pending() and not slave.fileno() in r:
+                    slave.ReadSensors (max_commands)
+        for fd in r:
+            slave,subfd = readers[fd]
+            if subfd is None:
+                slave.ReadSensors (max_commands)
+            else:
+                slave.data_ready (subfd)
+        if report_period and time.time() >= next_report:
+            for slave in slaves:
+                slave.report_counts()
+            next_report += report_period
+
+def poll_boards(slaves):
+    # select() cannot wait on serial ports under Windows
+    while True:
+        for slave in slaves:
+            slave.ReadSensors()
+            slave.listen (timeout=0, loop=False)
+        #time.sleep(.01)    On windows, the sleep is like minimum 300ms -- too long
+
+def per_board(values, default, nboards, what):
+    if values is None:
+        return [default] * nboards
+    if len(values) == 1:
+        return values * nboards
+    if len(values) != nboards:
+        raise RuntimeError ("Need one %s or one per serial port (%d given for %d ports)"%(
+            what, len(values), nboards))
+    return values
 
 if '__main__' == __name__:
     opt = argparse.ArgumentParser(description='Control/sensor slave process')
-    opt.add_argument('serial_port', help = 'Serial port path of physical controller')
-    opt.add_argument('-c', '--config-file', default='sensors.yml', help='YAML config file for sensor / control board')
-    opt.add_argument('-p', '--pubsub-config', default='sensors_pubsub.yml', help='YAML config file coms configuration')
+    opt.add_argument('serial_port', nargs='+', help = 'Serial port path(s) of physical controller(s)')
+    opt.add_argument('-c', '--config-file', action='append', default=None,
+            help='YAML config file for sensor / control board. Give once for all boards, or once per board')
+    opt.add_argument('-p', '--pubsub-config', action='append', default=None,
+            help='YAML config file coms configuration. Give one per board when running several')
+    opt.add_argument('-r', '--report-period', type=float, default=10.0, help='Seconds between per-board throughput reports')
     opt.add_argument('--log-prefix', default=None, help = 'Over-ride logging prefix')
     opt.add_argument('-l', '--log-level', type=int, default=logging.WARNING, help = '1 = Maximum Logging. 100 = Absolute Silence. 40 = Errors only. 10 = Basic Debug')
     opt.add_argument('-v', '--magnetic-variation', default=None, help='The magnetic variation(declination) of the current position')
     opt.add_argument('-a', '--altitude', default=None, help='The currently known altitude')
     opt.add_argument('-w', '--wind', help="Wind speed and direction 'speed_knots,dir_deg'")
+    opt.add_argument('--checkpoint-dir', default=None,
+            help='Directory to keep calibration state in, for a warm start after a restart')
+    opt.add_argument('--checkpoint-max-age', type=float, default=60.0,
+            help='Seconds old a checkpoint can be and still be restored')
+    opt.add_argument('--checkpoint-period', type=float, default=1.0, help='Seconds between checkpoint saves')
     args = opt.parse_args()
 
     rootlogger = logging.getLogger()
@@ -415,13 +528,22 @@ if '__main__' == __name__:
     rootlogger.addHandler(console_handler)
     rootlogger.log(99, log_start)
 
-    try:
-        _main_port = serial.Serial(args.serial_port, 115200, timeout=0)
-    except:
-        raise RuntimeError("Cannot open control/sensor port %s"%args.serial_port)
-    command_channel = ArduinoCmdMessenger(arduino_messages)
-    command_channel.StartComs (_main_port)
-
+    nboards = len(args.serial_port)
+    config_files = per_board(args.config_file, 'sensors.yml', nboards, 'config file')
+    pubsub_files = per_board(args.pubsub_config, 'sensors_pubsub.yml', nboards, 'pubsub config')
+    # Boards sharing a pubsub config would publish indistinguishable raw channels,
+    # and each would try to bind the same ControlSlave port
+    if len(set(pubsub_files)) != nboards:
+        raise RuntimeError ("Need a different pubsub config for each of the %d serial ports"%nboards)
+    command_channels = list()
+    for port in args.serial_port:
+        try:
+            _main_port = serial.Serial(port, 115200, timeout=0)
+        except:
+            raise RuntimeError("Cannot open control/sensor port %s"%port)
+        command_channel = ArduinoCmdMessenger(arduino_messages)
+        command_channel.StartComs (_main_port)
+        command_channels.append (command_channel)
 
     if args.wind:
         try:
@@ -436,14 +558,20 @@ if '__main__' == __name__:
     else:
         rootlogger.info("Wind = None")
 
-    with open(args.config_file, 'r') as yml:
-        config = yaml.load (yml)
-        yml.close()
-    with open (args.pubsub_config, 'r') as yml:
-        pubsub_config = yaml.load(yml)
-        yml.close()
-    slave = SenseControlSlave(command_channel, config, pubsub_config)
-    while True:
-        slave.ReadSensors()
-        slave.listen (timeout=0, loop=False)
-        #time.sleep(.01)    On windows, the sleep is like minimum 300ms -- too long
+    slaves = list()
+    for command_channel,config_file,pubsub_file in zip(command_channels, config_files, pubsub_files):
+        with open(config_file, 'r') as yml:
+            config = yaml.load (yml)
+            yml.close()
+        with open (pubsub_file, 'r') as yml:
+            pubsub_config = yaml.load(yml)
+            yml.close()
+        slaves.append (SenseControlSlave(command_channel, config, pubsub_config))
+    if args.checkpoint_dir is not None:
+        os.makedirs (args.checkpoint_dir, exist_ok=True)
+        for slave in slaves:
+            slave.enable_checkpoints (args.checkpoint_dir, args.checkpoint_max_age, args.checkpoint_period)
+    if os.name == 'nt':
+        poll_boards (slaves)
+    else:
+        run_boards (slaves, args.report_period)
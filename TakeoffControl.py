@@ -18,6 +18,7 @@ import logging
 import PID
 import Common.FileConfig as FileConfig
 import Common.util as util
+from Common.Curve import Curve
 
 logger=logging.getLogger(__name__)
 
@@ -82,6 +83,7 @@ class TakeoffControl(FileConfig.FileConfig):
 
     def initialize(self, filelines):
         self.InitializeFromFileLines(filelines)
+        self.HeadingRateCurve = Curve.rate(self.HeadingRateCurve)
         ms = util.millis(self._sensors.Time())
         self._last_update_time = ms
         kp,ki,kd = self.RudderPIDTuningParams
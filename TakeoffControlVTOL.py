@@ -18,6 +18,7 @@ import logging
 import Common.FileConfig as FileConfig
 import Globals
 import Common.util as util
+from Common.Curve import Curve
 
 logger=logging.getLogger(__name__)
 
@@ -93,6 +94,7 @@ class TakeoffControlVTOL(FileConfig.FileConfig):
 
     def initialize(self, filelines):
         self.InitializeFromFileLines(filelines)
+        self.CorrectionCurve = Curve.rate(self.CorrectionCurve)
         self._attitude_vtol_estimation.initialize(self.PitchPIDParameters, self.PitchPIDSamplePeriod,
                 self.PitchPIDLimits, util.millis(self._sensors.Time()))
 
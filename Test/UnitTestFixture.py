@@ -13,9 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import logging, time
+import logging
 
 import Common.FileConfig as FileConfig
+import Common.Clock as Clock
 
 control = None
 
@@ -66,6 +67,9 @@ class UnitTestControl:
                 )
         self.last_val ["Throttle"] = throttles[0]
 
+    def Flush(self):
+        pass
+
     def initialize(self, filelines):
         return
 
@@ -74,105 +78,117 @@ class UnitTestControl:
 
 sensors = None
 
+# Slots of UnitTestSensors.values
+ALTITUDE = 0
+HEADING = 1
+ROLL = 2
+ROLL_RATE = 3
+PITCH = 4
+PITCH_RATE = 5
+YAW = 6
+AIRSPEED = 7
+GROUND_SPEED = 8
+CLIMB_RATE = 9
+LONGITUDE = 10
+LATITUDE = 11
+MAGNETIC_DECLINATION = 12
+TRUE_HEADING = 13
+OUTER_ENGINE_POSITION = 14
+GROUND_TRACK = 15
+BATTERY = 16
+
+SENSOR_NAMES = ["Altitude",
+        "Heading",
+        "Roll",
+        "RollRate",
+        "Pitch",
+        "PitchRate",
+        "Yaw",
+        "AirSpeed",
+        "GroundSpeed",
+        "ClimbRate",
+        "Longitude",
+        "Latitude",
+        "MagneticDeclination",
+        "TrueHeading",
+        "OuterEnginePosition",
+        "GroundTrack",
+        "Battery",
+        ]
+
 class UnitTestSensors:
     def __init__(self):
         global sensors
-        self.sensor_suite = [(0, "Altitude"),
-                (0, "Heading"),
-                (0, "Roll"),
-                (0, "RollRate"),
-                (0, "Pitch"),
-                (0, "PitchRate"),
-                (0, "Yaw"),
-                (0, "AirSpeed"),
-                (0, "GroundSpeed"),
-                (0, "ClimbRate"),
-                (0, "Longitude"),
-                (0, "Latitude"),
-                (0, "MagneticDeclination"),
-                (0, "TrueHeading"),
-                (0, "OuterEnginePosition"),
-                (0, "GroundTrack"),
-                (0, "Battery"),
-                ]
-        self.previous_readings = [s[0] for s in self.sensor_suite]
+        self.values = [0] * len(SENSOR_NAMES)
+        self.previous_readings = list(self.values)
+        self._slots = dict((name, i) for i,name in enumerate(SENSOR_NAMES))
         self.SamplesPerSecond = 10
         sensors = self
 
     def initialize(self, filelines):
         pass
 
+    def Poll(self):
+        # The responses set the sensors directly
+        pass
+
+    def WaitFrame(self, timeout):
+        Clock.sleep(timeout)
+        return False
+
     def Altitude(self):
-        assert(self.sensor_suite[0][1] == "Altitude")
-        return self.sensor_suite[0][0]
+        return self.values[ALTITUDE]
 
     def Heading(self):
-        assert(self.sensor_suite[1][1] == "Heading")
-        return self.sensor_suite[1][0]
+        return self.values[HEADING]
 
     def Roll(self):
-        assert(self.sensor_suite[2][1] == "Roll")
-        return self.sensor_suite[2][0]
+        return self.values[ROLL]
 
     def RollRate(self):
-        assert(self.sensor_suite[3][1] == "RollRate")
-        return self.sensor_suite[3][0]
+        return self.values[ROLL_RATE]
 
     def Pitch(self):
-        assert(self.sensor_suite[4][1] == "Pitch")
-        return self.sensor_suite[4][0]
+        return self.values[PITCH]
 
     def PitchRate(self):
-        assert(self.sensor_suite[5][1] == "PitchRate")
-        return self.sensor_suite[5][0]
+        return self.values[PITCH_RATE]
 
     def Yaw(self):
-        assert(self.sensor_suite[6][1] == "Yaw")
-        return self.sensor_suite[6][0]
+        return self.values[YAW]
 
     def AirSpeed(self):
-        assert(self.sensor_suite[7][1] == "AirSpeed")
-        return self.sensor_suite[7][0]
+        return self.values[AIRSPEED]
 
     def GroundSpeed(self):
-        assert(self.sensor_suite[8][1] == "GroundSpeed")
-        return self.sensor_suite[8][0]
+        return self.values[GROUND_SPEED]
 
     def ClimbRate(self):
-        assert(self.sensor_suite[9][1] == "ClimbRate")
-        return self.sensor_suite[9][0]
+        return self.values[CLIMB_RATE]
 
     def Position(self):
-        assert(self.sensor_suite[10][1] == "Longitude")
-        assert(self.sensor_suite[11][1] == "Latitude")
-        return (self.sensor_suite[10][0], self.sensor_suite[11][0])
+        return (self.values[LONGITUDE], self.values[LATITUDE])
 
     def HeadingRateChange(self):
-        assert(self.sensor_suite[1][1] == "Heading")
-        return ((self.sensor_suite[1][0] - self.previous_readings[1]) * self.SamplesPerSecond)
+        return ((self.values[HEADING] - self.previous_readings[HEADING]) * self.SamplesPerSecond)
 
     def TrueHeading(self):
-        assert(self.sensor_suite[13][1] == "TrueHeading")
-        return self.sensor_suite[13][0]
+        return self.values[TRUE_HEADING]
 
     def MagneticDeclination(self):
-        assert(self.sensor_suite[12][1] == "MagneticDeclination")
-        return self.sensor_suite[12][0]
+        return self.values[MAGNETIC_DECLINATION]
 
     def Time(self):
-        return time.time()
+        return Clock.time()
 
     def GroundTrack(self):
-        assert(self.sensor_suite[15][1] == "GroundTrack")
-        return self.sensor_suite[15][0]
+        return self.values[GROUND_TRACK]
 
     def Battery(self):
-        assert(self.sensor_suite[16][1] == "Battery")
-        return self.sensor_suite[16][0]
+        return self.values[BATTERY]
 
     def OuterEnginePosition(self):
-        assert(self.sensor_suite[14][1] == "OuterEnginePosition")
-        return self.sensor_suite[14][0]
+        return self.values[OUTER_ENGINE_POSITION]
 
     def WindSpeed(self):
         # TODO: Implement
@@ -182,10 +198,13 @@ class UnitTestSensors:
         # TODO: Implement
         return 0.0
 
+    def Snapshot(self):
+        return str(dict(zip(SENSOR_NAMES, self.values)))
+
     def SetSensor(self, name, value):
-        for snum in range(len(self.sensor_suite)):
-            if name == self.sensor_suite[snum][1]:
-                self.sensor_suite[snum] = (value, name)
+        slot = self._slots.get(name)
+        if slot is not None:
+            self.values[slot] = value
 
 
 class ResponseStep(FileConfig.FileConfig):
@@ -219,10 +238,10 @@ class ResponseStep(FileConfig.FileConfig):
         self.condition = ' '.join(args[1:])
 
     def Enter(self):
-        self.enter_time = time.time()
+        self.enter_time = Clock.time()
 
     def TimeSinceEntry(self):
-        return time.time() - self.enter_time
+        return Clock.time() - self.enter_time
 
     def UpdateSensors(self):
         global control
@@ -0,0 +1,60 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import numpy
+import pytest
+
+from Common.Curve import Curve
+
+IRREGULAR = [(0.0, 0.0), (10.0, -50.0), (30.0, -100.0), (200.0, -500.0)]
+UNIFORM = [(float(x), x * x / 10.0) for x in range(0, 370, 10)]
+REPEATED = [(0.0, 1.0), (5.0, 2.0), (5.0, 4.0), (10.0, 3.0), (10.0, 6.0)]
+
+CURVES = [
+    ('rate', lambda: Curve(IRREGULAR, symmetric=True)),
+    ('rate uniform', lambda: Curve(UNIFORM, symmetric=True)),
+    ('rate one point', lambda: Curve([(3.0, 2.0)], symmetric=True)),
+    ('look_up', lambda: Curve(IRREGULAR)),
+    ('look_up continuous', lambda: Curve(IRREGULAR, continuous=True)),
+    ('look_up reverse', lambda: Curve(IRREGULAR, reverse=True, continuous=True)),
+    ('look_up repeated', lambda: Curve(REPEATED)),
+    ('look_up repeated continuous', lambda: Curve(REPEATED, continuous=True)),
+    ('look_up uniform', lambda: Curve(UNIFORM, continuous=True)),
+    ('look_up one point', lambda: Curve([(3.0, 2.0)])),
+    ('lut', lambda: Curve(IRREGULAR, symmetric=True, lut_size=50)),
+]
+
+@pytest.mark.parametrize('make', [m for n,m in CURVES], ids=[n for n,m in CURVES])
+def test_array_matches_scalar(make):
+    curve = make()
+    rand = numpy.random.default_rng(1)
+    x = rand.uniform(-600.0, 600.0, (40, 25))
+    # The points themselves and just around them
+    ends = numpy.array([p[k] for p in curve.points for k in (0, 1)])
+    x[0, :] = numpy.resize(ends, 25)
+    x[1, :] = numpy.resize(-ends, 25)
+    x[2, :] = numpy.resize(numpy.nextafter(ends, numpy.inf), 25)
+    got = curve(x)
+    assert isinstance(got, numpy.ndarray)
+    assert got.shape == x.shape
+    expected = numpy.array([curve(float(v)) for v in x.flat]).reshape(x.shape)
+    assert numpy.allclose(got, expected, rtol=1e-12, atol=1e-9)
+
+def test_scalars():
+    curve = Curve(IRREGULAR, symmetric=True)
+    for x in (numpy.float32(20.0), numpy.float64(-20.0), numpy.int64(20), 20):
+        assert not isinstance(curve(x), numpy.ndarray)
+        assert abs(abs(curve(x)) - 75.0) < 1e-9
+    assert list(curve([20.0, -20.0])) == [-75.0, 75.0]
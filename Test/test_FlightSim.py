@@ -0,0 +1,50 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Flies TakeoffAndLand.pln with every simulated airframe, headless and on the
+# virtual clock, and checks that each one touches down safely on the runway.
+
+import os, sys, re, shutil, subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AIRFRAMES = ['172', 'Avanti', '747', 'OwlVTOL']
+
+# Runway 16L as given in TakeoffAndLand.pln: threshold latitude, 1 nm long to the south
+THRESHOLD_LATITUDE = 47.4636
+END_LATITUDE = 47.4469
+MARGIN = 0.002          # About 700 feet
+
+touchdown = re.compile(r'Simulated aircraft touched down at ([\d.]+) fpm, \(([-\d.]+),([-\d.]+)\)')
+
+@pytest.mark.parametrize('airframe', AIRFRAMES)
+def test_takeoff_and_land(airframe, tmp_path):
+    cfg = airframe + '-sim.cfg'
+    for name in (cfg, airframe + '.sim', 'TakeoffAndLand.pln'):
+        shutil.copy (os.path.join(ROOT, name), str(tmp_path))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    result = subprocess.run ([sys.executable, os.path.join(ROOT, 'Fly.py'), '-V', '-e', '-t', '900',
+                '--log-level', '20', cfg, 'TakeoffAndLand.pln'],
+            cwd=str(tmp_path), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=600)
+    output = result.stdout
+    assert 'Simulated aircraft crashed' not in output
+    m = touchdown.search (output)
+    assert m is not None, output[-2000:]
+    lng,lat = float(m.group(2)), float(m.group(3))
+    assert END_LATITUDE - MARGIN < lat < THRESHOLD_LATITUDE + MARGIN
+    assert abs(lng + 122.308) < MARGIN
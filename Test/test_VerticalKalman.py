@@ -0,0 +1,98 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math, random
+
+from VerticalKalman import VerticalKalman
+
+STANDARD_GRAVITY = 9.80665
+ACCEL_RATE = 100
+BARO_EVERY = 10
+
+# Runs the filter at rest, with pitch and roll level and the baro at altitude.
+# a_z may be a function of the sample number.
+def run_at_rest(vk, seconds, a_z, altitude=100.0, start=0.0):
+    for i in range(int(seconds * ACCEL_RATE)):
+        tm = start + i / ACCEL_RATE
+        vk.a_x = 0.0
+        vk.a_y = 0.0
+        vk.a_z = a_z(i) if callable(a_z) else a_z
+        vk.accelerometers_updated = tm
+        vk.updated ('accelerometers')
+        if i % BARO_EVERY == 0:
+            vk.altitude_computed = altitude
+            vk.AltitudeComputed_updated = tm
+            vk.updated ('AltitudeComputed')
+
+def test_at_rest_meters_per_second_squared():
+    vk = VerticalKalman(config={})
+    # Calibration takes the first second
+    run_at_rest (vk, 1, STANDARD_GRAVITY)
+    elapsed = 1
+    for seconds in (1, 9, 50):
+        run_at_rest (vk, seconds, STANDARD_GRAVITY, start=elapsed)
+        elapsed += seconds
+        assert abs(vk.climb_rate_pub.climb_rate) <= 1
+        assert abs(vk.altitude_pub.altitude - 100) <= 1
+    assert abs(vk.one_g - STANDARD_GRAVITY) < 1e-9
+
+def test_at_rest_calibrates_scale_error():
+    vk = VerticalKalman(config={})
+    run_at_rest (vk, 60, STANDARD_GRAVITY * 1.02)
+    assert abs(vk.climb_rate_pub.climb_rate) <= 1
+
+def test_at_rest_given_one_g():
+    vk = VerticalKalman(one_g=1.0, config={})
+    run_at_rest (vk, 60, 1.0)
+    assert abs(vk.climb_rate_pub.climb_rate) <= 1
+    assert abs(vk.b) < 0.01
+
+def test_restart_in_a_turn():
+    # 30 degrees of bank in level flight, before and after the attitude arrives
+    a_z = STANDARD_GRAVITY / math.cos(30.0 * math.pi / 180.0)
+    vk = VerticalKalman(config={})
+    run_at_rest (vk, 5, a_z)
+    assert vk.one_g == STANDARD_GRAVITY
+    vk = VerticalKalman(config={})
+    vk.roll = 30.0
+    run_at_rest (vk, 60, a_z)
+    assert vk.one_g == STANDARD_GRAVITY
+    assert abs(vk.climb_rate_pub.climb_rate) <= 1
+    assert vk.calibrating
+
+def test_restart_in_turbulence():
+    vk = VerticalKalman(config={})
+    rand = random.Random(1)
+    run_at_rest (vk, 60, lambda i: STANDARD_GRAVITY * (1.0 + rand.gauss(0.0, 0.2)))
+    assert vk.one_g == STANDARD_GRAVITY
+    # Once it is still, it calibrates
+    run_at_rest (vk, 5, STANDARD_GRAVITY * 1.02, start=60)
+    assert not vk.calibrating
+    assert abs(vk.one_g - STANDARD_GRAVITY * 1.02) < 1e-9
+
+def test_state_survives_restart(tmp_path):
+    vk = VerticalKalman(config={})
+    vk.enable_checkpoint (str(tmp_path), 60.0, period=0.0)
+    run_at_rest (vk, 5, STANDARD_GRAVITY)
+    vk._checkpoint.close()
+
+    restarted = VerticalKalman(config={})
+    assert restarted.enable_checkpoint (str(tmp_path), 60.0, period=0.0)
+    assert restarted.initialized
+    for name in VerticalKalman.checkpoint_values:
+        assert getattr(restarted, name) == getattr(vk, name)
+    run_at_rest (restarted, 1, STANDARD_GRAVITY, start=5)
+    assert abs(restarted.climb_rate_pub.climb_rate) <= 1
+    restarted._checkpoint.close()
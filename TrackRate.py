@@ -1,14 +1,18 @@
 
 import Common.util as util
+from Common.Filters import FIRFilter
 from MicroServerComs import MicroServerComs
 
 class TrackRate(MicroServerComs):
+    checkpoint_values = ['_raw_track_rate']
+    checkpoint_format = '%dd'%len(util.LowPassFIR)
+
     def __init__(self):
         MicroServerComs.__init__(self, "TrackRate")
         self.last_ground_track = None
         self.last_time = None
         self.track_rate = None
-        self._raw_track_rate = list()
+        self._raw_track_rate = FIRFilter(util.LowPassFIR)
 
     def updated(self, channel):
         if self.last_time is not None:
@@ -19,7 +23,7 @@ class TrackRate(MicroServerComs):
             if trackdiff > 180:
                 trackdiff -= 360
             current_track_rate = trackdiff / timediff
-            self.track_rate = util.LowPassFilter (current_track_rate, self._raw_track_rate)
+            self.track_rate = self._raw_track_rate.filter (current_track_rate)
             self.publish ()
             print ("TrackRate: %d/%g => %g"%(trackdiff, timediff, self.track_rate))
         self.last_time = self.gps_utc
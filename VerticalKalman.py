@@ -0,0 +1,246 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import math
+
+import Common.util as util
+from MicroServerComs import MicroServerComs
+
+STANDARD_GRAVITY = 9.80665       # meters / second^2, as the accelerometers report
+G_FEET_PER_SEC = STANDARD_GRAVITY * util.FEET_METER
+
+# Kalman filter over altitude (feet), vertical speed (feet / second) and
+# vertical accelerometer bias (feet / second^2), standing in for the Altitude
+# and ClimbRate services.
+#
+# Each accelerometer sample predicts the state forward, using the vertical
+# acceleration (specific force along up, less 1 g). one_g is the
+# accelerometers' reading of 1 g, standard gravity in meters / second^2 unless
+# given. A window of samples taken level and still refines it for the
+# sensors' scale error. Since the service may start in flight, a window that
+# moves, or that is off one_g by more than max_scale_error, is not used, and
+# the filter keeps predicting with the value it has. Barometric altitude
+# (AltitudeComputed) and GPS altitude correct it. Since both measurements are
+# of the first state only, the updates reduce to scalar arithmetic on the
+# covariance, held in place in a flat 3x3 list.
+#
+# Altitude and climb rate are published at the accelerometer rate on the
+# Altitude and ClimbRate channels, through KalmanAltitude and KalmanClimbRate.
+class VerticalKalman(MicroServerComs):
+    checkpoint_values = ['h', 'v', 'b', 'P', 'one_g']
+    checkpoint_format = 'ddd9dd'
+
+    def __init__(self, accel_noise=1.0, bias_noise=0.02, baro_noise=10.0, gps_noise=50.0,
+                 conf_mult=0.01, one_g=STANDARD_GRAVITY, calibration_samples=100,
+                 max_scale_error=0.05, still_tolerance=0.01, level_tolerance=5.0, config=None):
+        MicroServerComs.__init__(self, "VerticalKalman", config=config)
+        self.altitude_pub = KalmanAltitude(config)
+        self.climb_rate_pub = KalmanClimbRate(config)
+        self.a_x = None
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.gps_altitude = None
+        self.gps_signal_quality = 0
+        self.last_time = None
+        self.initialized = False
+
+        # Process noise spectral densities: acceleration (ft/s^2) and bias drift (ft/s^2 per root second)
+        self.accel_variance = accel_noise * accel_noise
+        self.bias_variance = bias_noise * bias_noise
+        # Measurement noise variances (feet^2)
+        self.baro_variance = baro_noise * baro_noise
+        self.gps_variance = gps_noise * gps_noise
+        self.confidence_multiplier = conf_mult
+        self.one_g = one_g
+        self.calibration_samples = calibration_samples
+        self.max_scale_error = max_scale_error
+        self.still_tolerance = still_tolerance
+        self.level_tolerance = level_tolerance
+        self.calibrating = calibration_samples > 0
+        self._g_samples = list()
+
+        # State: altitude, vertical speed, accelerometer bias
+        self.h = 0.0
+        self.v = 0.0
+        self.b = 0.0
+        # Covariance, row major
+        self.P = [0.0] * 9
+
+    def updated(self, channel):
+        if channel == 'accelerometers':
+            if self.calibrating:
+                self.calibrate()
+            if not self.initialized:
+                return
+            tm = self.accelerometers_updated
+            if self.last_time is None:
+                self.last_time = tm
+                return
+            dt = tm - self.last_time
+            if dt <= 0:
+                return
+            self.last_time = tm
+            self.predict (dt, self.vertical_acceleration())
+            self.publish_state (tm)
+        elif channel == 'AltitudeComputed':
+            if not self.initialized:
+                self.start (self.altitude_computed, self.AltitudeComputed_updated)
+            else:
+                self.correct (self.altitude_computed, self.baro_variance)
+        elif channel == 'gpsfeed':
+            if self.initialized and self.gps_signal_quality > 0 and self.gps_altitude is not None:
+                self.correct (self.gps_altitude, self.gps_variance)
+
+    def start(self, altitude, tm):
+        self.h = altitude
+        self.v = 0.0
+        self.b = 0.0
+        P = self.P
+        for i in range(9):
+            P[i] = 0.0
+        P[0] = self.baro_variance
+        P[4] = 100.0            # (10 ft/s)^2
+        P[8] = 1.0              # (1 ft/s^2)^2
+        self.last_time = tm
+        self.initialized = True
+
+    def calibrate(self):
+        # Windows of calibration_samples, until one is level, still and near one_g
+        if abs(self.pitch) > self.level_tolerance or abs(self.roll) > self.level_tolerance:
+            self._g_samples = list()
+            return
+        samples = self._g_samples
+        samples.append (math.sqrt(self.a_x * self.a_x + self.a_y * self.a_y + self.a_z * self.a_z))
+        if len(samples) < self.calibration_samples:
+            return
+        self._g_samples = list()
+        n = len(samples)
+        g = sum(samples) / n
+        spread = math.sqrt(sum([(x - g) * (x - g) for x in samples]) / n)
+        if spread > self.still_tolerance * g:
+            return
+        if abs(g / self.one_g - 1.0) > self.max_scale_error:
+            return
+        self.one_g = g
+        self.calibrating = False
+
+    def checkpoint_restored(self):
+        # The filter resumes with the next accelerometer sample, with the saved one_g
+        self.initialized = True
+        self.calibrating = False
+        self.last_time = None
+
+    def vertical_acceleration(self):
+        # Specific force along earth up, minus gravity, in feet / second^2
+        if self.a_x is None:
+            return 0.0
+        pitch = self.pitch * util.RAD_DEG
+        roll = self.roll * util.RAD_DEG
+        cp = math.cos(pitch)
+        up = -self.a_x * cp * math.sin(roll) + self.a_y * math.sin(pitch) + \
+              self.a_z * cp * math.cos(roll)
+        return (up / self.one_g - 1.0) * G_FEET_PER_SEC
+
+    def predict(self, dt, accel):
+        # x = F x + B u, with F = [[1, dt, -dt^2/2], [0, 1, -dt], [0, 0, 1]]
+        hdt2 = 0.5 * dt * dt
+        a = accel - self.b
+        self.h += self.v * dt + a * hdt2
+        self.v += a * dt
+
+        # P = F P F' + Q, written out for this F
+        P = self.P
+        p00,p01,p02,p10,p11,p12,p20,p21,p22 = P
+        # F P
+        f00 = p00 + dt * p10 - hdt2 * p20
+        f01 = p01 + dt * p11 - hdt2 * p21
+        f02 = p02 + dt * p12 - hdt2 * p22
+        f10 = p10 - dt * p20
+        f11 = p11 - dt * p21
+        f12 = p12 - dt * p22
+        # (F P) F'
+        P[0] = f00 + dt * f01 - hdt2 * f02
+        P[1] = f01 - dt * f02
+        P[2] = f02
+        P[3] = f10 + dt * f11 - hdt2 * f12
+        P[4] = f11 - dt * f12
+        P[5] = f12
+        P[6] = p20 + dt * p21 - hdt2 * p22
+        P[7] = p21 - dt * p22
+        P[8] = p22
+        # Continuous white acceleration noise, and a random walk bias
+        q = self.accel_variance
+        P[0] += q * dt * dt * dt / 3.0
+        P[1] += q * hdt2
+        P[3] += q * hdt2
+        P[4] += q * dt
+        P[8] += self.bias_variance * dt
+
+    def correct(self, altitude, variance):
+        # H = [1, 0, 0]
+        P = self.P
+        s = P[0] + variance
+        k0 = P[0] / s
+        k1 = P[3] / s
+        k2 = P[6] / s
+        innovation = altitude - self.h
+        self.h += k0 * innovation
+        self.v += k1 * innovation
+        self.b += k2 * innovation
+        # P = (I - K H) P
+        p00,p01,p02 = P[0], P[1], P[2]
+        P[0] -= k0 * p00
+        P[1] -= k0 * p01
+        P[2] -= k0 * p02
+        P[3] -= k1 * p00
+        P[4] -= k1 * p01
+        P[5] -= k1 * p02
+        P[6] -= k2 * p00
+        P[7] -= k2 * p01
+        P[8] -= k2 * p02
+
+    def publish_state(self, tm):
+        alt = self.altitude_pub
+        alt.timestamp = tm
+        alt.altitude = int(round(self.h))
+        alt.altitude_confidence = 10.0 - math.sqrt(self.P[0]) * self.confidence_multiplier
+        alt.publish ()
+        climb = self.climb_rate_pub
+        climb.timestamp = tm
+        climb.climb_rate = int(round(self.v * 60.0))
+        climb.climb_rate_confidence = 10.0 - math.sqrt(self.P[4]) * 60.0 * self.confidence_multiplier
+        climb.publish ()
+        self.save_checkpoint ()
+
+# Publishers only. They stand in for the Altitude and ClimbRate services, so
+# they also receive those services' internal inputs, which are ignored.
+class KalmanAltitude(MicroServerComs):
+    def __init__(self, config=None):
+        MicroServerComs.__init__(self, "KalmanAltitude", channel='Altitude', config=config)
+
+    def updated(self, channel):
+        pass
+
+class KalmanClimbRate(MicroServerComs):
+    def __init__(self, config=None):
+        MicroServerComs.__init__(self, "KalmanClimbRate", channel='ClimbRate', config=config)
+
+    def updated(self, channel):
+        pass
+
+
+if __name__ == "__main__":
+    vk = VerticalKalman()
+    vk.listen()
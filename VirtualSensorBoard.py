@@ -0,0 +1,262 @@
+# Copyright (C) 2018  Garrett Herschleb
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Emulates the Arduino sense/control board (ArduinoSensors.ino) on a pseudo
+# terminal, so SenseControlRemote.py can be run and benchmarked without the
+# physical Arduino Mega and 10DOF board.
+
+import os, sys, time, math, random, select, errno
+import pty, tty
+import argparse, logging
+
+from ArduinoCmdMessenger import ArduinoCmdMessenger
+from SenseControlRemote import arduino_messages
+
+logger=logging.getLogger(__name__)
+
+ACK = arduino_messages.index('ack')
+NACK = arduino_messages.index('nack')
+SENSOR_READING = arduino_messages.index('sensor_reading')
+
+# Functions the board can stream, as set up by setup_i2c_sensor / setup_serial_sensor
+SENSOR_FUNCTIONS = 'armptg'
+
+class VirtualSensorBoard:
+    def __init__(self, rates=None, bit_error_rate=0.0, crc_nack_rate=0.0,
+                 trace=None, replay_rate=100.0, seed=None):
+        # rates: function letter -> samples per second. Overrides the polling period
+        #        the host asks for in its setup command.
+        # bit_error_rate: probability that any one transmitted bit is flipped
+        # crc_nack_rate: probability that a host command is answered with a crc nack
+        # trace: raw byte capture of a board's serial output to replay instead of
+        #        generating readings. replay_rate is in frames per second.
+        self.rates = rates if rates is not None else dict()
+        self.bit_error_rate = bit_error_rate
+        self.crc_nack_rate = crc_nack_rate
+        self.replay_rate = replay_rate
+        self._random = random.Random(seed)
+        self._messenger = ArduinoCmdMessenger(arduino_messages)
+        self._receive_buffer = ''
+        self._channels = dict()       # channel -> [function, period, next_time]
+        self._replay_frames = None
+        self._replay_index = 0
+        self._next_replay = 0
+        self._gps_toggle = False
+        self.sent_count = 0
+        if trace is not None:
+            self.load_trace(trace)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._start = time.time()
+
+    def load_trace(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read().decode('utf-8', errors='ignore')
+        frames = list()
+        while True:
+            eoc = self._messenger.command_delim_found(data)
+            if eoc < 0:
+                break
+            frames.append(data[:eoc].encode('ascii', errors='ignore'))
+            data = data[eoc:]
+        if len(frames) == 0:
+            raise RuntimeError ("No command frames found in trace %s"%filename)
+        self._replay_frames = frames
+
+    def millis(self):
+        return int((time.time() - self._start) * 1000) & 0xffffffff
+
+    def run(self, duration=None, sent_counter=None):
+        endtime = None if duration is None else time.time() + duration
+        while endtime is None or time.time() < endtime:
+            r,w,x = select.select ([self.master], [], [], 0.001)
+            if r:
+                self.receive()
+            self.stream(time.time())
+            if sent_counter is not None:
+                sent_counter.value = self.sent_count
+
+    def receive(self):
+        try:
+            data = os.read(self.master, 4096)
+        except OSError as e:
+            if e.errno == errno.EIO:        # Host closed the port
+                return
+            raise
+        self._receive_buffer += data.decode('utf-8', errors='ignore')
+        while True:
+            eoc = self._messenger.command_delim_found(self._receive_buffer)
+            if eoc < 0:
+                break
+            frame = self._receive_buffer[:eoc]
+            self._receive_buffer = self._receive_buffer[eoc:]
+            self.command_received(frame)
+
+    def command_received(self, frame):
+        body = frame[:frame.rindex(self._messenger.arg_delim)+1] \
+                if self._messenger.arg_delim in frame else frame
+        crc = frame[len(body):-1]
+        if crc != self._messenger.crc(body) or self._random.random() < self.crc_nack_rate:
+            self.send(NACK, ['crc'])
+            return
+        cmd,args = self._messenger.parse_recv(body)
+        if cmd.startswith('setup_'):
+            chan = args[0]
+            if cmd == 'setup_i2c_sensor' or cmd == 'setup_spi_sensor':
+                function,period = args[1],args[2]
+            elif cmd == 'setup_serial_sensor':
+                function,period = args[1],1000
+            else:
+                function,period = None,None     # Generic digital/analog inputs are not emulated
+            if function in SENSOR_FUNCTIONS:
+                if function in self.rates:
+                    period = 1.0 / self.rates[function]
+                else:
+                    period = float(period) / 1000.0
+                self._channels[chan] = [function, period, time.time() + period]
+            self.send(ACK, [])
+        elif cmd.startswith('set_'):
+            self.send(ACK, [])
+        else:
+            self.send(NACK, ['Unknown Command'])
+
+    def stream(self, now):
+        out = list()
+        if self._replay_frames is not None:
+            if self._next_replay == 0:
+                self._next_replay = now
+            while self._next_replay <= now:
+                out.append(self._replay_frames[self._replay_index])
+                self._replay_index = (self._replay_index + 1) % len(self._replay_frames)
+                self._next_replay += 1.0 / self.replay_rate
+        else:
+            for chan,ch in self._channels.items():
+                function,period,next_time = ch
+                while next_time <= now:
+                    out.append(self.format_reading(chan, function))
+                    next_time += period
+                ch[2] = next_time
+        if out:
+            self.write(b''.join(out))
+            self.sent_count += len(out)
+
+    def format_reading(self, chan, function):
+        ms = self.millis()
+        noise = self._random.gauss
+        if function == 'a':
+            args = [chan, noise(0.0, .05), noise(0.0, .05), noise(9.8, .05), ms, 1, 0, 0]
+        elif function == 'r':
+            args = [chan, noise(0.0, .1), noise(0.0, .1), noise(0.0, .1), ms, 1, 0, 0]
+        elif function == 'm':
+            args = [chan, noise(20.0, .5), noise(40.0, .5), noise(-30.0, .5), ms, 1, 0, 0]
+        elif function == 'p':
+            args = [chan, noise(101325.0, 5.0), 0.0, ms, 1, 0, 0]
+        elif function == 't':
+            args = [chan, noise(15.0, .1), 1, 0, 0]
+        else:
+            args = [chan, self.nmea_sentence(), ms]
+        return self.format_frame(SENSOR_READING, args)
+
+    def nmea_sentence(self):
+        # Alternate GGA (position) and RMC (ground vector) like a real receiver
+        tm = time.gmtime()
+        utc = '%02d%02d%02d.00'%(tm.tm_hour, tm.tm_min, tm.tm_sec)
+        self._gps_toggle = not self._gps_toggle
+        if self._gps_toggle:
+            body = 'GPGGA,%s,4740.000,N,12220.000,W,1,08,0.9,100.0,M,0.0,M,,'%utc
+        else:
+            body = 'GPRMC,%s,A,4740.000,N,12220.000,W,000.0,000.0,010118,015.0,E'%utc
+        checksum = 0
+        for c in body:
+            checksum ^= ord(c)
+        return '$%s*%02X'%(body, checksum)
+
+    def format_frame(self, cmd, args):
+        d = self._messenger.arg_delim
+        s = str(cmd)
+        for a in args:
+            if isinstance(a, float):
+                s += d + '%.4f'%a
+            else:
+                s += d + str(a)
+        return (s + self._messenger.command_delim).encode('ascii')
+
+    def send(self, cmd, args):
+        self.write(self.format_frame(cmd, args))
+
+    def write(self, data):
+        if self.bit_error_rate > 0.0:
+            data = self.inject_bit_errors(data)
+        while len(data) > 0:
+            try:
+                n = os.write(self.master, data)
+            except OSError as e:
+                if e.errno == errno.EIO:        # Host closed the port
+                    return
+                raise
+            data = data[n:]
+
+    def error_gap(self):
+        # Number of good bits before the next flipped one (geometric distribution)
+        if self.bit_error_rate >= 1.0:
+            return 0
+        return int(math.log(1.0 - self._random.random()) / math.log(1.0 - self.bit_error_rate))
+
+    def inject_bit_errors(self, data):
+        nbits = len(data) * 8
+        bit = self.error_gap()
+        if bit >= nbits:
+            return data
+        data = bytearray(data)
+        while bit < nbits:
+            data[bit >> 3] ^= (1 << (bit & 7))
+            bit += 1 + self.error_gap()
+        return bytes(data)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+def parse_rates(rate_args):
+    rates = dict()
+    if rate_args:
+        for r in rate_args:
+            function,hz = r.split('=')
+            if not function in SENSOR_FUNCTIONS:
+                raise RuntimeError ("Unknown sensor function %s (one of %s)"%(function, SENSOR_FUNCTIONS))
+            rates[function] = float(hz)
+    return rates
+
+if __name__ == "__main__":
+    opt = argparse.ArgumentParser(description='Virtual sense/control board on a pseudo terminal')
+    opt.add_argument('-r', '--rate', action='append', default=None,
+            help="Samples per second for a sensor function, e.g. 'r=200'. May be repeated")
+    opt.add_argument('-b', '--bit-error-rate', type=float, default=0.0, help='Probability of flipping each transmitted bit')
+    opt.add_argument('-n', '--crc-nack-rate', type=float, default=0.0, help='Probability of answering a command with a crc nack')
+    opt.add_argument('-t', '--trace', default=None, help='Raw serial capture to replay instead of generated readings')
+    opt.add_argument('--replay-rate', type=float, default=100.0, help='Frames per second when replaying a trace')
+    opt.add_argument('-s', '--seed', type=int, default=None, help='Random seed for noise and error injection')
+    args = opt.parse_args()
+
+    board = VirtualSensorBoard(parse_rates(args.rate), args.bit_error_rate, args.crc_nack_rate,
+            args.trace, args.replay_rate, args.seed)
+    print ("Virtual sensor board on %s"%board.port)
+    sys.stdout.flush()
+    try:
+        board.run()
+    except KeyboardInterrupt:
+        pass
+    board.close()
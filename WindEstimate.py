@@ -1,16 +1,23 @@
 
 import Common.util as util
 from Common.Spatial import Polar
+from Common.WindsAloft import WindsAloftIndex
 
 from MicroServerComs import MicroServerComs
 
 class WindEstimate(MicroServerComs):
+    checkpoint_values = ['wind_heading', 'wind_speed']
+    checkpoint_format = 'ii'
+
     def __init__(self):
         MicroServerComs.__init__(self, "WindEstimate")
         self.airspeed_is_estimated = False
-        self.winds_aloft_reports = dict()
+        self.winds_aloft_reports = WindsAloftIndex()
+        self.gps_lat = None
+        self.gps_lng = None
         self.gps_ground_track = None
         self.gps_ground_speed = None
+        self.altitude = None
         self.airspeed = None
         self.true_airspeed = None
         self.cas2tas = None
@@ -22,23 +29,10 @@ class WindEstimate(MicroServerComs):
     def updated(self, channel):
         update = False
         if channel == 'windsaloftreport':
-            position=(round(self.wa_lat,2),round(self.wa_lng,2))
-            if position in self.winds_aloft_reports:
-                if self.wa_altitude in self.winds_aloft_reports[position]:
-                    self.winds_aloft_reports[position][self.wa_altitude][self.wa_time] = ( \
-                            self.wa_heading,self.wa_speed)
-                    # TODO: trim out old reports
-                else:
-                    self.winds_aloft_reports[position][self.wa_altitude] = {
-                            self.wa_time: (self.wa_heading,self.wa_speed)}
-            else:
-                self.winds_aloft_reports[position] = {
-                        self.wa_altitude: {self.wa_time: (self.wa_heading,self.wa_speed)}}
+            self.winds_aloft_reports.add (self.wa_lat, self.wa_lng, self.wa_altitude,
+                    self.wa_time, self.wa_heading, self.wa_speed)
             if self.airspeed_is_estimated:
-                # TODO: Create wind estimate from reports
-                self.wind_heading = self.wa_heading
-                self.wind_speed = self.wa_speed
-                self.publish()  # Publish the last reported for now
+                self.estimate_from_reports()
         elif channel == 'Airspeed':
             if self.cas2tas is not None:
                 self.true_airspeed = self.airspeed * self.cas2tas
@@ -64,9 +58,28 @@ class WindEstimate(MicroServerComs):
                 self.wind_heading += 360
             self.publish ()
             print ("WindEstimate: %d at %d degrees"%(self.wind_speed, self.wind_heading))
+        elif channel == 'GroundVector' and self.airspeed_is_estimated:
+            self.estimate_from_reports()
+
+    def estimate_from_reports(self):
+        # Without a measured airspeed the wind comes from nearby reports
+        if self.gps_lat is None or self.altitude is None:
+            if self.winds_aloft_reports.newest is None:
+                return
+            # No position yet. Use the latest report as is.
+            self.wind_heading = self.wa_heading
+            self.wind_speed = self.wa_speed
         else:
-            # TODO: estimate wind from aloft reports
-            pass
+            estimate = self.winds_aloft_reports.estimate (self.gps_lat, self.gps_lng,
+                    self.altitude, self.gps_utc)
+            if estimate is None:
+                return
+            heading,speed,weight = estimate
+            self.wind_heading = int(round(heading)) % 360
+            self.wind_speed = int(round(speed))
+        self.publish ()
+        print ("WindEstimate: %d at %d degrees from %d reports"%(self.wind_speed,
+                self.wind_heading, len(self.winds_aloft_reports)))
 
 
 if __name__ == "__main__":
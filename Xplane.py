@@ -13,7 +13,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import socket, struct, logging, time
+import socket, struct, logging, array
+
+import Common.Clock as Clock
 
 control = None
 
@@ -23,12 +25,18 @@ SECONDS_HOUR = 3600.0
 NM_METER = .00053996
 FEET_METER = 1.0/.3048
 
+# Control outputs are staged as they are set during a control cycle and sent
+# together by Flush() at the end of it. A value within deadband of the one
+# last sent is not sent again, except every refresh seconds. A send that
+# fails is left staged for the next Flush().
 class XplaneControl:
-    def __init__(self, localportno, xplane_host, xplane_port):
+    def __init__(self, localportno, xplane_host, xplane_port, deadband=0.001, refresh=1.0):
         global control
         self.localport = localportno
         self.xplane_host = xplane_host
         self.xplane_port = xplane_port
+        self.deadband = deadband
+        self.refresh = refresh
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind (("", localportno))
         self.sock.setblocking (0)
@@ -52,6 +60,25 @@ class XplaneControl:
         self.data_struct_body = struct.Struct("iffffffff")
         self.throttle_index = 26
 
+        # Prebuilt datagrams; only the values are packed into them when sending
+        self.dref_value_struct = struct.Struct("f")
+        self._dref_packets = [bytearray(self.dref_struct_preamble + self.dref_struct_body.pack(0.0, dataref))
+                              for dataref,name,channel_range in self.controls]
+        self.throttle_count = 6
+        self.throttle_struct = struct.Struct("%df"%self.throttle_count)
+        self._throttle_packet = bytearray(self.data_struct_preamble + self.data_struct_body.pack(
+                                          self.throttle_index, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+        self._value_offset = len(self.dref_struct_preamble)
+        self._throttle_offset = len(self.data_struct_preamble) + 4
+
+        # Staged, and last sent values with the time they were sent, per channel.
+        # The throttles are one more channel after the controls.
+        self._throttle_channel = len(self.controls)
+        self._staged = [None] * (self._throttle_channel + 1)
+        self._sent = [None] * (self._throttle_channel + 1)
+        self._sent_time = [0.0] * (self._throttle_channel + 1)
+        self.send_errors = 0
+
         override_joystick = self.dref_struct_preamble + self.dref_struct_body.pack(1.0, b"sim/operation/override/override_joystick")
         self.sock.sendto (override_joystick, (self.xplane_host, self.xplane_port))
 
@@ -89,208 +116,256 @@ class XplaneControl:
         return (mn,mx)
 
     def SetAnalogChannel(self, channel, val):
-        for retry in range(5):
-            if channel < 0 or channel >= len(self.controls):
-                raise RuntimeError ("Invalid channel set (%d)"%channel)
-            channel_range = self.controls[channel][2]
+        if channel < 0 or channel >= len(self.controls):
+            raise RuntimeError ("Invalid channel set (%d)"%channel)
+        channel_range = self.controls[channel][2]
+        if channel_range[0] == 0.0:
+            scaled_value = val
+        else:
             channel_range_size = abs(channel_range[1] - channel_range[0])
-            if self.controls[channel][2][0] == 0.0:
-                scaled_value = val
-            else:
-                scaled_value = (val - self.ServoRange[0]) * channel_range_size / self.servo_range_size + channel_range[0]
-            logger.log (3, "Setting channel %s to %g (%g)", self.controls[channel][1], val, scaled_value)
-            #print ("Setting channel %s = %g (%g)"%(self.controls[channel][1], val, scaled_value))
-            try:
-                cmd = self.dref_struct_preamble + self.dref_struct_body.pack(scaled_value, self.controls[channel][0])
-                control.sock.sendto(cmd, (self.xplane_host, self.xplane_port))
-                break
-            except:
-                time.sleep(.01)
+            scaled_value = (val - self.ServoRange[0]) * channel_range_size / self.servo_range_size + channel_range[0]
+        logger.log (3, "Setting channel %s to %g (%g)", self.controls[channel][1], val, scaled_value)
+        self._staged[channel] = scaled_value
 
     def SetDigitalChannel(self, channel, val):
-        for retry in range(5):
-            if channel < 0 or channel >= len(self.controls):
-                raise RuntimeError ("Invalid channel set (%d)"%channel)
-            logger.log (3, "Setting digital channel %s to %g", self.controls[channel][1], val)
-            #print ("Setting channel %s = %g (%g)"%(self.controls[channel][1], val, scaled_value))
-            try:
-                cmd = self.dref_struct_preamble + self.dref_struct_body.pack(val, self.controls[channel][0])
-                control.sock.sendto(cmd, (self.xplane_host, self.xplane_port))
-                break
-            except:
-                time.sleep(.01)
+        if channel < 0 or channel >= len(self.controls):
+            raise RuntimeError ("Invalid channel set (%d)"%channel)
+        logger.log (3, "Setting digital channel %s to %g", self.controls[channel][1], val)
+        self._staged[channel] = val
 
     def SetThrottles(self, throttles):
-        cmd = self.data_struct_preamble + self.data_struct_body.pack(self.throttle_index,
-                throttles[0],
-                throttles[1],
-                throttles[2],
-                throttles[3],
-                throttles[4],
-                throttles[5],
-                0.0, 0.0)
-        logger.log (3, "Setting throttles to %g,%g,%g,%g  %g,%g", throttles[0],
-                throttles[1],
-                throttles[2],
-                throttles[3],
-                throttles[4],
-                throttles[5],
-                )
-        control.sock.sendto(cmd, (self.xplane_host, self.xplane_port))
+        throttles = tuple(throttles[:self.throttle_count])
+        logger.log (3, "Setting throttles to %g,%g,%g,%g  %g,%g", *throttles)
+        self._staged[self._throttle_channel] = throttles
+
+    def _changed(self, channel, val, now):
+        last = self._sent[channel]
+        if last is None or now - self._sent_time[channel] >= self.refresh:
+            return True
+        if channel == self._throttle_channel:
+            return any(abs(v - l) > self.deadband for v,l in zip(val, last))
+        return abs(val - last) > self.deadband
+
+    def Flush(self):
+        now = Clock.time()
+        address = (self.xplane_host, self.xplane_port)
+        staged = self._staged
+        for channel,val in enumerate(staged):
+            if val is None:
+                continue
+            if not self._changed(channel, val, now):
+                staged[channel] = None
+                continue
+            if channel == self._throttle_channel:
+                packet = self._throttle_packet
+                self.throttle_struct.pack_into (packet, self._throttle_offset, *val)
+            else:
+                packet = self._dref_packets[channel]
+                self.dref_value_struct.pack_into (packet, self._value_offset, val)
+            try:
+                self.sock.sendto (packet, address)
+            except OSError:
+                self.send_errors += 1
+                continue
+            staged[channel] = None
+            self._sent[channel] = val
+            self._sent_time[channel] = now
 
     def initialize(self, filelines):
         self.servo_range_size = self.ServoRange[1] - self.ServoRange[0]
         return
 
+# Slots of the sensor snapshot, in XplaneSensors.values. Each is also the
+# RREF index its dataref is requested under.
+ALTITUDE = 0
+HEADING = 1
+ROLL = 2
+ROLL_RATE = 3
+PITCH = 4
+PITCH_RATE = 5
+YAW = 6
+AIRSPEED = 7
+GROUND_SPEED = 8
+CLIMB_RATE = 9
+LONGITUDE = 10
+LATITUDE = 11
+MAGNETIC_DECLINATION = 12
+TRUE_HEADING = 13
+SIM_TIME = 14
+GROUND_TRACK = 15
+WIND_SPEED = 16
+WIND_DIRECTION = 17
+AGL = 18
+ENGINE_FAIL0 = 19
+ENGINE_FAIL_COUNT = 6
+
+SENSOR_SUITE = [("Altitude", b"sim/flightmodel/misc/h_ind"),
+        ("Heading", b"sim/flightmodel/position/mag_psi"),
+        ("Roll", b"sim/flightmodel/position/true_phi"),
+        ("RollRate", b"sim/flightmodel/position/P"),
+        ("Pitch", b"sim/flightmodel/position/true_theta"),
+        ("PitchRate", b"sim/flightmodel/position/Q"),
+        ("Yaw", b"sim/cockpit2/gauges/indicators/slip_deg"),
+        ("AirSpeed", b"sim/flightmodel/position/indicated_airspeed"),
+        ("GroundSpeed", b"sim/flightmodel/position/groundspeed"),
+        ("ClimbRate", b"sim/flightmodel/position/vh_ind_fpm"),
+        ("Longitude", b"sim/flightmodel/position/longitude"),
+        ("Latitude", b"sim/flightmodel/position/latitude"),
+        ("MagneticDeclination", b"sim/flightmodel/position/magnetic_variation"),
+        ("TrueHeading", b"sim/flightmodel/position/true_psi"),
+        ("SimTime", b"sim/time/total_running_time_sec"),
+        ("GroundTrack", b"sim/flightmodel/position/hpath"),
+        ("WindSpeed", b"sim/weather/wind_speed_kt[0]"),
+        ("WindDirection", b"sim/weather/wind_direction_degt[0]"),
+        ("AGL", b"sim/flightmodel/position/y_agl"),
+        ("EngineFail0", b"sim/operation/failures/rel_engfai0"),
+        ("EngineFail1", b"sim/operation/failures/rel_engfai1"),
+        ("EngineFail2", b"sim/operation/failures/rel_engfai2"),
+        ("EngineFail3", b"sim/operation/failures/rel_engfai3"),
+        ("EngineFail4", b"sim/operation/failures/rel_engfai4"),
+        ("EngineFail5", b"sim/operation/failures/rel_engfai5"),
+        ]
+
+SENSOR_INDEX = dict((name, i) for i,(name,dataref) in enumerate(SENSOR_SUITE))
+
+# Largest datagram X-Plane sends back
+RECV_SIZE = 4096
+
+# A fresh reading of this dataref marks a new attitude frame
+FRAME_SLOT = ROLL
+
+# The sensors are read once per control cycle: Poll() takes in everything
+# X-Plane has sent since the last cycle, and the accessors return what that
+# left in the snapshot.
+#
+# Each dataref is requested at rate times per second, unless rates, a dict of
+# sensor name to rate, gives it its own. For example the attitude at 50 and
+# the position at 5:
+#   Xplane.XplaneSensors(rates={"Roll":50, "Pitch":50, "Longitude":5, "Latitude":5})
 class XplaneSensors:
-    def __init__(self):
-        self.sensor_suite = [(0, "Altitude", b"sim/flightmodel/misc/h_ind"),
-                (0, "Heading", b"sim/flightmodel/position/mag_psi"),
-                (0, "Roll", b"sim/flightmodel/position/true_phi"),
-                (0, "RollRate", b"sim/flightmodel/position/P"),
-                (0, "Pitch", b"sim/flightmodel/position/true_theta"),
-                (0, "PitchRate", b"sim/flightmodel/position/Q"),
-                (0, "Yaw", b"sim/cockpit2/gauges/indicators/slip_deg"),
-                (0, "AirSpeed", b"sim/flightmodel/position/indicated_airspeed"),
-                (0, "GroundSpeed", b"sim/flightmodel/position/groundspeed"),
-                (0, "ClimbRate", b"sim/flightmodel/position/vh_ind_fpm"),
-                (0, "Longitude", b"sim/flightmodel/position/longitude"),
-                (0, "Latitude", b"sim/flightmodel/position/latitude"),
-                (0, "MagneticDeclination", b"sim/flightmodel/position/magnetic_variation"),
-                (0, "TrueHeading", b"sim/flightmodel/position/true_psi"),
-                (0, "SimTime", b"sim/time/total_running_time_sec"),
-                (0, "GroundTrack", b"sim/flightmodel/position/hpath"),
-                (0, "WindSpeed", b"sim/weather/wind_speed_kt[0]"),
-                (0, "WindDirection", b"sim/weather/wind_direction_degt[0]"),
-                (0, "AGL", b"sim/flightmodel/position/y_agl"),
-                (0, "EngineFail0", b"sim/operation/failures/rel_engfai0"),
-                (0, "EngineFail1", b"sim/operation/failures/rel_engfai1"),
-                (0, "EngineFail2", b"sim/operation/failures/rel_engfai2"),
-                (0, "EngineFail3", b"sim/operation/failures/rel_engfai3"),
-                (0, "EngineFail4", b"sim/operation/failures/rel_engfai4"),
-                (0, "EngineFail5", b"sim/operation/failures/rel_engfai5"),
-                ]
-        self.previous_readings = [s[0] for s in self.sensor_suite]
+    def __init__(self, rate=10, rates=None):
+        self.rates = [rate] * len(SENSOR_SUITE)
+        if rates:
+            for name,r in rates.items():
+                if name not in SENSOR_INDEX:
+                    raise RuntimeError ("Unknown X-Plane sensor %s"%name)
+                self.rates[SENSOR_INDEX[name]] = r
+        self.values = array.array('d', [0.0] * len(SENSOR_SUITE))
+        self.previous_readings = array.array('d', [0.0] * len(SENSOR_SUITE))
+        self._buffer = bytearray(RECV_SIZE)
+        self._view = memoryview(self._buffer)
         self._history_count = 0
-        self.SamplesPerSecond = 10
+        self._fresh = False
         self.dref_rcv_struct = struct.Struct("If")
         self.preamble_struct = struct.Struct("5s")
         self.dref_request_struct = struct.Struct("II400s")
         self.data_struct_body = struct.Struct("iffffffff")
 
 
-    def initialize(self, filelines):
+    # X-Plane knows the altitude, barometer and winds itself
+    def initialize(self, known_altitude=None, given_barometer=None, winds=None):
         global control
-        dref_num = 0
         pre = self.preamble_struct.pack (b"RREF")
-        for d in self.sensor_suite:
-            req = self.dref_request_struct.pack(self.SamplesPerSecond, dref_num, d[2])
+        for dref_num,(name,dataref) in enumerate(SENSOR_SUITE):
+            req = self.dref_request_struct.pack(self.rates[dref_num], dref_num, dataref)
             control.sock.sendto(pre + req, (control.xplane_host, control.xplane_port))
-            dref_num += 1
 
-        time.sleep(.5)
-        self.ProcessIncoming()
+        Clock.sleep(.5)
+        self.Poll()
         return
 
+    def WaitSensorsGreen(self):
+        while not self._history_count:
+            self.WaitFrame (1.0)
+
+    def Poll(self):
+        self._receive()
+        self._fresh = False
+
+    # Waits until an attitude frame arrives that the last Poll() did not take in,
+    # or timeout seconds pass. Returns whether one arrived.
+    def WaitFrame(self, timeout):
+        global control
+        end = Clock.time() + timeout
+        while not self._fresh:
+            remaining = end - Clock.time()
+            if remaining <= 0:
+                return False
+            if Clock.select([control.sock], remaining):
+                self._receive()
+        return True
+
+    def _receive(self):
+        global control
+        sock = control.sock
+        view = self._view
+        while True:
+            try:
+                n = sock.recv_into(self._buffer)
+            except OSError:
+                break
+            self._parse_input(view[:n])
+
     def Altitude(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[0][1] == "Altitude")
-        return self.sensor_suite[0][0]
+        return self.values[ALTITUDE]
 
     def Heading(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[1][1] == "Heading")
-        return self.sensor_suite[1][0]
+        return self.values[HEADING]
 
     def Roll(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[2][1] == "Roll")
-        return self.sensor_suite[2][0]
+        return self.values[ROLL]
 
     def RollRate(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[3][1] == "RollRate")
-        return self.sensor_suite[3][0]
+        return self.values[ROLL_RATE]
 
     def Pitch(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[4][1] == "Pitch")
-        return self.sensor_suite[4][0]
+        return self.values[PITCH]
 
     def PitchRate(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[5][1] == "PitchRate")
-        return self.sensor_suite[5][0]
+        return self.values[PITCH_RATE]
 
     def Yaw(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[6][1] == "Yaw")
-        return self.sensor_suite[6][0]
+        return self.values[YAW]
 
     def AirSpeed(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[7][1] == "AirSpeed")
-        return self.sensor_suite[7][0]
+        return self.values[AIRSPEED]
 
     def GroundSpeed(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[8][1] == "GroundSpeed")
-        return self.sensor_suite[8][0] * SECONDS_HOUR * NM_METER
+        return self.values[GROUND_SPEED] * SECONDS_HOUR * NM_METER
 
     def ClimbRate(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[9][1] == "ClimbRate")
-        return self.sensor_suite[9][0]
+        return self.values[CLIMB_RATE]
 
     def Position(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[10][1] == "Longitude")
-        assert(self.sensor_suite[11][1] == "Latitude")
-        return (self.sensor_suite[10][0], self.sensor_suite[11][0])
+        return (self.values[LONGITUDE], self.values[LATITUDE])
 
     def HeadingRateChange(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[1][1] == "Heading")
         if self._history_count < 3:
             return 0
         else:
-            return ((self.sensor_suite[1][0] - self.previous_readings[1]) * self.SamplesPerSecond)
+            return ((self.values[HEADING] - self.previous_readings[HEADING]) * self.rates[HEADING])
 
     def TrueHeading(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[13][1] == "TrueHeading")
-        return self.sensor_suite[13][0]
+        return self.values[TRUE_HEADING]
 
     def MagneticDeclination(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[12][1] == "MagneticDeclination")
-        return self.sensor_suite[12][0]
+        return self.values[MAGNETIC_DECLINATION]
 
     def Time(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[14][1] == "SimTime")
-        return self.sensor_suite[14][0]
+        return self.values[SIM_TIME]
 
     # Actual flight path in true coordinates
     def GroundTrack(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[15][1] == "GroundTrack")
-        return (self.sensor_suite[15][0])
+        return self.values[GROUND_TRACK]
 
     def WindSpeed(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[16][1] == "WindSpeed")
-        return (self.sensor_suite[16][0])
+        return self.values[WIND_SPEED]
 
     def WindDirection(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[17][1] == "WindDirection")
-        return (self.sensor_suite[17][0])
+        return self.values[WIND_DIRECTION]
 
     def AGL(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[18][1] == "AGL")
-        return (self.sensor_suite[18][0] * FEET_METER)
+        return self.values[AGL] * FEET_METER
 
     def GearUpLocked(self):
         return True
@@ -299,57 +374,46 @@ class XplaneSensors:
         return 0.0
 
     def OuterEnginePosition(self):
-        self.ProcessIncoming()
-        assert(self.sensor_suite[19][1] == "EngineFail0")
         ret = 0
-        for i in range(19,25):
-            if self.sensor_suite[i][0] != 0:
+        for v in self.values[ENGINE_FAIL0:ENGINE_FAIL0 + ENGINE_FAIL_COUNT]:
+            if v != 0:
                 ret += 1
         return ret
 
     def Snapshot(self):
         ret = dict()
-        for s in self.sensor_suite:
-            ret[s[1]] = s[0]
+        for (name,dataref),v in zip(SENSOR_SUITE, self.values):
+            ret[name] = v
         return str(ret)
 
-    def ProcessIncoming(self):
-        global control
-        while True:
-            try:
-                rec = control.sock.recv(1024)
-                self._parse_input(rec)
-            except:
-                break
-
     def Battery(self):
         return 100
 
     def EnginesOut(self):
         return 0
 
+    # rec is a memoryview of the receive buffer, only valid until the next read
     def _parse_input(self, rec):
-        DREF_SIZE=8
-        assert(self.dref_rcv_struct.size == DREF_SIZE)
         header = rec[:4]
-        if header  == "RREF" or header == b"RREF":
-            rec = rec[5:]
-            for index in range(0,len(rec),DREF_SIZE):
-                parse = rec[index:index+DREF_SIZE]
-                index,val = self.dref_rcv_struct.unpack(parse)
-                if index < len(self.sensor_suite):
-                    self.previous_readings[index] = self.sensor_suite[index][0]
-                    ss = self.sensor_suite[index]
-                    self.sensor_suite[index] = (val, ss[1], ss[2])
-                    logger.log (2, "Xplane reading[%s] = %g", self.sensor_suite[index][1], val)
-                    #print ("Xplane reading[%s] = %g"%(self.sensor_suite[index][1], val))
+        if header == b"RREF":
+            values = self.values
+            previous = self.previous_readings
+            count = len(values)
+            body = rec[5:]
+            body = body[:len(body) - len(body) % self.dref_rcv_struct.size]
+            for index,val in self.dref_rcv_struct.iter_unpack(body):
+                if index < count:
+                    previous[index] = values[index]
+                    values[index] = val
+                    if index == FRAME_SLOT:
+                        self._fresh = True
                 else:
                     logger.warning("Got input from X-Plane in index %d", index)
             self._history_count += 1
-        elif header == "DATA" or header == b"DATA":
-            rec = rec[5:]
-            index,v1,v2,v3,v4,v5,v6,v7,v8 = self.data_struct_body.unpack(rec)
-            print ("DATA[%d]: %g, %g, %g, %g,    %g, %g, %g, %g"%(index, v1, v2,v3,v4,v5,v6,v7))
+            logger.log (2, "Xplane readings %s", values)
+        elif header == b"DATA":
+            index,v1,v2,v3,v4,v5,v6,v7,v8 = self.data_struct_body.unpack_from(rec, 5)
+            print ("DATA[%d]: %g, %g, %g, %g,    %g, %g, %g, %g"%(index, v1, v2,v3,v4,v5,v6,v7,v8))
 
     def KnownAltitude(self, alt):
         pass
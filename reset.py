@@ -3,3 +3,4 @@ import Xplane
 
 cont = Xplane.XplaneControl(48000, "192.168.0.101", 49000)
 cont.SetThrottles ([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+cont.Flush()